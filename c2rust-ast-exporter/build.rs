@@ -79,6 +79,8 @@ fn generate_bindings() -> Result<(), &'static str> {
         .rustified_enum("TypeTag")
         .rustified_enum("StringTypeTag")
         .rustified_enum("BuiltinVaListKind")
+        .rustified_enum("ExportFormatVersion")
+        .rustified_enum("CborExportTag")
         // Tell bindgen we are processing c++
         .clang_arg("-xc++")
         // Finish the builder and generate the bindings.
@@ -53,8 +53,50 @@ using clang::QualType;
 using std::string;
 
 namespace {
+// Strings that are emitted at most once per translation unit when exporting
+// format version 2. Each string is referenced by its index in the table.
+class StringTable {
+    std::unordered_map<std::string, uint64_t> indices;
+    std::vector<const std::string *> strings;
+
+  public:
+    // Strings shorter than this are no larger inline than as a reference.
+    static const size_t MinLength = 4;
+
+    // Look up the table index of `str`, adding it if necessary. Returns false
+    // if the string should be emitted inline instead.
+    bool intern(const std::string &str, uint64_t &index) {
+        if (str.size() < MinLength)
+            return false;
+        auto result = indices.emplace(str, strings.size());
+        if (result.second)
+            strings.push_back(&result.first->first);
+        index = result.first->second;
+        return true;
+    }
+
+    void encode(CborEncoder *encoder) const {
+        CborEncoder array;
+        cbor_encoder_create_array(encoder, &array, strings.size());
+        for (auto s : strings) {
+            cbor_encode_text_string(&array, s->data(), s->size());
+        }
+        cbor_encoder_close_container(encoder, &array);
+    }
+};
+
+// String table of the translation unit being exported, if any.
+StringTable *stringTable = nullptr;
+
 // Encode a string object assuming that it is valid UTF-8 encoded text
 void cbor_encode_string(CborEncoder *encoder, const std::string &str) {
+    uint64_t index;
+    if (stringTable && stringTable->intern(str, index)) {
+        cbor_encode_tag(encoder, StringRefTag);
+        cbor_encode_uint(encoder, index);
+        return;
+    }
+
     auto ptr = str.data();
     auto len = str.size();
     cbor_encode_text_string(encoder, ptr, len);
@@ -246,7 +288,7 @@ class TypeEncoder final : public TypeVisitor<TypeEncoder> {
                 break;
             }
             if (tag) {
-                cbor_encode_text_stringz(local, tag);
+                cbor_encode_string(local, tag);
             } else {
                 cbor_encode_null(local);
             }
@@ -946,7 +988,7 @@ class TranslateASTVisitor final
         encode_entry(S, TagAttributedStmt, childIds,
                      [S](CborEncoder *array){
                          for (auto s: S->getAttrs()) {
-                             cbor_encode_text_stringz(array, s->getSpelling());
+                             cbor_encode_string(array, s->getSpelling());
                          }
         });
         return true;
@@ -1001,7 +1043,7 @@ class TranslateASTVisitor final
 
         std::vector<void *> childIds = {LS->getSubStmt()};
         encode_entry(LS, TagLabelStmt, childIds, [LS](CborEncoder *array) {
-            cbor_encode_text_stringz(array, LS->getName());
+            cbor_encode_string(array, LS->getName());
         });
         return true;
     }
@@ -1306,16 +1348,16 @@ class TranslateASTVisitor final
             [E, t, qt, this](CborEncoder *extras) {
                 switch (E->getKind()) {
                 case UETT_SizeOf:
-                    cbor_encode_text_stringz(extras, "sizeof");
+                    cbor_encode_string(extras, "sizeof");
                     break;
                 case UETT_AlignOf:
-                    cbor_encode_text_stringz(extras, "alignof");
+                    cbor_encode_string(extras, "alignof");
                     break;
                 case UETT_VecStep:
-                    cbor_encode_text_stringz(extras, "vecstep");
+                    cbor_encode_string(extras, "vecstep");
                     break;
                 case UETT_OpenMPRequiredSimdAlign:
-                    cbor_encode_text_stringz(extras, "openmprequiredsimdalign");
+                    cbor_encode_string(extras, "openmprequiredsimdalign");
                     break;
 #if CLANG_VERSION_MAJOR >= 8
                 case UETT_PreferredAlignOf: {
@@ -1341,9 +1383,9 @@ class TranslateASTVisitor final
                     if (T->isSpecificBuiltinType(BuiltinType::Double) ||
                         T->isSpecificBuiltinType(BuiltinType::LongLong) ||
                         T->isSpecificBuiltinType(BuiltinType::ULongLong))
-                        cbor_encode_text_stringz(extras, "preferredalignof");
+                        cbor_encode_string(extras, "preferredalignof");
                     else
-                        cbor_encode_text_stringz(extras, "alignof");
+                        cbor_encode_string(extras, "alignof");
                     break;
                 }
 #endif // CLANG_VERSION_MAJOR
@@ -1604,7 +1646,7 @@ class TranslateASTVisitor final
                     }
                 }
 
-                cbor_encode_text_stringz(array, cast_name);
+                cbor_encode_string(array, cast_name);
             });
         return true;
     }
@@ -1633,7 +1675,7 @@ class TranslateASTVisitor final
         }
 
         encode_entry(E, TagCStyleCastExpr, childIds, [E](CborEncoder *array) {
-            cbor_encode_text_stringz(array, E->getCastKindName());
+            cbor_encode_string(array, E->getCastKindName());
         });
         return true;
     }
@@ -1885,15 +1927,13 @@ class TranslateASTVisitor final
                     auto attrs = def ? def->getAttrs() : FD->getAttrs();
 
                     for (auto attr : attrs) {
-                        cbor_encode_text_stringz(&attr_info,
-                                                 attr->getSpelling());
+                        cbor_encode_string(&attr_info, attr->getSpelling());
 
                         if (auto *aa = dyn_cast<AliasAttr>(attr)) {
-                            cbor_encode_text_stringz(
-                                &attr_info, aa->getAliasee().str().c_str());
+                            cbor_encode_string(&attr_info, aa->getAliasee().str());
                         } else if (auto *va = dyn_cast<VisibilityAttr>(attr)) {
                             const char *vis = VisibilityAttr::ConvertVisibilityTypeToStr(va->getVisibility());
-                            cbor_encode_text_stringz(&attr_info, vis);
+                            cbor_encode_string(&attr_info, vis);
                         }
                     }
                 }
@@ -1912,7 +1952,7 @@ class TranslateASTVisitor final
         encode_entry_extra(encoder, PVD, TagParmVarDecl, childIds,
                            [PVD](CborEncoder *array){
                                auto name = PVD->getNameAsString();
-                               cbor_encode_text_stringz(array, name.c_str());
+                               cbor_encode_string(array, name);
                            });
         return true;
     }*/
@@ -1995,15 +2035,12 @@ class TranslateASTVisitor final
                     auto attrs = def ? def->getAttrs() : VD->getAttrs();
 
                     for (auto attr : def->attrs()) {
-                        cbor_encode_text_stringz(&attr_info,
-                                                 attr->getSpelling());
+                        cbor_encode_string(&attr_info, attr->getSpelling());
 
                         if (auto *sa = dyn_cast<SectionAttr>(attr)) {
-                            cbor_encode_text_stringz(
-                                &attr_info, sa->getName().str().c_str());
+                            cbor_encode_string(&attr_info, sa->getName().str());
                         } else if (auto *aa = dyn_cast<AliasAttr>(attr)) {
-                            cbor_encode_text_stringz(
-                                &attr_info, aa->getAliasee().str().c_str());
+                            cbor_encode_string(&attr_info, aa->getAliasee().str());
                         }
                     }
                 }
@@ -2036,7 +2073,7 @@ class TranslateASTVisitor final
                 size_t attrs_n = D->hasAttrs() ? D->getAttrs().size() : 0;
                 cbor_encoder_create_array(local, &attrs, attrs_n);
                 for (auto a : D->attrs()) {
-                    cbor_encode_text_stringz(&attrs, a->getSpelling());
+                    cbor_encode_string(&attrs, a->getSpelling());
                 }
                 cbor_encoder_close_container(local, &attrs);
             });
@@ -2091,7 +2128,7 @@ class TranslateASTVisitor final
                 size_t attrs_n = D->hasAttrs() ? D->getAttrs().size() : 0;
                 cbor_encoder_create_array(local, &attrs, attrs_n);
                 for (auto a : D->attrs()) {
-                    cbor_encode_text_stringz(&attrs, a->getSpelling());
+                    cbor_encode_string(&attrs, a->getSpelling());
                 }
                 cbor_encoder_close_container(local, &attrs);
 
@@ -2534,6 +2571,16 @@ void TypeEncoder::VisitVariableArrayType(const VariableArrayType *T) {
 //    abort();
 //}
 
+// Apply a custom category to all command-line options so that they are the
+// only ones displayed.
+static llvm::cl::OptionCategory MyToolCategory("my-tool options");
+
+static llvm::cl::opt<unsigned> FormatVersion(
+    "format-version",
+    llvm::cl::desc("Version of the CBOR output format: 1 (default) or 2, "
+                   "which emits strings once in a string table"),
+    llvm::cl::init(FormatVersionLegacy), llvm::cl::cat(MyToolCategory));
+
 class TranslateConsumer : public clang::ASTConsumer {
     Outputs *outputs;
     const std::string outfile;
@@ -2557,8 +2604,18 @@ class TranslateConsumer : public clang::ASTConsumer {
                                                             size_t len) {
             cbor_encoder_init(&encoder, buffer, len, 0);
 
+            bool withStringTable = FormatVersion == FormatVersionStringTable;
+            StringTable strings;
+            stringTable = withStringTable ? &strings : nullptr;
+
             CborEncoder outer;
-            cbor_encoder_create_array(&encoder, &outer, 6);
+            cbor_encoder_create_array(&encoder, &outer,
+                                      withStringTable ? 8 : 6);
+
+            // 0. Format version, omitted in version 1
+            if (withStringTable) {
+                cbor_encode_uint(&outer, FormatVersionStringTable);
+            }
 
             CborEncoder array;
 
@@ -2664,6 +2721,12 @@ class TranslateConsumer : public clang::ASTConsumer {
             auto target = Context.getTargetInfo().getTriple().str();
             cbor_encode_string(&outer, target);
 
+            // 7. String table, only in version 2
+            if (withStringTable) {
+                stringTable = nullptr;
+                strings.encode(&outer);
+            }
+
             cbor_encoder_close_container(&encoder, &outer);
         };
 
@@ -2708,10 +2771,6 @@ class TranslateAction : public clang::ASTFrontendAction {
     }
 };
 
-// Apply a custom category to all command-line options so that they are the
-// only ones displayed.
-static llvm::cl::OptionCategory MyToolCategory("my-tool options");
-
 // Added in C++ 17
 template <class _Tp, size_t _Sz>
 constexpr size_t size(const _Tp (&)[_Sz]) noexcept {
@@ -2832,6 +2891,14 @@ Outputs process(int argc, const char *argv[], int *result) {
     std::string sourcePath = OptionsParser.getSourcePathList().back();
     // Make a new list with just the file we're currently translating
     std::vector<std::string> sourcePathList(1, sourcePath);
+
+    if (FormatVersion != FormatVersionLegacy &&
+        FormatVersion != FormatVersionStringTable) {
+        errs() << "Unsupported CBOR format version: " << FormatVersion << "\n";
+        *result = 1;
+        return Outputs();
+    }
+
     ClangTool Tool(OptionsParser.getCompilations(), sourcePathList);
 
     Outputs outputs;
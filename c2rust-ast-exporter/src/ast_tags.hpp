@@ -158,6 +158,20 @@ enum StringTypeTag {
     TagUnevaluated,
 };
 
+// Versions of the CBOR output format. Version 2 adds a string table: strings
+// are emitted once, at the end of the output, and referenced by index.
+enum ExportFormatVersion {
+    FormatVersionLegacy = 1,
+    FormatVersionStringTable,
+};
+
+enum CborExportTag {
+    // CBOR tag wrapping the index of a string table entry. The number is from
+    // the first-come-first-served range of the IANA registry but is not
+    // registered, so it only has this meaning in format version 2 outputs.
+    StringRefTag = 49858,
+};
+
 // From `clang/Basic/TargetInfo.h`
 /// The different kinds of `__builtin_va_list` types defined by
 /// the target implementation.
@@ -1,3 +1,4 @@
+use serde::de::Error as _;
 use serde_bytes::ByteBuf;
 use serde_cbor::error;
 use std::collections::{HashMap, VecDeque};
@@ -178,7 +179,104 @@ fn import_va_list_kind(tag: u64) -> BuiltinVaListKind {
     unsafe { std::mem::transmute::<u32, BuiltinVaListKind>(tag as u32) }
 }
 
+/// Convert the sections of any supported export format version into the
+/// layout of version 1, which has no version field and no string table.
+///
+/// Version 2 makes the export smaller, but not the imported AST: the AST
+/// holds its strings as `Value::Text`, so every reference still becomes a
+/// string of its own, as in version 1.
+fn import_format(items: Value) -> error::Result<Value> {
+    let mut sections = match items {
+        Value::Array(sections) => sections,
+        _ => return Err(error::Error::custom("expected an array of sections")),
+    };
+    let version = match sections.first() {
+        Some(&Value::Integer(version)) => version,
+        _ => return Ok(Value::Array(sections)),
+    };
+    if version != ExportFormatVersion::FormatVersionStringTable as i128 {
+        return Err(error::Error::custom(format!(
+            "unsupported AST export format version {version}"
+        )));
+    }
+
+    let mut strings: Vec<String> = match sections.pop() {
+        Some(table) => from_value(table)?,
+        None => return Err(error::Error::custom("missing string table")),
+    };
+    sections.remove(0);
+    // Count the references to each string, so that the last one can take
+    // the string out of the table instead of copying it.
+    let mut refs = vec![0usize; strings.len()];
+    for section in &sections {
+        count_string_refs(section, &mut refs)?;
+    }
+    for section in &mut sections {
+        resolve_string_refs(section, &mut strings, &mut refs)?;
+    }
+    Ok(Value::Array(sections))
+}
+
+fn invalid_string_ref() -> error::Error {
+    error::Error::custom("invalid string table reference")
+}
+
+/// The string table index that `value` refers to, if it is a reference.
+fn string_ref_index(value: &Value) -> Option<error::Result<usize>> {
+    match value {
+        Value::Tag(tag, index) if *tag == CborExportTag::StringRefTag as u64 => {
+            Some(match **index {
+                Value::Integer(index) => usize::try_from(index).map_err(|_| invalid_string_ref()),
+                _ => Err(invalid_string_ref()),
+            })
+        }
+        _ => None,
+    }
+}
+
+fn count_string_refs(value: &Value, refs: &mut [usize]) -> error::Result<()> {
+    if let Some(index) = string_ref_index(value) {
+        *refs.get_mut(index?).ok_or_else(invalid_string_ref)? += 1;
+        return Ok(());
+    }
+    match value {
+        Value::Array(values) => values
+            .iter()
+            .try_for_each(|value| count_string_refs(value, refs)),
+        _ => Ok(()),
+    }
+}
+
+/// Replace references into the string table with the strings themselves.
+/// `refs` holds the number of references to each string that are left.
+fn resolve_string_refs(
+    value: &mut Value,
+    strings: &mut [String],
+    refs: &mut [usize],
+) -> error::Result<()> {
+    if let Some(index) = string_ref_index(value) {
+        // `count_string_refs` checked the index
+        let index = index?;
+        refs[index] -= 1;
+        let string = if refs[index] == 0 {
+            std::mem::take(&mut strings[index])
+        } else {
+            strings[index].clone()
+        };
+        *value = Value::Text(string);
+        return Ok(());
+    }
+    match value {
+        Value::Array(values) => values
+            .iter_mut()
+            .try_for_each(|value| resolve_string_refs(value, strings, refs)),
+        _ => Ok(()),
+    }
+}
+
 pub fn process(items: Value) -> error::Result<AstContext> {
+    let items = import_format(items)?;
+
     let mut asts: HashMap<u64, AstNode> = HashMap::new();
     let mut types: HashMap<u64, TypeNode> = HashMap::new();
     let mut comments: Vec<CommentNode> = vec![];
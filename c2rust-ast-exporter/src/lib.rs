@@ -23,8 +23,9 @@ pub fn get_untyped_ast(
     cc_db: &Path,
     extra_args: &[&str],
     debug: bool,
+    string_table: bool,
 ) -> Result<clang_ast::AstContext, Error> {
-    let cbors = get_ast_cbors(file_path, cc_db, extra_args, debug);
+    let cbors = get_ast_cbors(file_path, cc_db, extra_args, debug, string_table);
     let buffer = cbors
         .values()
         .next()
@@ -48,6 +49,7 @@ fn get_ast_cbors(
     cc_db: &Path,
     extra_args: &[&str],
     debug: bool,
+    string_table: bool,
 ) -> HashMap<String, Vec<u8>> {
     let mut res = 0;
 
@@ -56,6 +58,11 @@ fn get_ast_cbors(
     args_owned.push(CString::new("-p").unwrap());
     args_owned.push(CString::new(cc_db.to_str().unwrap()).unwrap());
 
+    if string_table {
+        let version = clang_ast::ExportFormatVersion::FormatVersionStringTable as u32;
+        args_owned.push(CString::new(format!("-format-version={version}")).unwrap());
+    }
+
     for &arg in extra_args {
         args_owned.push(CString::new(["-extra-arg=", arg].join("")).unwrap())
     }
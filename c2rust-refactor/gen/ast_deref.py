@@ -1,5 +1,3 @@
-from datetime import datetime
-
 from util import *
 
 @linewise
@@ -15,7 +13,7 @@ def do_ast_deref_impl(d):
 @linewise
 def generate(decls):
     yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
-    yield '// Produced %s by process_ast.py' % (datetime.now(),)
+    yield '// Produced by process_ast.py'
     yield ''
 
     for d in decls:
@@ -17,7 +17,6 @@ Attributes:
 - `#[equiv_mode=custom]`: On a type declaration, do not generate an `impl`.
 '''
 
-from datetime import datetime
 from textwrap import indent, dedent
 
 from ast import *
@@ -89,7 +88,7 @@ def ignore_impl(d):
 @linewise
 def generate(decls):
     yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
-    yield '// Produced %s by process_ast.py' % (datetime.now(),)
+    yield '// Produced by process_ast.py'
     yield ''
 
     for d in decls:
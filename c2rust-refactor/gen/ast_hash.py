@@ -0,0 +1,85 @@
+'''This module generates `AstHash` impls for each AST node type.  The hash is
+consistent with `AstEquiv::ast_equiv`: equivalent values hash the same.
+
+- A struct value hashes its fields.
+- An enum value hashes its variant, then the fields of that variant.
+- A flag value hashes with `Hash`, since `AstEquiv` compares it with `==`.
+
+Attributes:
+
+- `#[equiv_mode=eq]`: On a type declaration, generate a trivial `impl` that hashes
+  values using `Hash`.
+
+- `#[equiv_mode=ignore]`: On a type declaration, generate a trivial `impl` that
+  hashes nothing, so that hashes ignore fields of this type, just like
+  comparisons do.
+
+- `#[equiv_mode=custom]`: On a type declaration, do not generate an `impl`.
+'''
+
+from textwrap import indent, dedent
+
+from ast import *
+from util import *
+
+
+@linewise
+def hash_fields(se):
+    yield 'match self {'
+    for v, path in variants_paths(se):
+        yield '  &%s => {' % struct_pattern(v, path)
+        for f in v.fields:
+            yield '    AstHash::ast_hash(%s, state);' % f.name
+        yield '  }'
+    yield '}'
+
+
+@linewise
+def hash_impl(se):
+    yield '#[allow(unused, non_shorthand_field_patterns)]'
+    yield 'impl AstHash for %s {' % se.name
+    yield '  fn ast_hash<H: Hasher>(&self, state: &mut H) {'
+    if isinstance(se, Enum):
+        yield '    mem::discriminant(self).hash(state);'
+    yield indent(hash_fields(se), '    ')
+    yield '  }'
+    yield '}'
+
+@linewise
+def eq_impl(d):
+    yield '#[allow(unused)]'
+    yield 'impl AstHash for %s {' % d.name
+    yield '  fn ast_hash<H: Hasher>(&self, state: &mut H) {'
+    yield '    self.hash(state)'
+    yield '  }'
+    yield '}'
+
+@linewise
+def ignore_impl(d):
+    yield '#[allow(unused)]'
+    yield 'impl AstHash for %s {' % d.name
+    yield '  fn ast_hash<H: Hasher>(&self, state: &mut H) {}'
+    yield '}'
+
+@linewise
+def generate(decls):
+    yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
+    yield '// Produced by process_ast.py'
+    yield ''
+
+    for d in decls:
+        mode = d.attrs.get('equiv_mode')
+        if mode is None:
+            if isinstance(d, (Struct, Enum)):
+                mode = 'compare'
+            else:
+                mode = 'eq'
+
+        if mode == 'compare':
+            yield hash_impl(d)
+        elif mode == 'eq':
+            yield eq_impl(d)
+        elif mode == 'ignore':
+            yield ignore_impl(d)
+        elif mode == 'custom':
+            pass
@@ -1,5 +1,3 @@
-from datetime import datetime
-
 from ast import *
 from util import *
 
@@ -7,29 +5,32 @@ from util import *
 def do_ast_names_impl(d):
     if not isinstance(d, (Struct, Enum)):
         return
-    yield '#[allow(unused, non_shorthand_field_patterns)]'
+    yield '#[allow(unused)]'
     yield 'impl AstName for %s {' % d.name
-    yield '  fn ast_name(&self) -> String {'
-
-    yield '    match self {'
-    for v, path in variants_paths(d):
-        yield '      &%s => {' % struct_pattern(v, path)
-        yield '        "%s".to_string()' % v.name
-        if isinstance(d, (Struct)):
-            kind_field = find_kind_field(d)
-            if kind_field:
-                yield '        + ":" + &self.%s.ast_name()' % kind_field
-        yield '      }'
-    yield '    }'
+    yield '  fn variant_name(&self) -> &\'static str {'
+    if isinstance(d, Struct):
+        yield '    "%s"' % d.name
+    else:
+        yield '    match self {'
+        for v, path in variants_paths(d):
+            # braces match unit, tuple and struct variants alike
+            yield '      &%s { .. } => "%s",' % (path, v.name)
+        yield '    }'
     yield '  }'
+
+    kind_field = find_kind_field(d) if isinstance(d, Struct) else None
+    if kind_field:
+        yield '  fn write_ast_name(&self, w: &mut impl fmt::Write) -> fmt::Result {'
+        yield '    w.write_str("%s:")?;' % d.name
+        yield '    self.%s.write_ast_name(w)' % kind_field
+        yield '  }'
     yield '}'
 
 @linewise
 def generate(decls):
     yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
-    yield '// Produced %s by process_ast.py' % (datetime.now(),)
+    yield '// Produced by process_ast.py'
     yield ''
 
     for d in decls:
         yield do_ast_names_impl(d)
-
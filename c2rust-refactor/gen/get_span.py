@@ -18,7 +18,6 @@ Attributes:
   The field name can be omitted, in which case it defaults to `attrs`.
 '''
 
-from datetime import datetime
 from textwrap import indent, dedent
 
 from ast import *
@@ -60,7 +59,7 @@ def find_span_field(s):
 @linewise
 def generate(decls):
     yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
-    yield '// Produced %s by process_ast.py' % (datetime.now(),)
+    yield '// Produced by process_ast.py'
     yield ''
 
     for d in decls:
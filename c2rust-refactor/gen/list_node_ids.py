@@ -1,4 +1,6 @@
-'''This module generates `ListNodeIds` impls for each AST node type.
+'''This module generates `ListNodeIds` impls for each AST node type.  The impls
+provide `for_each_node_id`, which visits the fields in order and stops as soon
+as the callback returns `ControlFlow::Break`; `add_node_ids` is built on it.
 
 Attributes:
 
@@ -6,7 +8,6 @@ Attributes:
   custom one can be provided.
 '''
 
-from datetime import datetime
 from textwrap import indent, dedent
 
 from ast import *
@@ -19,15 +20,18 @@ def list_rec(se, target):
     for v, path in variants_paths(se):
         yield '  &%s => {' % struct_pattern(v, path)
         for f in v.fields:
-            yield '    ListNodeIds::add_node_ids(%s, node_id_list);' % (f.name,)
+            yield '    if ListNodeIds::for_each_node_id(%s, node_id_fn).is_break() {' % (f.name,)
+            yield '      return ControlFlow::Break;'
+            yield '    }'
         yield '  }'
     yield '}'
+    yield 'ControlFlow::Continue'
 
 @linewise
 def list_impl(se):
     yield '#[allow(unused, non_shorthand_field_patterns)]'
     yield 'impl ListNodeIds for %s {' % se.name
-    yield '  fn add_node_ids(&self, node_id_list: &mut Vec<NodeId>) {'
+    yield '  fn for_each_node_id(&self, node_id_fn: &mut dyn FnMut(NodeId) -> ControlFlow) -> ControlFlow {'
     yield indent(list_rec(se, 'self'), '    ')
     yield '  }'
     yield '}'
@@ -36,15 +40,15 @@ def list_impl(se):
 def dummy_impl(se):
     yield '#[allow(unused, non_shorthand_field_patterns)]'
     yield 'impl ListNodeIds for %s {' % se.name
-    yield '  fn add_node_ids(&self, _node_id_list: &mut Vec<NodeId>) {'
-    yield '    // Do nothing'
+    yield '  fn for_each_node_id(&self, _node_id_fn: &mut dyn FnMut(NodeId) -> ControlFlow) -> ControlFlow {'
+    yield '    ControlFlow::Continue'
     yield '  }'
     yield '}'
 
 @linewise
 def generate(decls):
     yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
-    yield '// Produced %s by process_ast.py' % (datetime.now(),)
+    yield '// Produced by process_ast.py'
     yield ''
 
     for d in decls:
@@ -13,7 +13,6 @@ Attributes:
   is an lvalue, with the same mutability.
 '''
 
-from datetime import datetime
 from textwrap import indent, dedent
 
 from ast import *
@@ -91,7 +90,7 @@ def null_impl(d):
 @linewise
 def generate(decls):
     yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
-    yield '// Produced %s by process_ast.py' % (datetime.now(),)
+    yield '// Produced by process_ast.py'
     yield ''
 
     for d in decls:
@@ -14,7 +14,6 @@ Attributes:
 - `#[to_lua_custom]`: implements `ToLuaExt` and `UserData` separately.
 '''
 
-from datetime import datetime
 from textwrap import indent, dedent
 
 from ast import *
@@ -136,7 +135,7 @@ def do_one_impl(s, kind_map, boxed, emit_ldoc):
                 yield '    // @function %s_name' % kind_field
                 yield '    // @treturn string string representation of the kind'
             yield '    methods.add_method("%s_name", |_lua_ctx, this, ()| {' % kind_field
-            yield '      Ok(this.borrow().%s.ast_name())' % kind_field
+            yield '      Ok(this.borrow().%s.variant_name())' % kind_field
             yield '    });'
 
             kind_name = s.attrs['fold_kind']
@@ -151,7 +150,7 @@ def do_one_impl(s, kind_map, boxed, emit_ldoc):
             yield '    // @function kind_name'
             yield '    // @treturn string string representation of the kind'
         yield '    methods.add_method("kind_name", |_lua_ctx, this, ()| {'
-        yield '      Ok(this.borrow().ast_name())'
+        yield '      Ok(this.borrow().variant_name())'
         yield '    });'
         imm_box_prefix = '&**' if boxed else '&*'
         mut_box_prefix = '&mut **' if boxed else '&mut *'
@@ -252,7 +251,7 @@ def do_impl(s, kind_map):
 @linewise
 def generate(decls):
     yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
-    yield '// Produced %s by process_ast.py' % (datetime.now(),)
+    yield '// Produced by process_ast.py'
     yield ''
     yield '/// Refactoring module'
     yield '// @module Refactor'
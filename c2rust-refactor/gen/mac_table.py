@@ -11,6 +11,11 @@ collapser's `MacTable`.  This is a basic recursive traversal on two ASTs
    `collect_macros_seq` instead of the normal `collect_macros`, which handles
    macros possibly expanding into multiple sequential nodes.
 
+ * At nodes marked `#[mac_table_prune]`, we skip the traversal when the
+   unexpanded node's span contains no macro invocation, and only match up the
+   `NodeId`s of the two subtrees.  The node must have a `span` field that
+   covers every macro invocation under it.
+
 Note that `#[mac_table_record]` should only be applied on nodes where a macro
 expands to exactly one node.  Macros that can expand to multiple nodes need to
 be handled by `#[mac_table_seq]` instead.  Leaving off `#[mac_table_record]`
@@ -22,6 +27,9 @@ Attributes:
 
 - `#[mac_table_record]`: Check for and record macros at each node of this type.
 
+- `#[mac_table_prune]`: Skip subtrees of this type that contain no macro
+  invocations.
+
 - `#[mac_table_seq]`: On a field, use `collect_macros_seq` to handle macros
   within the unexpanded sequence that produce multiple items in the expanded
   sequence.
@@ -30,7 +38,6 @@ Attributes:
   will be provided elsewhere.
 '''
 
-from datetime import datetime
 from textwrap import indent
 
 from ast import *
@@ -41,6 +48,12 @@ def do_collect_macros_body(se, target1, target2):
     if not isinstance(se, (Struct, Enum)):
         return
 
+    if 'mac_table_prune' in se.attrs:
+        yield 'if !cx.may_contain_invoc(%s.span) && cx.record_node_id_matches(%s, %s) {' % \
+                (target1, target1, target2)
+        yield '  return;'
+        yield '}'
+
     yield 'match (%s, %s) {' % (target1, target2)
     for v, path in variants_paths(se):
         yield '  (&%s,' % struct_pattern(v, path, '1')
@@ -80,7 +93,7 @@ def do_collect_macros_impl(d):
 @linewise
 def generate(decls):
     yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
-    yield '// Produced %s by process_ast.py' % (datetime.now(),)
+    yield '// Produced by process_ast.py'
     yield ''
 
     for d in decls:
@@ -12,7 +12,6 @@ Attributes:
   `Ctxt`.  The type must implement `GetSpan` and `AsNonterminal`.
 '''
 
-from datetime import datetime
 from textwrap import indent
 
 from ast import *
@@ -53,7 +52,7 @@ def do_nt_match_impl(d):
 @linewise
 def generate(decls):
     yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
-    yield '// Produced %s by process_ast.py' % (datetime.now(),)
+    yield '// Produced by process_ast.py'
     yield ''
 
     for d in decls:
@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
+import argparse
 from collections import namedtuple
+import importlib
+import json
+import multiprocessing
+import os
 import re
-import sys
 
 from ast import *
 
@@ -202,62 +206,118 @@ def parse(s):
     return p.parse_decls()
 
 
-if __name__ == '__main__':
-    decls = parse(open('gen/ast.txt').read())
-
-    mode, out_file = sys.argv[1:]
-
-    if mode == 'ast_deref':
-        import ast_deref
-        text = ast_deref.generate(decls)
-    elif mode == 'ast_equiv':
-        import ast_equiv
-        text = ast_equiv.generate(decls)
-    elif mode == 'matcher':
-        import matcher
-        text = matcher.generate(decls)
-    elif mode == 'get_span':
-        import get_span
-        text = get_span.generate(decls)
-    elif mode == 'get_node_id':
-        import get_node_id
-        text = get_node_id.generate(decls)
-    elif mode == 'lr_expr':
-        import lr_expr
-        text = lr_expr.generate(decls)
-    elif mode == 'list_node_ids':
-        import list_node_ids
-        text = list_node_ids.generate(decls)
-    elif mode == 'rewrite_rewrite':
-        import rewrite
-        text = rewrite.generate_rewrite_impls(decls)
-    elif mode == 'rewrite_recursive':
-        import rewrite
-        text = rewrite.generate_recursive_impls(decls)
-    elif mode == 'rewrite_recover_children':
-        import rewrite
-        text = rewrite.generate_recover_children_impls(decls)
-    elif mode == 'rewrite_seq_item':
-        import rewrite
-        text = rewrite.generate_seq_item_impls(decls)
-    elif mode == 'rewrite_maybe_rewrite_seq':
-        import rewrite
-        text = rewrite.generate_maybe_rewrite_seq_impls(decls)
-    elif mode == 'mac_table':
-        import mac_table
-        text = mac_table.generate(decls)
-    elif mode == 'nt_match':
-        import nt_match
-        text = nt_match.generate(decls)
-    elif mode == 'ast_names':
-        import ast_names
-        text = ast_names.generate(decls)
-    elif mode == 'lua_ast_node':
-        import lua_ast_node
-        text = lua_ast_node.generate(decls)
-    else:
+# mode -> (module, generator function, output file used by build.rs)
+MODES = {
+    'ast_deref': ('ast_deref', 'generate', 'ast_deref_gen.inc.rs'),
+    'ast_equiv': ('ast_equiv', 'generate', 'ast_equiv_gen.inc.rs'),
+    'ast_hash': ('ast_hash', 'generate', 'ast_hash_gen.inc.rs'),
+    'matcher': ('matcher', 'generate', 'matcher_impls_gen.inc.rs'),
+    'get_span': ('get_span', 'generate', 'get_span_gen.inc.rs'),
+    'get_node_id': ('get_node_id', 'generate', 'get_node_id_gen.inc.rs'),
+    'lr_expr': ('lr_expr', 'generate', 'lr_expr_gen.inc.rs'),
+    'list_node_ids': ('list_node_ids', 'generate', 'list_node_ids_gen.inc.rs'),
+    'rewrite_rewrite': ('rewrite', 'generate_rewrite_impls',
+                        'rewrite_rewrite_gen.inc.rs'),
+    'rewrite_recursive': ('rewrite', 'generate_recursive_impls',
+                          'rewrite_recursive_gen.inc.rs'),
+    'rewrite_recover_children': ('rewrite', 'generate_recover_children_impls',
+                                 'rewrite_recover_children_gen.inc.rs'),
+    'rewrite_seq_item': ('rewrite', 'generate_seq_item_impls',
+                         'rewrite_seq_item_gen.inc.rs'),
+    'rewrite_maybe_rewrite_seq': ('rewrite',
+                                  'generate_maybe_rewrite_seq_impls',
+                                  'rewrite_maybe_rewrite_seq_gen.inc.rs'),
+    'mac_table': ('mac_table', 'generate', 'mac_table_gen.inc.rs'),
+    'nt_match': ('nt_match', 'generate', 'nt_match_gen.inc.rs'),
+    'ast_names': ('ast_names', 'generate', 'ast_names_gen.inc.rs'),
+    'lua_ast_node': ('lua_ast_node', 'generate', 'lua_ast_node_gen.inc.rs'),
+}
+
+AST_TXT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ast.txt')
+
+# parsed once, before the worker processes of `--all` fork
+DECLS = None
+
+
+def generate(mode, decls):
+    if mode not in MODES:
         raise ValueError('unknown mode: %r' % mode)
-
-    with open(out_file, 'w') as f:
+    module, func, _ = MODES[mode]
+    return getattr(importlib.import_module(module), func)(decls) + '\n'
+
+
+def write_if_changed(path, text):
+    """Write `text` to `path` unless it already holds exactly that, so that
+    cargo doesn't recompile code that didn't change."""
+    try:
+        with open(path) as f:
+            if f.read() == text:
+                return False
+    except FileNotFoundError:
+        pass
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
         f.write(text)
-        f.write('\n')
+    os.replace(tmp_path, path)
+    return True
+
+
+def generate_into(mode, out_dir):
+    path = os.path.join(out_dir, MODES[mode][2])
+    return mode, write_if_changed(path, generate(mode, DECLS))
+
+
+def generate_all(out_dir, jobs):
+    if jobs > 1:
+        with multiprocessing.get_context('fork').Pool(jobs) as pool:
+            return pool.starmap(generate_into,
+                                [(mode, out_dir) for mode in MODES])
+    return [generate_into(mode, out_dir) for mode in MODES]
+
+
+def report(decls, top, as_json):
+    import report
+    names = {d.name for d in decls}
+    results = {mode: report.measure(generate(mode, decls), names)
+               for mode in MODES}
+    if as_json:
+        return json.dumps(results, indent=2, sort_keys=True)
+    return report.format_report(results, top)
+
+
+def main():
+    global DECLS
+    parser = argparse.ArgumentParser(
+        description='Generate Rust code for the AST types in ast.txt.')
+    parser.add_argument('mode', nargs='?', choices=list(MODES))
+    parser.add_argument('out_file', nargs='?')
+    parser.add_argument('--all', metavar='OUT_DIR',
+                        help='generate every mode into its file in OUT_DIR')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of modes to generate in parallel with --all')
+    parser.add_argument('--report', action='store_true',
+                        help='print the generated lines, match arms and '
+                             'closures per mode and AST type')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of AST types to list per mode in the report')
+    parser.add_argument('--json', action='store_true',
+                        help='print the whole report as JSON')
+    args = parser.parse_args()
+
+    with open(AST_TXT) as f:
+        DECLS = parse(f.read())
+
+    if args.report:
+        print(report(DECLS, args.top, args.json))
+    elif args.all:
+        if args.mode:
+            parser.error('a mode can\'t be combined with --all')
+        generate_all(args.all, args.jobs)
+    elif args.mode and args.out_file:
+        write_if_changed(args.out_file, generate(args.mode, DECLS))
+    else:
+        parser.error('expected a mode and an output file, --all or --report')
+
+
+if __name__ == '__main__':
+    main()
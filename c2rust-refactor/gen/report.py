@@ -0,0 +1,100 @@
+'''This module measures the code that each mode generates, per AST type, as a
+proxy for what that code costs to compile. It backs `process_ast.py --report`.
+
+Each top-level `impl` or `fn` of the generated code, together with the
+attributes and comments right before it, is attributed to an AST type:
+
+- Impls count for the type they are for. Wrappers such as `P<...>` or
+  `LuaAstNode<...>` are looked through.
+- Functions count for the first AST type in their signature.
+
+Everything else, such as module-level tables, counts as `(other)`.
+'''
+
+from collections import defaultdict
+import re
+
+ITEM_RE = re.compile(r'^(?:pub\s+)?(?:unsafe\s+)?(impl|fn)\b(.*?)\s*\{')
+IDENT_RE = re.compile(r'[A-Za-z_]\w*')
+# closures passed as arguments or bound to variables, e.g. `(|x| ...` or
+# `= move || ...`
+CLOSURE_RE = re.compile(r'(?:^|[(,=])\s*(?:move\s+)?\|[^|\n]*\|(?!\|)')
+
+OTHER = '(other)'
+METRICS = ('lines', 'arms', 'closures')
+
+
+def item_type(kind, header, names):
+    if kind == 'impl':
+        target = header.split(' for ', 1)[-1]
+        found = [t for t in IDENT_RE.findall(target) if t in names]
+        return found[-1] if found else OTHER
+    found = [t for t in IDENT_RE.findall(header) if t in names]
+    return found[0] if found else OTHER
+
+
+def measure(text, names):
+    '''Count the lines, match arms and closures of `text` per AST type.'''
+    stats = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+
+    def count(ty, line):
+        if not line.strip():
+            return
+        s = stats[ty]
+        s['lines'] += 1
+        s['arms'] += line.count('=>')
+        s['closures'] += len(CLOSURE_RE.findall(line))
+
+    current = None
+    pending = []
+    for line in text.splitlines():
+        if current is not None:
+            count(current, line)
+            if line.startswith('}'):
+                current = None
+            continue
+
+        m = ITEM_RE.match(line)
+        if m:
+            current = item_type(m.group(1), m.group(2), names)
+            for l in pending + [line]:
+                count(current, l)
+            pending = []
+            # e.g. `impl LuaAstNodeSafe for LuaAstNode<Crate> {}`
+            if line.count('{') == line.count('}'):
+                current = None
+        elif line.startswith(('#[', '//')):
+            pending.append(line)
+        else:
+            for l in pending + [line]:
+                count(OTHER, l)
+            pending = []
+    for l in pending:
+        count(OTHER, l)
+    return dict(stats)
+
+
+def totals(stats):
+    return {m: sum(s[m] for s in stats.values()) for m in METRICS}
+
+
+def format_report(results, top):
+    '''Format `{mode: measure(...)}`, listing the `top` biggest types of
+    each mode.'''
+    lines = []
+    overall = totals({mode: totals(stats) for mode, stats in results.items()})
+    lines.append('%-28s %8s %8s %8s' % (('mode / type',) + METRICS))
+    lines.append('%-28s %8d %8d %8d' % (('all modes',) +
+                                         tuple(overall[m] for m in METRICS)))
+
+    by_size = sorted(results.items(), key=lambda kv: -totals(kv[1])['lines'])
+    for mode, stats in by_size:
+        t = totals(stats)
+        lines.append('')
+        lines.append('%-28s %8d %8d %8d' % ((mode,) +
+                                             tuple(t[m] for m in METRICS)))
+        biggest = sorted(stats.items(), key=lambda kv: -kv[1]['lines'])
+        for ty, s in biggest[:top]:
+            lines.append('  %-26s %8d %8d %8d' % ((ty,) +
+                                                   tuple(s[m] for m in METRICS)))
+    return '\n'.join(lines)
@@ -143,7 +143,6 @@ These affect the behavior of generated `Recursive` and `RecoverChildren` impls.
   exprs in function-call callee positions.
 '''
 
-from datetime import datetime
 import re
 from textwrap import indent, dedent
 
@@ -332,7 +331,7 @@ def do_rewrite_impl(d):
 @linewise
 def generate_rewrite_impls(decls):
     yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
-    yield '// Produced %s by process_ast.py' % (datetime.now(),)
+    yield '// Produced by process_ast.py'
     yield ''
 
     for d in decls:
@@ -433,7 +432,7 @@ def do_recursive_impl(d):
 @linewise
 def generate_recursive_impls(decls):
     yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
-    yield '// Produced %s by process_ast.py' % (datetime.now(),)
+    yield '// Produced by process_ast.py'
     yield ''
 
     for d in decls:
@@ -511,7 +510,7 @@ def do_recover_children_impl(d):
 @linewise
 def generate_recover_children_impls(decls):
     yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
-    yield '// Produced %s by process_ast.py' % (datetime.now(),)
+    yield '// Produced by process_ast.py'
     yield ''
 
     for d in decls:
@@ -531,7 +530,7 @@ def do_seq_item_impl(d):
 @linewise
 def generate_seq_item_impls(decls):
     yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
-    yield '// Produced %s by process_ast.py' % (datetime.now(),)
+    yield '// Produced by process_ast.py'
     yield ''
 
     for d in decls:
@@ -559,7 +558,7 @@ def do_maybe_rewrite_seq_impl(d):
 @linewise
 def generate_maybe_rewrite_seq_impls(decls):
     yield '// AUTOMATICALLY GENERATED - DO NOT EDIT'
-    yield '// Produced %s by process_ast.py' % (datetime.now(),)
+    yield '// Produced by process_ast.py'
     yield ''
 
     for d in decls:
@@ -0,0 +1,113 @@
+//! `AstHash` trait for hashing ASTs consistently with `AstEquiv`.
+use rustc_target::spec::abi::Abi;
+use std::collections::hash_map::DefaultHasher;
+use std::hash::{Hash, Hasher};
+use std::mem;
+use std::rc::Rc;
+use syntax::ast::*;
+use syntax::token::{BinOpToken, DelimToken, Nonterminal, Token, TokenKind};
+use syntax::token::{Lit as TokenLit, LitKind as TokenLitKind};
+use syntax::ptr::P;
+use syntax::source_map::{Span, Spanned};
+use syntax::tokenstream::{DelimSpan, TokenStream, TokenTree};
+use syntax::ThinVec;
+use syntax_pos::hygiene::SyntaxContext;
+
+/// Trait for hashing the structure of AST nodes.  Nodes that are equivalent under
+/// `AstEquiv::ast_equiv` have the same hash, so comparing hashes is a cheap way to rule out
+/// candidates before calling `ast_equiv`, or to key a memo table of equivalence results.  Like
+/// `ast_equiv`, this ignores `Span`s, `NodeId`s and the other fields marked
+/// `#[equiv_mode=ignore]`.
+///
+/// Hashes are not consistent with `AstEquiv::unnamed_equiv`, which treats all
+/// `C2RustUnnamed*` names as equal.
+pub trait AstHash {
+    fn ast_hash<H: Hasher>(&self, state: &mut H);
+}
+
+/// Computes the `AstHash` of a node with the standard library's default hasher.
+pub fn ast_hash<T: AstHash + ?Sized>(x: &T) -> u64 {
+    let mut state = DefaultHasher::new();
+    x.ast_hash(&mut state);
+    state.finish()
+}
+
+impl<'a, T: AstHash + ?Sized> AstHash for &'a T {
+    fn ast_hash<H: Hasher>(&self, state: &mut H) {
+        <T as AstHash>::ast_hash(*self, state)
+    }
+}
+
+impl<T: AstHash> AstHash for P<T> {
+    fn ast_hash<H: Hasher>(&self, state: &mut H) {
+        <T as AstHash>::ast_hash(self, state)
+    }
+}
+
+impl<T: AstHash> AstHash for Rc<T> {
+    fn ast_hash<H: Hasher>(&self, state: &mut H) {
+        <T as AstHash>::ast_hash(self, state)
+    }
+}
+
+impl<T: AstHash> AstHash for Spanned<T> {
+    fn ast_hash<H: Hasher>(&self, state: &mut H) {
+        self.node.ast_hash(state)
+    }
+}
+
+impl<T: AstHash> AstHash for [T] {
+    fn ast_hash<H: Hasher>(&self, state: &mut H) {
+        // Hash the length, so that `[a, b], [c]` and `[a], [b, c]` differ.
+        self.len().hash(state);
+        for x in self {
+            x.ast_hash(state);
+        }
+    }
+}
+
+impl<T: AstHash> AstHash for Vec<T> {
+    fn ast_hash<H: Hasher>(&self, state: &mut H) {
+        <[T] as AstHash>::ast_hash(self, state)
+    }
+}
+
+impl<T: AstHash> AstHash for ThinVec<T> {
+    fn ast_hash<H: Hasher>(&self, state: &mut H) {
+        <[T] as AstHash>::ast_hash(self, state)
+    }
+}
+
+impl<T: AstHash> AstHash for Option<T> {
+    fn ast_hash<H: Hasher>(&self, state: &mut H) {
+        mem::discriminant(self).hash(state);
+        if let Some(ref x) = *self {
+            x.ast_hash(state);
+        }
+    }
+}
+
+impl<A: AstHash, B: AstHash> AstHash for (A, B) {
+    fn ast_hash<H: Hasher>(&self, state: &mut H) {
+        self.0.ast_hash(state);
+        self.1.ast_hash(state);
+    }
+}
+
+impl<A: AstHash, B: AstHash, C: AstHash> AstHash for (A, B, C) {
+    fn ast_hash<H: Hasher>(&self, state: &mut H) {
+        self.0.ast_hash(state);
+        self.1.ast_hash(state);
+        self.2.ast_hash(state);
+    }
+}
+
+// Implementations for specific AST types are auto-generated.
+include!(concat!(env!("OUT_DIR"), "/ast_hash_gen.inc.rs"));
+
+impl AstHash for Ident {
+    fn ast_hash<H: Hasher>(&self, state: &mut H) {
+        // `ast_equiv` compares the span too, but spans are ignored.
+        self.name.ast_hash(state)
+    }
+}
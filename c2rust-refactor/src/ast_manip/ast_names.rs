@@ -1,3 +1,4 @@
+use std::fmt;
 use syntax::ast::*;
 use syntax::token::{BinOpToken, DelimToken, Nonterminal, Token, TokenKind};
 use syntax::token::{Lit as TokenLit, LitKind as TokenLitKind};
@@ -6,19 +7,41 @@ use syntax::source_map::Spanned;
 use syntax::tokenstream::{DelimSpan, TokenTree};
 
 pub trait AstName {
-    fn ast_name(&self) -> String;
+    /// The name of this node's variant, or of its type for structs, e.g.
+    /// `"Call"` for an `ExprKind::Call`.
+    fn variant_name(&self) -> &'static str;
+
+    /// Writes the full name of this node. For nodes with a kind, it includes
+    /// the name of the kind, e.g. `Expr:Call`.
+    fn write_ast_name(&self, w: &mut impl fmt::Write) -> fmt::Result {
+        w.write_str(self.variant_name())
+    }
+
+    fn ast_name(&self) -> String {
+        let mut name = String::new();
+        self.write_ast_name(&mut name).unwrap();
+        name
+    }
 }
 
 include!(concat!(env!("OUT_DIR"), "/ast_names_gen.inc.rs"));
 
 impl<T: AstName> AstName for P<T> {
-    fn ast_name(&self) -> String {
-        <T as AstName>::ast_name(self)
+    fn variant_name(&self) -> &'static str {
+        <T as AstName>::variant_name(self)
+    }
+
+    fn write_ast_name(&self, w: &mut impl fmt::Write) -> fmt::Result {
+        <T as AstName>::write_ast_name(self, w)
     }
 }
 
 impl<T: AstName> AstName for Spanned<T> {
-    fn ast_name(&self) -> String {
-        self.node.ast_name()
+    fn variant_name(&self) -> &'static str {
+        self.node.variant_name()
+    }
+
+    fn write_ast_name(&self, w: &mut impl fmt::Write) -> fmt::Result {
+        self.node.write_ast_name(w)
     }
 }
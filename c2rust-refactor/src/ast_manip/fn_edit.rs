@@ -35,13 +35,13 @@ pub struct FnLike {
 }
 
 impl AstName for FnKind {
-    fn ast_name(&self) -> String {
+    fn variant_name(&self) -> &'static str {
         match self {
             FnKind::Normal => "Normal",
             FnKind::ImplMethod => "ImplMethod",
             FnKind::TraitMethod => "TraitMethod",
             FnKind::Foreign => "Foreign",
-        }.into()
+        }
     }
 }
 
@@ -10,6 +10,19 @@ use syntax::tokenstream::{DelimSpan, TokenStream, TokenTree};
 use syntax::ThinVec;
 use syntax_pos::hygiene::SyntaxContext;
 
+/// Whether `ListNodeIds::for_each_node_id` should go on to the next `NodeId`.
+#[derive(Clone, Copy, PartialEq, Eq, Debug)]
+pub enum ControlFlow {
+    Continue,
+    Break,
+}
+
+impl ControlFlow {
+    pub fn is_break(self) -> bool {
+        self == ControlFlow::Break
+    }
+}
+
 pub trait ListNodeIds {
     fn list_node_ids(&self) -> Vec<NodeId> {
         let mut ids = Vec::new();
@@ -17,79 +30,107 @@ pub trait ListNodeIds {
         ids
     }
 
-    fn add_node_ids(&self, ids: &mut Vec<NodeId>);
+    fn add_node_ids(&self, ids: &mut Vec<NodeId>) {
+        self.for_each_node_id(&mut |id| {
+            ids.push(id);
+            ControlFlow::Continue
+        });
+    }
+
+    /// Checks whether `id` appears in this node, without listing its other `NodeId`s.
+    fn contains_node_id(&self, id: NodeId) -> bool {
+        self.for_each_node_id(&mut |x| {
+            if x == id {
+                ControlFlow::Break
+            } else {
+                ControlFlow::Continue
+            }
+        })
+        .is_break()
+    }
+
+    /// Calls `f` on each `NodeId` in this node, in the order of `list_node_ids`, until it returns
+    /// `ControlFlow::Break`.  Returns `Break` if `f` did.
+    fn for_each_node_id(&self, f: &mut dyn FnMut(NodeId) -> ControlFlow) -> ControlFlow;
 }
 
 impl ListNodeIds for NodeId {
-    fn add_node_ids(&self, ids: &mut Vec<NodeId>) {
-        ids.push(*self);
+    fn for_each_node_id(&self, f: &mut dyn FnMut(NodeId) -> ControlFlow) -> ControlFlow {
+        f(*self)
     }
 }
 
 impl<T: ListNodeIds> ListNodeIds for P<T> {
-    fn add_node_ids(&self, ids: &mut Vec<NodeId>) {
-        <T as ListNodeIds>::add_node_ids(self, ids)
+    fn for_each_node_id(&self, f: &mut dyn FnMut(NodeId) -> ControlFlow) -> ControlFlow {
+        <T as ListNodeIds>::for_each_node_id(self, f)
     }
 }
 
 impl<T: ListNodeIds> ListNodeIds for Rc<T> {
-    fn add_node_ids(&self, ids: &mut Vec<NodeId>) {
-        <T as ListNodeIds>::add_node_ids(self, ids)
+    fn for_each_node_id(&self, f: &mut dyn FnMut(NodeId) -> ControlFlow) -> ControlFlow {
+        <T as ListNodeIds>::for_each_node_id(self, f)
     }
 }
 
 impl<T: ListNodeIds> ListNodeIds for Spanned<T> {
-    fn add_node_ids(&self, ids: &mut Vec<NodeId>) {
-        <T as ListNodeIds>::add_node_ids(&self.node, ids)
+    fn for_each_node_id(&self, f: &mut dyn FnMut(NodeId) -> ControlFlow) -> ControlFlow {
+        <T as ListNodeIds>::for_each_node_id(&self.node, f)
     }
 }
 
 impl<T: ListNodeIds> ListNodeIds for [T] {
-    fn add_node_ids(&self, ids: &mut Vec<NodeId>) {
+    fn for_each_node_id(&self, f: &mut dyn FnMut(NodeId) -> ControlFlow) -> ControlFlow {
         for x in self.iter() {
-            <T as ListNodeIds>::add_node_ids(x, ids)
+            if <T as ListNodeIds>::for_each_node_id(x, f).is_break() {
+                return ControlFlow::Break;
+            }
         }
+        ControlFlow::Continue
     }
 }
 
 impl<T: ListNodeIds> ListNodeIds for Vec<T> {
-    fn add_node_ids(&self, ids: &mut Vec<NodeId>) {
-        <[T] as ListNodeIds>::add_node_ids(self, ids)
+    fn for_each_node_id(&self, f: &mut dyn FnMut(NodeId) -> ControlFlow) -> ControlFlow {
+        <[T] as ListNodeIds>::for_each_node_id(self, f)
     }
 }
 
 impl<T: ListNodeIds> ListNodeIds for SmallVec<[T; 1]> {
-    fn add_node_ids(&self, ids: &mut Vec<NodeId>) {
-        <[T] as ListNodeIds>::add_node_ids(self, ids)
+    fn for_each_node_id(&self, f: &mut dyn FnMut(NodeId) -> ControlFlow) -> ControlFlow {
+        <[T] as ListNodeIds>::for_each_node_id(self, f)
     }
 }
 
 impl<T: ListNodeIds> ListNodeIds for ThinVec<T> {
-    fn add_node_ids(&self, ids: &mut Vec<NodeId>) {
-        <[T] as ListNodeIds>::add_node_ids(self, ids)
+    fn for_each_node_id(&self, f: &mut dyn FnMut(NodeId) -> ControlFlow) -> ControlFlow {
+        <[T] as ListNodeIds>::for_each_node_id(self, f)
     }
 }
 
 impl<T: ListNodeIds> ListNodeIds for Option<T> {
-    fn add_node_ids(&self, ids: &mut Vec<NodeId>) {
-        if let Some(ref x) = *self {
-            <T as ListNodeIds>::add_node_ids(x, ids);
+    fn for_each_node_id(&self, f: &mut dyn FnMut(NodeId) -> ControlFlow) -> ControlFlow {
+        match *self {
+            Some(ref x) => <T as ListNodeIds>::for_each_node_id(x, f),
+            None => ControlFlow::Continue,
         }
     }
 }
 
 impl<A: ListNodeIds, B: ListNodeIds> ListNodeIds for (A, B) {
-    fn add_node_ids(&self, ids: &mut Vec<NodeId>) {
-        self.0.add_node_ids(ids);
-        self.1.add_node_ids(ids);
+    fn for_each_node_id(&self, f: &mut dyn FnMut(NodeId) -> ControlFlow) -> ControlFlow {
+        if self.0.for_each_node_id(f).is_break() {
+            return ControlFlow::Break;
+        }
+        self.1.for_each_node_id(f)
     }
 }
 
 impl<A: ListNodeIds, B: ListNodeIds, C: ListNodeIds> ListNodeIds for (A, B, C) {
-    fn add_node_ids(&self, ids: &mut Vec<NodeId>) {
-        self.0.add_node_ids(ids);
-        self.1.add_node_ids(ids);
-        self.2.add_node_ids(ids);
+    fn for_each_node_id(&self, f: &mut dyn FnMut(NodeId) -> ControlFlow) -> ControlFlow {
+        if self.0.for_each_node_id(f).is_break() || self.1.for_each_node_id(f).is_break() {
+            return ControlFlow::Break;
+        }
+        self.2.for_each_node_id(f)
     }
 }
 
@@ -4,6 +4,7 @@
 // Modules with simple APIs are private, with their public definitions reexported.
 mod ast_deref;
 mod ast_equiv;
+mod ast_hash;
 mod ast_map;
 mod ast_names;
 mod ast_node;
@@ -19,13 +20,14 @@ mod visit_node;
 
 pub use self::ast_deref::AstDeref;
 pub use self::ast_equiv::AstEquiv;
+pub use self::ast_hash::{ast_hash, AstHash};
 pub use self::ast_map::{map_ast, map_ast_into, map_ast_unified, map_ast_into_unified, AstMap, NodeTable, UnifiedAstMap};
 pub use self::ast_names::AstName;
 pub use self::ast_node::{AstNode, AstNodeRef};
 pub use self::fold::{FlatMapNodes, MutVisit, MutVisitNodes, WalkAst};
 pub use self::get_node_id::{GetNodeId, MaybeGetNodeId};
 pub use self::get_span::GetSpan;
-pub use self::list_node_ids::ListNodeIds;
+pub use self::list_node_ids::{ControlFlow, ListNodeIds};
 pub use self::output_exprs::fold_output_exprs;
 pub use self::remove_paren::remove_paren;
 pub use self::seq_edit::{fold_blocks, fold_modules};
@@ -13,10 +13,10 @@ use std::rc::Rc;
 use syntax::attr;
 use syntax::ptr::P;
 use syntax::source_map::Spanned;
-use syntax::visit::Visitor;
+use syntax::visit::{self, Visitor};
 use syntax_pos::Symbol;
 
-use crate::ast_manip::Visit;
+use crate::ast_manip::{ListNodeIds, Visit};
 use crate::ast_manip::{GetNodeId, GetSpan};
 use crate::ast_manip::util::path_eq;
 
@@ -203,7 +203,7 @@ pub fn collect_macro_invocations<'ast>(
     unexpanded: &'ast Crate,
     expanded: &'ast Crate,
 ) -> (MacTable<'ast>, Vec<(NodeId, NodeId)>) {
-    let mut ctxt = Ctxt::new();
+    let mut ctxt = Ctxt::new(collect_invoc_spans(unexpanded));
     // Because `expanded` hasn't been transformed since it was macro expanded, we know that the
     // first `inj_count` items are the injected prelude and crate imports.
     let (crate_names, has_prelude) = super::injected_items(unexpanded);
@@ -216,14 +216,75 @@ pub fn collect_macro_invocations<'ast>(
     (ctxt.table, ctxt.matched_node_ids)
 }
 
+/// Collects the spans of the macro invocations in the unexpanded crate, sorted by their start.
+/// `CollectMacros` skips the nodes whose spans contain none of them.
+struct CollectInvocSpans {
+    spans: Vec<Span>,
+}
+
+impl CollectInvocSpans {
+    fn collect<T: MaybeInvoc>(&mut self, x: &T, span: Span) {
+        if x.as_invoc().is_some() {
+            self.spans.push(span);
+        }
+    }
+}
+
+macro_rules! collect_invoc_spans {
+    ($($visit_thing:ident($Thing:ty), $walk_thing:ident;)*) => {
+        impl<'ast> Visitor<'ast> for CollectInvocSpans {
+            $(
+                fn $visit_thing(&mut self, x: &'ast $Thing) {
+                    self.collect(x, x.span);
+                    visit::$walk_thing(self, x);
+                }
+            )*
+
+            fn visit_item(&mut self, x: &'ast Item) {
+                self.collect(x, x.span);
+                // The items of an out-of-line module are in another file, outside the span of
+                // the `mod` item, so never skip the nodes around one.
+                match x.kind {
+                    ItemKind::Mod(ref m) if !m.inline => self.spans.push(x.span),
+                    _ => {}
+                }
+                visit::walk_item(self, x);
+            }
+
+            fn visit_mac(&mut self, mac: &'ast Mac) {
+                visit::walk_mac(self, mac)
+            }
+        }
+    };
+}
+
+collect_invoc_spans! {
+    visit_impl_item(ImplItem), walk_impl_item;
+    visit_trait_item(TraitItem), walk_trait_item;
+    visit_foreign_item(ForeignItem), walk_foreign_item;
+    visit_stmt(Stmt), walk_stmt;
+    visit_expr(Expr), walk_expr;
+    visit_pat(Pat), walk_pat;
+    visit_ty(Ty), walk_ty;
+}
+
+fn collect_invoc_spans(krate: &Crate) -> Vec<Span> {
+    let mut v = CollectInvocSpans { spans: Vec::new() };
+    krate.visit(&mut v);
+    v.spans.sort_by_key(|sp| sp.lo());
+    v.spans
+}
+
 struct Ctxt<'a> {
     table: MacTable<'a>,
     next_id: u32,
     matched_node_ids: Vec<(NodeId, NodeId)>,
+    /// Spans of the macro invocations in the unexpanded crate, sorted by their start.
+    invoc_spans: Vec<Span>,
 }
 
 impl<'a> Ctxt<'a> {
-    fn new() -> Ctxt<'a> {
+    fn new(invoc_spans: Vec<Span>) -> Ctxt<'a> {
         Ctxt {
             table: MacTable {
                 map: HashMap::new(),
@@ -232,6 +293,19 @@ impl<'a> Ctxt<'a> {
             },
             next_id: 0,
             matched_node_ids: Vec::new(),
+            invoc_spans,
+        }
+    }
+
+    /// Checks whether the unexpanded node at `sp` may contain a macro invocation.  This errs on
+    /// the side of `true`: any invocation that starts within `sp` counts.
+    fn may_contain_invoc(&self, sp: Span) -> bool {
+        if sp.is_dummy() || is_macro_generated(sp) {
+            return true;
+        }
+        match self.invoc_spans.binary_search_by_key(&sp.lo(), |invoc| invoc.lo()) {
+            Ok(_) => true,
+            Err(i) => i < self.invoc_spans.len() && self.invoc_spans[i].lo() <= sp.hi(),
         }
     }
 
@@ -265,6 +339,20 @@ impl<'a> Ctxt<'a> {
         self.matched_node_ids.push((old, new));
     }
 
+    /// Matches up the `NodeId`s of two subtrees that contain no macro invocations, in the same
+    /// order as walking them with `collect_macros` would.  Returns `false` without recording
+    /// anything if the subtrees have different numbers of `NodeId`s, e.g. because a `#[cfg_attr]`
+    /// changed an attribute, so that the caller can fall back to the lockstep walk.
+    fn record_node_id_matches<T: ListNodeIds>(&mut self, old: &T, new: &T) -> bool {
+        let old_ids = old.list_node_ids();
+        let new_ids = new.list_node_ids();
+        if old_ids.len() != new_ids.len() {
+            return false;
+        }
+        self.matched_node_ids.extend(old_ids.into_iter().zip(new_ids));
+        true
+    }
+
     fn record_one_macro(
         &mut self,
         old_id: NodeId,
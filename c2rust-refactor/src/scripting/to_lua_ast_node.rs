@@ -1077,9 +1077,9 @@ impl AddMoreMethods for LuaAstNode<P<Expr>> {
 
         methods.add_method("get_op", |_lua_ctx, this, ()| {
             match &this.borrow().kind {
-                ExprKind::Unary(op, _) => Ok(Some(op.ast_name())),
+                ExprKind::Unary(op, _) => Ok(Some(op.variant_name())),
                 ExprKind::Binary(op, ..) |
-                ExprKind::AssignOp(op, ..) => Ok(Some(op.ast_name())),
+                ExprKind::AssignOp(op, ..) => Ok(Some(op.variant_name())),
                 _ => Ok(None),
             }
         });
@@ -1321,7 +1321,7 @@ impl AddMoreMethods for LuaAstNode<P<Expr>> {
             impl<'lua> MutVisitor for LuaFilterMapExpr<'lua> {
                 fn visit_expr(&mut self, x: &mut P<Expr>) {
                     let is_end = self.filter
-                        .call::<_, bool>(x.kind.ast_name())
+                        .call::<_, bool>(x.kind.variant_name())
                         .expect("Failed to call filter");
 
                     if is_end {
@@ -1655,7 +1655,7 @@ impl AddMoreMethods for LuaAstNode<P<Local>> {
 impl AddMoreMethods for LuaAstNode<Lit> {
     fn add_more_methods<'lua, M: UserDataMethods<'lua, Self>>(methods: &mut M) {
         methods.add_method("get_kind", |_lua_ctx, this, ()| {
-            Ok(this.borrow().kind.ast_name())
+            Ok(this.borrow().kind.variant_name())
         });
 
         methods.add_method("get_value", |lua_ctx, this, ()| {
@@ -1829,7 +1829,7 @@ impl ToLuaExt for AstNode {
 impl UserData for LuaAstNode<FnLike> {
     fn add_methods<'lua, M: UserDataMethods<'lua, Self>>(methods: &mut M) {
         methods.add_method("get_kind", |_lua_ctx, this, ()| {
-            Ok(this.borrow().kind.ast_name())
+            Ok(this.borrow().kind.variant_name())
         });
 
         methods.add_method("get_id", |lua_ctx, this, ()| {
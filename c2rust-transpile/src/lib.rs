@@ -18,6 +18,7 @@ use std::io;
 use std::io::prelude::*;
 use std::path::{Path, PathBuf};
 use std::process;
+use std::time::Instant;
 
 use crate::compile_cmds::CompileCmd;
 use failure::Error;
@@ -55,6 +56,7 @@ pub struct TranspilerConfig {
     pub dump_structures: bool,
     pub verbose: bool,
     pub debug_ast_exporter: bool,
+    pub intern_ast_strings: bool,
 
     // Options that control translation
     pub incremental_relooper: bool,
@@ -488,11 +490,13 @@ fn transpile_single(
     }
 
     // Extract the untyped AST from the CBOR file
+    let export_start = Instant::now();
     let untyped_context = match ast_exporter::get_untyped_ast(
         input_path.as_path(),
         cc_db,
         extra_clang_args,
         tcfg.debug_ast_exporter,
+        tcfg.intern_ast_strings,
     ) {
         Err(e) => {
             warn!(
@@ -504,8 +508,15 @@ fn transpile_single(
         }
         Ok(cxt) => cxt,
     };
+    // scripts/integration_test_translator.py --benchmark parses these timings
+    info!(
+        "exported the AST of {} in {:.6}s",
+        file,
+        export_start.elapsed().as_secs_f64()
+    );
 
     println!("Transpiling {}", file);
+    let translate_start = Instant::now();
 
     if tcfg.dump_untyped_context {
         println!("CBOR Clang AST");
@@ -535,8 +546,8 @@ fn transpile_single(
     let (translated_string, pragmas, crates) =
         translator::translate(typed_context, tcfg, input_path);
 
-    let mut file = match File::create(&output_path) {
-        Ok(file) => file,
+    let mut out = match File::create(&output_path) {
+        Ok(out) => out,
         Err(e) => panic!(
             "Unable to open file {} for writing: {}",
             output_path.display(),
@@ -544,7 +555,7 @@ fn transpile_single(
         ),
     };
 
-    match file.write_all(translated_string.as_bytes()) {
+    match out.write_all(translated_string.as_bytes()) {
         Ok(()) => (),
         Err(e) => panic!(
             "Unable to write translation to file {}: {}",
@@ -552,6 +563,11 @@ fn transpile_single(
             e
         ),
     };
+    info!(
+        "translated {} in {:.6}s",
+        file,
+        translate_start.elapsed().as_secs_f64()
+    );
 
     Ok((output_path, pragmas, crates))
 }
@@ -36,6 +36,11 @@ struct Args {
     #[clap(long)]
     debug_ast_exporter: bool,
 
+    /// Have the Clang AST exporter emit each string once, in a string table,
+    /// to make its output smaller
+    #[clap(long)]
+    intern_ast_strings: bool,
+
     /// Verbose mode
     #[clap(short = 'v', long)]
     verbose: bool,
@@ -177,6 +182,7 @@ fn main() {
         dump_cfg_liveness: args.dump_cfgs_liveness,
         dump_structures: args.dump_structures,
         debug_ast_exporter: args.debug_ast_exporter,
+        intern_ast_strings: args.intern_ast_strings,
         verbose: args.verbose,
 
         incremental_relooper: !args.no_incremental_relooper,
@@ -1,5 +1,4 @@
 #!/usr/bin/env python3
-import json
 import os
 import sys
 from plumbum.cmd import mv, mkdir, sed, rustc, cargo, rm
@@ -10,6 +9,7 @@ JSON_C_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'repo'))
 
 sys.path.append(os.path.join(JSON_C_DIR, '../../../scripts'))
 from common import *
+from compile_db import CompileDb, drop_flags, write as write_compile_db
 
 
 # List of c2rust-refactor commands to run.
@@ -84,23 +84,10 @@ def main():
 
 
     # Patch compile_commands to remove certain flags
-    with open('compile_commands.json') as f:
-        cc_json = json.load(f)
-
-    for entry in cc_json:
-        if 'arguments' not in entry:
-            continue
-
-        new_args = []
-        for arg in entry['arguments']:
-            if arg in ('-Werror', '-D_FORTIFY_SOURCE=2'):
-                continue
-            new_args.append(arg)
-
-        entry['arguments'] = new_args
-
-    with open('compile_commands.json', 'w') as f:
-        json.dump(cc_json, f, indent=4)
+    db = CompileDb('compile_commands.json')
+    write_compile_db(db.path,
+                     drop_flags(db, {'-Werror', '-D_FORTIFY_SOURCE=2'}),
+                     indent=4)
 
 
     # Remove object files that will confuse `transpile`
@@ -6,6 +6,7 @@
 
 from shutil import rmtree
 from common import *
+import compile_db
 from collections import namedtuple
 
 
@@ -22,12 +23,7 @@ class CompileCommandsBuilder(object):
     def write_result(self, outdir: str) -> None:
         assert os.path.isdir(outdir), "No such dir: " + outdir
         outpath = os.path.join(outdir, config.CC_DB_JSON)
-        outjson = json.dumps(self.entries, indent=2)
-        # print(outjson)
-        with open(outpath, "w") as ccdb_fh:
-            ccdb_fh.writelines(outjson)
-
-        return outpath
+        return compile_db.write(outpath, self.entries)
 
 
 def generate_html_entries_header(snudown: str):
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Report what the CBOR files output by the AST exporter are made of.
+
+The file is streamed one node at a time so that the serialized size of each
+node can be measured. Sizes are then aggregated per tag, per source file and
+per top-level declaration. Two exports can also be compared.
+
+Examples:
+
+    cbor_profile.py report foo.c.cbor
+    cbor_profile.py report --json foo.c.cbor > foo.json
+    cbor_profile.py diff before/foo.c.cbor after/foo.c.cbor
+"""
+
+import sys
+import json
+import argparse
+
+from collections import defaultdict
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from common import die
+from cborpp import TAGS, FORMAT_VERSION_STRING_TABLE, cbor2, resolve_strings
+
+# Type IDs carry qualifiers in their low bits, see `TypeNode::ID_MASK` in
+# c2rust-ast-exporter/src/clang_ast.rs.
+TYPE_ID_MASK = ~0b111
+# Tags below this value denote AST nodes, the rest denote type nodes.
+FIRST_TYPE_TAG = 400
+
+CBOR_ARRAY_6 = 0x86
+CBOR_ARRAY_8 = 0x88
+CBOR_ARRAY_INDEFINITE = 0x9f
+CBOR_BREAK = 0xff
+
+UNATTRIBUTED = "<unattributed>"
+
+# counts and serialized bytes
+Stat = List[int]
+Table = Dict[str, Stat]
+
+
+def _parse_args() -> argparse.Namespace:
+    """
+    define and parse command line arguments here.
+    """
+    desc = 'Profile the size of CBOR files output by the AST exporter.'
+    parser = argparse.ArgumentParser(description=desc)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    report = subparsers.add_parser(
+        'report', help="report node counts and bytes of one export.")
+    report.add_argument('cbor', help="cbor file to profile.")
+
+    diff = subparsers.add_parser(
+        'diff', help="compare node counts and bytes of two exports.")
+    diff.add_argument('old', help="baseline cbor file.")
+    diff.add_argument('new', help="cbor file to compare to the baseline.")
+
+    for sub in (report, diff):
+        sub.add_argument('--top', '-n', dest='top', type=int, default=20,
+                         help="rows to print per table, 0 prints all.")
+        sub.add_argument('--json', dest='json', default=False,
+                         action='store_true',
+                         help="print the tables as JSON.")
+    return parser.parse_args()
+
+
+def tag_name(tag: int) -> str:
+    return TAGS.get(tag, "MissingTag({})".format(tag))
+
+
+class Node:
+    """
+    Compact summary of a single AST or type node.
+    """
+    __slots__ = ('tag', 'size', 'fileid', 'refs', 'name')
+
+    def __init__(self, tag: int, size: int, fileid: Optional[int],
+                 refs: List[int], name: Any) -> None:
+        self.tag = tag
+        self.size = size
+        self.fileid = fileid
+        self.refs = refs
+        self.name = name
+
+
+def _summarize(entry: List[Any], size: int) -> Node:
+    tag = entry[1]
+    if tag < FIRST_TYPE_TAG:
+        # see `encode_entry_raw` in AstExporter.cpp for the layout
+        refs = [c for c in entry[2] if c is not None]
+        if entry[8] is not None:
+            refs.append(entry[8] & TYPE_ID_MASK)
+        refs.extend(entry[10])
+        fileid = entry[3]
+        extras = entry[12:]
+    else:
+        # type extras mix references with sizes and flags; the latter
+        # never match a node ID so they are harmless here.
+        refs = [e & TYPE_ID_MASK for e in entry[2:]
+                if isinstance(e, int) and not isinstance(e, bool)]
+        fileid = None
+        extras = []
+    # names are either inline or references into the string table
+    name = next((e for e in extras
+                 if isinstance(e, (str, cbor2.CBORTag))), None)
+    return Node(tag, size, fileid, refs, name)
+
+
+def _expect_byte(fp: BinaryIO, expected: int, what: str) -> None:
+    byte = fp.read(1)
+    if not byte or byte[0] != expected:
+        die("unexpected CBOR layout: expected {}".format(what))
+
+
+class Export:
+    """
+    The nodes of one exported translation unit along with the sizes of the
+    sections that make up the file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.nodes: Dict[int, Node] = {}
+        self.top_nodes: List[int] = []
+        self.files: List[str] = []
+        self.strings: List[str] = []
+        self.sections: Dict[str, int] = {}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, 'rb') as fp:
+                self._stream(fp)
+        except FileNotFoundError:
+            die("file not found: " + self.path)
+        except cbor2.CBORDecodeError as de:
+            die("CBOR decoding error in {}: {}".format(self.path, de))
+
+    def _stream(self, fp: BinaryIO) -> None:
+        decoder = cbor2.CBORDecoder(fp)
+        byte = fp.read(1)
+        if not byte or byte[0] not in (CBOR_ARRAY_6, CBOR_ARRAY_8):
+            die("unexpected CBOR layout: expected top-level array")
+        # 0. format version 2 adds a version field and a string table
+        string_table = byte[0] == CBOR_ARRAY_8
+        if string_table:
+            version = decoder.decode()
+            if version != FORMAT_VERSION_STRING_TABLE:
+                die("unsupported AST export format version {}".format(
+                    version))
+
+        # 1. all of the AST and type nodes, one at a time
+        begin = fp.tell()
+        _expect_byte(fp, CBOR_ARRAY_INDEFINITE, "node array")
+        while True:
+            start = fp.tell()
+            byte = fp.read(1)
+            if not byte:
+                die("unexpected end of file in node array")
+            if byte[0] == CBOR_BREAK:
+                break
+            fp.seek(start)
+            entry = decoder.decode()
+            self.nodes[entry[0]] = _summarize(entry, fp.tell() - start)
+        self.sections["nodes"] = fp.tell() - begin
+
+        # 2.-6. the remaining sections are small enough to decode whole
+        def section(name: str) -> Any:
+            start = fp.tell()
+            value = decoder.decode()
+            self.sections[name] = fp.tell() - start
+            return value
+
+        self.top_nodes = section("top_nodes")
+        files = section("files")
+        section("comments")
+        section("va_list_kind")
+        section("target")
+        if string_table:
+            self.strings = section("strings")
+        self.files = [path for path, _ in resolve_strings(files, self.strings)]
+        self.sections["total"] = fp.tell()
+
+    def file_name(self, fileid: Optional[int]) -> str:
+        if fileid is None or fileid >= len(self.files):
+            return UNATTRIBUTED
+        return self.files[fileid] or "<built-in>"
+
+    def owners(self) -> Dict[int, int]:
+        """
+        Attribute every node reachable from a top-level declaration to that
+        declaration. A node shared by several declarations, such as a type,
+        is attributed to the first one that reaches it.
+        """
+        owner = {decl: decl for decl in self.top_nodes if decl in self.nodes}
+        for decl in self.top_nodes:
+            stack = [decl]
+            while stack:
+                node = self.nodes.get(stack.pop())
+                if node is None:
+                    continue
+                for ref in node.refs:
+                    if ref in self.nodes and ref not in owner:
+                        owner[ref] = decl
+                        stack.append(ref)
+        return owner
+
+    def decl_label(self, decl: int) -> str:
+        node = self.nodes[decl]
+        name = resolve_strings(node.name, self.strings)
+        return "{} {} ({})".format(tag_name(node.tag),
+                                   name or "<anonymous>",
+                                   self.file_name(node.fileid))
+
+    def tables(self) -> Dict[str, Table]:
+        by_tag: Table = defaultdict(lambda: [0, 0])
+        by_file: Table = defaultdict(lambda: [0, 0])
+        by_decl: Table = defaultdict(lambda: [0, 0])
+        owner = self.owners()
+
+        for node_id, node in self.nodes.items():
+            decl = owner.get(node_id)
+            if decl is None:
+                decl_key = file_key = UNATTRIBUTED
+            else:
+                decl_key = self.decl_label(decl)
+                file_key = self.file_name(self.nodes[decl].fileid)
+            for table, key in ((by_tag, tag_name(node.tag)),
+                               (by_file, file_key),
+                               (by_decl, decl_key)):
+                table[key][0] += 1
+                table[key][1] += node.size
+
+        sections = {k: [1, v] for k, v in self.sections.items()}
+        return {
+            "sections": sections,
+            "tags": dict(by_tag),
+            "files": dict(by_file),
+            "decls": dict(by_decl),
+        }
+
+
+def _rows(table: Table, top: int) -> List[Tuple[str, Stat]]:
+    rows = sorted(table.items(), key=lambda kv: (-abs(kv[1][1]), kv[0]))
+    return rows[:top] if top > 0 else rows
+
+
+def _print_report(export: Export, tables: Dict[str, Table], top: int) -> None:
+    total = export.sections["total"] or 1
+    print("{}: {} bytes, {} nodes, {} top-level decls".format(
+        export.path, export.sections["total"], len(export.nodes),
+        len(export.top_nodes)))
+    for title, table in tables.items():
+        print()
+        print("{:>10} {:>12} {:>7}  {}".format("count", "bytes", "%", title))
+        for key, (count, size) in _rows(table, top):
+            print("{:>10} {:>12} {:>6.1f}%  {}".format(
+                count, size, 100.0 * size / total, key))
+
+
+def _diff_tables(old: Dict[str, Table],
+                 new: Dict[str, Table]) -> Dict[str, Table]:
+    diff = {}
+    for title in new:
+        delta: Table = {}
+        for key in set(old[title]) | set(new[title]):
+            o = old[title].get(key, [0, 0])
+            n = new[title].get(key, [0, 0])
+            if o != n:
+                delta[key] = [n[0] - o[0], n[1] - o[1]]
+        diff[title] = delta
+    return diff
+
+
+def _print_diff(old: Export, new: Export,
+                diff: Dict[str, Table], top: int) -> None:
+    print("{}: {} bytes".format(old.path, old.sections["total"]))
+    print("{}: {} bytes ({:+d})".format(
+        new.path, new.sections["total"],
+        new.sections["total"] - old.sections["total"]))
+    for title, table in diff.items():
+        print()
+        print("{:>10} {:>12}  {}".format("count", "bytes", title))
+        for key, (count, size) in _rows(table, top):
+            print("{:>+10d} {:>+12d}  {}".format(count, size, key))
+
+
+def _as_json(tables: Dict[str, Table], top: int) -> Dict[str, Any]:
+    return {
+        title: [{"key": key, "count": count, "bytes": size}
+                for key, (count, size) in _rows(table, top)]
+        for title, table in tables.items()
+    }
+
+
+def _main() -> None:
+    args = _parse_args()
+
+    if args.command == "report":
+        export = Export(args.cbor)
+        tables = export.tables()
+        if args.json:
+            json.dump(_as_json(tables, args.top), sys.stdout, indent=2)
+            print()
+        else:
+            _print_report(export, tables, args.top)
+    else:
+        old, new = Export(args.old), Export(args.new)
+        diff = _diff_tables(old.tables(), new.tables())
+        if args.json:
+            json.dump(_as_json(diff, args.top), sys.stdout, indent=2)
+            print()
+        else:
+            _print_diff(old, new, diff, args.top)
+
+
+if __name__ == "__main__":
+    _main()
@@ -6,6 +6,8 @@ import errno
 import pprint
 import argparse
 
+from typing import Any, List
+
 from common import die
 
 try:
@@ -33,17 +35,23 @@ def _parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
+# keep in sync with c2rust-ast-exporter/src/ast_tags.hpp
 TAGS = {
     0: "TagFunctionDecl",
     1: "TagParmVarDecl",
     2: "TagVarDecl",
-    3: "TagRecordDecl",
+    3: "TagStructDecl",
     4: "TagFieldDecl",
 
     5: "TagEnumDecl",
     6: "TagEnumConstantDecl",
     7: "TagTypedefDecl",
     8: "TagUnionDecl",
+    9: "TagNonCanonicalDecl",
+
+    10: "TagStaticAssertDecl",
+    11: "TagMacroObjectDef",
+    12: "TagMacroFunctionDef",
 
     100: "TagCompoundStmt",
     101: "TagReturnStmt",
@@ -58,11 +66,14 @@ TAGS = {
     109: "TagDeclStmt",
 
     110: "TagBreakStmt",
-    111: "TagEnuTagCaseStmtmDecl",
+    111: "TagCaseStmt",
     112: "TagContinueStmt",
     113: "TagDefaultStmt",
     114: "TagDoStmt",
 
+    115: "TagAsmStmt",
+    116: "TagAttributedStmt",
+
     200: "TagBinaryOperator",
     201: "TagUnaryOperator",
     202: "TagDeclRefExpr",
@@ -79,9 +90,21 @@ TAGS = {
     211: "TagMemberExpr",
     212: "TagParenExpr",
     213: "TagUnaryExprOrTypeTraitExpr",
-    214: "TagCompoundLiteralExpr",
+    214: "TagOffsetOfExpr",
+
+    215: "TagCompoundLiteralExpr",
+    216: "TagPredefinedExpr",
+    217: "TagVAArgExpr",
+    218: "TagShuffleVectorExpr",
+    219: "TagConvertVectorExpr",
 
-    215: "TagPredefinedExpr",
+    220: "TagDesignatedInitExpr",
+    221: "TagFullExpr",
+    222: "TagConstantExpr",
+    223: "TagStmtExpr",
+    224: "TagChooseExpr",
+
+    225: "TagAtomicExpr",
 
     300: "TagIntegerLiteral",
     301: "TagStringLiteral",
@@ -100,57 +123,99 @@ TAGS = {
     506: "TagULong",
     507: "TagULongLong",
     508: "TagPointer",
-    509: "TagStructType",
-
-    510: "TagUnionType",
-    511: "TagDouble",
-    512: "TagLongDouble",
-    513: "TagFloat",
-    514: "TagConstantArrayType",
-
-    515: "TagVariableArrayType",
-    516: "TagIncompleteArrayType",
-    517: "TagEnumType",
-    518: "TagFunctionType",
-    519: "TagTypeOfType",
-
-    520: "TagTypedefType",
-    521: "TagElaboratedType",
-    522: "TagUChar",
-    523: "TagSChar",
-    524: "TagChar",
-
-    525: "TagVoid",
-    526: "TagBool",
-    527: "TagDecayedType",
-    528: "TagParenType",
-    529: "TagSWChar",
-
-    530: "TagUWChar",
-    531: "TagInt128",
-    532: "TagUInt128",
-    533: "TagBuiltinFn",
-    534: "TagAttributedType",
-
-    535: "TagBlockPointer",
-
-    600: "TagUWChar",
-    601: "TagInt128",
-    602: "TagUInt128",
-    603: "TagBuiltinFn",
-    604: "TagAttributedType",
+    509: "TagReference",
+
+    510: "TagStructType",
+    511: "TagUnionType",
+    512: "TagDouble",
+    513: "TagLongDouble",
+    514: "TagFloat",
+
+    515: "TagConstantArrayType",
+    516: "TagVariableArrayType",
+    517: "TagIncompleteArrayType",
+    518: "TagEnumType",
+    519: "TagFunctionType",
+
+    520: "TagTypeOfType",
+    521: "TagVectorType",
+    522: "TagTypedefType",
+    523: "TagElaboratedType",
+    524: "TagUChar",
+
+    525: "TagSChar",
+    526: "TagChar",
+    527: "TagVoid",
+    528: "TagBool",
+    529: "TagDecayedType",
+
+    530: "TagParenType",
+    531: "TagSWChar",
+    532: "TagUWChar",
+    533: "TagInt128",
+    534: "TagUInt128",
+
+    535: "TagBuiltinFn",
+    536: "TagAttributedType",
+    537: "TagBlockPointer",
+    538: "TagComplexType",
+    539: "TagHalf",
+
+    540: "TagBFloat16",
+    541: "TagSveCount",
+    542: "TagSveBool",
+    543: "TagSveBoolx2",
+    544: "TagSveBoolx4",
+
+    600: "TagAscii",
+    601: "TagWide",
+    602: "TagUTF8",
+    603: "TagUTF16",
+    604: "TagUTF32",
+
+    605: "TagUnevaluated",
 }
 
 
+# keep in sync with ExportFormatVersion and CborExportTag in ast_tags.hpp
+FORMAT_VERSION_STRING_TABLE = 2
+STRING_REF_TAG = 49858
+
+
+def resolve_strings(value: Any, strings: List[str]) -> Any:
+    """
+    replace references into the string table with the strings themselves.
+    """
+    if isinstance(value, list):
+        return [resolve_strings(v, strings) for v in value]
+    if isinstance(value, cbor2.CBORTag) and value.tag == STRING_REF_TAG:
+        return strings[value.value]
+    return value
+
+
+def import_format(array: List[Any]) -> List[Any]:
+    """
+    convert the sections of any supported format version to the version 1
+    layout, which has no version field and no string table.
+    """
+    if not isinstance(array[0], int):
+        return array
+    if array[0] != FORMAT_VERSION_STRING_TABLE:
+        die("unsupported AST export format version {}".format(array[0]))
+    strings = array[-1]
+    return resolve_strings(array[1:-1], strings)
+
+
 def _main() -> None:
     args = _parse_args()
     try:
         array = cbor2.load(args.cbor)
     except cbor2.CBORDecodeError as de:
         die("CBOR decoding error:" + str(de))
+    array = import_format(array)
 
-    # translate tags
-    for e in array:
+    # translate tags of the AST and type nodes
+    for e in array[0]:
         assert len(e) >= 2
         e[1] = TAGS[e[1]] if e[1] in TAGS else "MissingTag"
 
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+"""
+Collects the build commands that the wrappers send over a Unix socket in
+"collector" capture mode and appends them to the journal in the build
+commands directory. The first wrapper of a build starts the collector, which
+exits once no command has arrived for a while.
+"""
+
+import fcntl
+import os
+import socket
+import sys
+import time
+
+import common
+
+LOCK_NAME = "collector.lock"
+
+# seconds without any command before the collector exits
+IDLE_TIMEOUT = float(os.environ.get("BUILD_COMMANDS_COLLECTOR_TIMEOUT", 30))
+
+# How long a new collector waits for one that is shutting down to release
+# the lock; less than the wrappers' COLLECTOR_START_TIMEOUT.
+LOCK_TIMEOUT = 1.0
+
+
+def _receive(conn):
+    chunks = []
+    with conn:
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _lock(lock_fd, sock_path):
+    """
+    Take the collector lock, unless another collector serves `sock_path`.
+    A collector that is shutting down holds the lock after it removed its
+    socket, while it drains the last connections, so wait for it briefly
+    rather than leave the wrapper that started us without a collector.
+    """
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            pass
+        if os.path.exists(sock_path) or time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+
+
+def serve(build_commands_dir):
+    # Only one collector may serve a directory. Wrappers that race to start
+    # one leave all but the first to exit here.
+    sock_path = os.path.join(build_commands_dir, common.SOCKET_NAME)
+    lock_fd = os.open(os.path.join(build_commands_dir, LOCK_NAME),
+                      os.O_RDWR | os.O_CREAT, 0o644)
+    if not _lock(lock_fd, sock_path):
+        os.close(lock_fd)
+        return
+
+    journal_path = os.path.join(build_commands_dir, common.JOURNAL_NAME)
+    # a socket left behind by a collector that died
+    if os.path.exists(sock_path):
+        os.unlink(sock_path)
+
+    journal = os.open(journal_path,
+                      os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(sock_path)
+        server.listen(socket.SOMAXCONN)
+        server.settimeout(IDLE_TIMEOUT)
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                break
+            conn.settimeout(None)
+            os.write(journal, _receive(conn))
+
+        # New wrappers can no longer connect once the socket is gone and
+        # start another collector instead; drain those that already did.
+        os.unlink(sock_path)
+        server.setblocking(False)
+        while True:
+            try:
+                conn, _ = server.accept()
+            except BlockingIOError:
+                break
+            conn.setblocking(True)
+            os.write(journal, _receive(conn))
+    finally:
+        server.close()
+        os.close(journal)
+        os.close(lock_fd)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit("Usage: collector.py <build commands directory>")
+    serve(sys.argv[1])
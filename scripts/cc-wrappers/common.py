@@ -1,21 +1,32 @@
-import hashlib
 import json
 import os
-import subprocess
+import socket
 import sys
+import time
 
-def run(build_type):
-    build_commands_dir = os.environ.get("BUILD_COMMANDS_DIRECTORY",
-                                        "/tmp/build_commands")
-    if not os.path.exists(build_commands_dir):
-        os.mkdir(build_commands_dir)
+# How the wrappers record build commands, selected via the
+# BUILD_COMMANDS_CAPTURE environment variable:
+#  - "files" (default) writes one JSON file per unique command,
+#  - "journal" appends one JSON line per command to a single journal file,
+#  - "collector" sends each command to a long-lived collector process that
+#    appends it to the journal; the first wrapper starts the collector.
+CAPTURE_FILES = "files"
+CAPTURE_JOURNAL = "journal"
+CAPTURE_COLLECTOR = "collector"
+
+# Keep in sync with scripts/convert_build_commands.py
+JOURNAL_NAME = "build_commands.jsonl"
+SOCKET_NAME = "collector.sock"
+
+# How long a wrapper waits for a freshly started collector to accept
+# connections before appending to the journal itself.
+COLLECTOR_START_TIMEOUT = 2.0
+
+
+def write_file(build_commands_dir, build_info):
+    # only the per-command layout pays for hashing
+    import hashlib
 
-    command = os.path.basename(sys.argv[0])
-    build_info = {
-        "type": build_type,
-        "directory": os.getcwd(),
-        "arguments": [command] + sys.argv[1:],
-    }
     build_json = json.dumps(build_info, indent=4)
 
     # Hash the contents of the JSON file and use that as the file name
@@ -28,6 +39,83 @@ def run(build_type):
     with open(build_file, 'w') as f:
         f.write(build_json)
 
+
+def append_to_journal(build_commands_dir, record):
+    # A single write to a file opened with O_APPEND is not interleaved with
+    # the writes of concurrent wrappers.
+    journal = os.path.join(build_commands_dir, JOURNAL_NAME)
+    fd = os.open(journal, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, record)
+    finally:
+        os.close(fd)
+
+
+def _send(sock_path, record):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(sock_path)
+        sock.sendall(record)
+
+
+def _start_collector(build_commands_dir):
+    import subprocess
+
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    collector = os.path.join(script_dir, "collector.py")
+    # Detach the collector so that it neither holds on to the build's
+    # output pipes nor gets killed along with this wrapper.
+    subprocess.Popen([sys.executable, collector, build_commands_dir],
+                     stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+
+def send_to_collector(build_commands_dir, record):
+    sock_path = os.path.join(build_commands_dir, SOCKET_NAME)
+    try:
+        _send(sock_path, record)
+        return
+    except OSError:
+        pass
+
+    _start_collector(build_commands_dir)
+    deadline = time.monotonic() + COLLECTOR_START_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.01)
+        try:
+            _send(sock_path, record)
+            return
+        except OSError:
+            pass
+
+    # the collector did not come up, so don't lose the command
+    append_to_journal(build_commands_dir, record)
+
+
+def run(build_type):
+    build_commands_dir = os.environ.get("BUILD_COMMANDS_DIRECTORY",
+                                        "/tmp/build_commands")
+    os.makedirs(build_commands_dir, exist_ok=True)
+
+    command = os.path.basename(sys.argv[0])
+    build_info = {
+        "type": build_type,
+        "directory": os.getcwd(),
+        "arguments": [command] + sys.argv[1:],
+    }
+
+    capture = os.environ.get("BUILD_COMMANDS_CAPTURE", CAPTURE_FILES)
+    if capture in (CAPTURE_JOURNAL, CAPTURE_COLLECTOR):
+        record = (json.dumps(build_info) + "\n").encode("utf-8")
+        if capture == CAPTURE_COLLECTOR:
+            send_to_collector(build_commands_dir, record)
+        else:
+            append_to_journal(build_commands_dir, record)
+    else:
+        write_file(build_commands_dir, build_info)
+
     script_dir = os.path.dirname(os.path.realpath(__file__))
     b_arg = ["-B" + script_dir] if build_type == "cc" else []
-    return subprocess.call([command] + b_arg + sys.argv[1:])
+    # Replace the wrapper with the real tool instead of waiting on it.
+    os.execvp(command, [command] + b_arg + sys.argv[1:])
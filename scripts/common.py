@@ -4,15 +4,18 @@ import re
 import sys
 import json
 import errno
+import hashlib
 import psutil
+import select
 import signal
 import logging
 import argparse
 import platform
+import tempfile
 import multiprocessing
 
 from pathlib import Path
-from typing import Any, Dict, List, NoReturn, Optional, Tuple, Union
+from typing import Any, Callable, Dict, List, NoReturn, Optional, Tuple, Union
 
 import plumbum as pb
 
@@ -318,6 +321,95 @@ def _invoke(console_output: bool, cmd: Command, *arguments: Union[str, List[str]
         die(msg, pee.retcode)
 
 
+class Jobserver:
+    """
+    A GNU make jobserver that limits the number of jobs run by concurrent
+    builds together. Each build takes a token before it starts, and the
+    `make` and `cargo` processes it runs take more tokens for their parallel
+    jobs from the same pool.
+    """
+
+    def __init__(self, jobs: int) -> None:
+        self.jobs = jobs
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_inheritable(self.read_fd, True)
+        os.set_inheritable(self.write_fd, True)
+        os.write(self.write_fd, b'+' * jobs)
+
+    @property
+    def fds(self) -> List[int]:
+        return [self.read_fd, self.write_fd]
+
+    def makeflags(self) -> str:
+        # `--jobserver-fds` is the spelling that make < 4.2 understands
+        return ' -j{} --jobserver-auth={r},{w} --jobserver-fds={r},{w}'.format(
+            self.jobs, r=self.read_fd, w=self.write_fd)
+
+    def acquire(self, greedy: bool = False) -> bytes:
+        """
+        Wait for a token. With `greedy`, also take every other token that is
+        free right now, for commands that can't use the jobserver themselves.
+        """
+        tokens = os.read(self.read_fd, 1)
+        while greedy and len(tokens) < self.jobs:
+            readable, _, _ = select.select([self.read_fd], [], [], 0)
+            if not readable:
+                break
+            tokens += os.read(self.read_fd, 1)
+        return tokens
+
+    def release(self, tokens: bytes) -> None:
+        os.write(self.write_fd, tokens)
+
+
+def invoke_with_jobserver(cmd: Command, jobserver: Jobserver,
+                          *arguments: str) -> None:
+    """
+    run `cmd` with its output on the console and `jobserver` in its
+    MAKEFLAGS, so that the make or cargo it runs shares the jobserver.
+    """
+    # plumbum closes inherited file descriptors, so pass the jobserver's
+    # explicitly
+    cmd = cmd.with_env(MAKEFLAGS=jobserver.makeflags())
+    retcode = cmd[arguments].popen(stdin=None, stdout=None, stderr=None,
+                                   pass_fds=jobserver.fds).wait()
+    if retcode != 0:
+        die("cmd exited with code {}: {}".format(retcode, cmd[arguments]),
+            retcode)
+
+
+def write_atomically(path: str, dump: Callable[[Any], None]) -> None:
+    """
+    replace the file at `path` with what `dump` writes to the text file
+    object it is passed, so that readers never see a partial file.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix="." + name + ".",
+                                    dir=directory, text=True)
+    try:
+        with os.fdopen(fd, "w") as fh:
+            dump(fh)
+        # mkstemp only grants access to the owner
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def sha256_file(path: str) -> str:
+    """
+    hex digest of the contents of the file at `path`, read in chunks.
+    """
+    hm = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            hm.update(chunk)
+    return hm.hexdigest()
+
+
 def get_cmd_or_die(cmd: str) -> Command:
     """
     lookup named command or terminate script.
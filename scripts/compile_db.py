@@ -0,0 +1,399 @@
+"""
+Read, query and rewrite compilation databases (`compile_commands.json`).
+
+Databases are streamed one entry at a time, so scanning a large database does
+not mean materializing it. Lookups by source file, directory and output go
+through an SQLite index that is stored next to the database and rebuilt
+whenever the database's mtime or size changes; a lookup then only reads the
+index rows and the entries it returns. Transformations are generators over
+entries, and `write` replaces a database atomically, so a database can be
+rewritten in place:
+
+    db = CompileDb("compile_commands.json")
+    write(db.path, drop_flags(db, {"-Werror"}))
+"""
+
+import codecs
+import json
+import os
+import shlex
+import sqlite3
+import tempfile
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, \
+    Set, Tuple
+
+from common import write_atomically
+
+Entry = Dict[str, Any]
+
+# Bump when the layout of the index changes.
+INDEX_VERSION = 2
+
+_CHUNK_SIZE = 1 << 20
+_WHITESPACE = " \t\n\r"
+
+
+def _normpath(directory: str, path: str) -> str:
+    return os.path.normpath(os.path.join(directory, path))
+
+
+def abs_file(entry: Entry) -> str:
+    """
+    The absolute path of the source file compiled by `entry`.
+    """
+    return _normpath(entry["directory"], entry["file"])
+
+
+def abs_output(entry: Entry) -> Optional[str]:
+    output = entry.get("output")
+    return _normpath(entry["directory"], output) if output else None
+
+
+def arguments(entry: Entry) -> List[str]:
+    """
+    The compiler invocation of `entry`, whether it is stored as `arguments`
+    or as a `command` string.
+    """
+    if "arguments" in entry:
+        return list(entry["arguments"])
+    return shlex.split(entry["command"])
+
+
+def _with_arguments(entry: Entry, args: List[str]) -> Entry:
+    entry = entry.copy()
+    if "arguments" in entry:
+        entry["arguments"] = args
+    else:
+        entry["command"] = " ".join(shlex.quote(a) for a in args)
+    return entry
+
+
+def _byte_len(text: str) -> int:
+    return len(text) if text.isascii() else len(text.encode("utf-8"))
+
+
+def _stream(path: str) -> Iterator[Tuple[int, int, Entry]]:
+    """
+    Yield the byte offset, byte length and value of each entry of the JSON
+    array in `path`.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    # byte offset of `buf[pos]` in the file, advanced along with `pos` so
+    # that every character is only measured once
+    offset = 0
+    started = False
+    eof = False
+
+    def malformed(what: str) -> ValueError:
+        return ValueError("malformed compilation database {}: {}".format(
+            path, what))
+
+    with open(path, "rb") as fp:
+        def fill() -> bool:
+            nonlocal buf, pos, eof
+            if eof:
+                return False
+            chunk = fp.read(_CHUNK_SIZE)
+            if not chunk:
+                # keep `buf` and `pos` as they are, the caller's offsets
+                # into `buf` stay valid
+                eof = True
+                buf += utf8.decode(b"", final=True)
+                return False
+            # drop what has been consumed before growing the buffer
+            buf = buf[pos:]
+            pos = 0
+            buf += utf8.decode(chunk)
+            return True
+
+        while True:
+            start = pos
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            # whitespace is ASCII
+            offset += pos - start
+            if pos == len(buf):
+                if fill():
+                    continue
+                raise malformed("unexpected end of file")
+
+            char = buf[pos]
+            if not started:
+                if char != "[":
+                    raise malformed("expected an array")
+                started = True
+                pos += 1
+                offset += 1
+                continue
+            if char == "]":
+                return
+            if char == ",":
+                pos += 1
+                offset += 1
+                continue
+
+            try:
+                entry, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                # the entry may straddle the end of the buffer
+                if fill():
+                    continue
+                raise malformed(str(e))
+            if end == len(buf) and fill():
+                # a number or literal may continue in the next chunk
+                continue
+            length = _byte_len(buf[pos:end])
+            yield offset, length, entry
+            pos = end
+            offset += length
+
+
+class CompileDb:
+    """
+    A compilation database on disk.
+
+    Iterating over it streams its entries; the `by_*` lookups use the index,
+    an SQLite database next to it, so that a lookup only reads the index
+    rows and the entries it returns.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = os.path.abspath(path)
+        self._index: Optional[sqlite3.Connection] = None
+        self._index_key: Optional[str] = None
+
+    @property
+    def index_path(self) -> str:
+        directory, name = os.path.split(self.path)
+        return os.path.join(directory, "." + name + ".index")
+
+    def __iter__(self) -> Iterator[Entry]:
+        for _, _, entry in _stream(self.path):
+            yield entry
+
+    def __len__(self) -> int:
+        return self.index.execute("SELECT count(*) FROM spans").fetchone()[0]
+
+    def _key(self) -> str:
+        st = os.stat(self.path)
+        return json.dumps([INDEX_VERSION, st.st_mtime_ns, st.st_size])
+
+    def _build_index(self, db: sqlite3.Connection, key: str) -> None:
+        db.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE meta (key TEXT NOT NULL);
+            CREATE TABLE spans (
+                id INTEGER PRIMARY KEY, offset INTEGER, length INTEGER);
+            CREATE TABLE lookup (tbl TEXT, key TEXT, id INTEGER);
+        """)
+        spans = []
+        rows = []
+        for i, (offset, length, entry) in enumerate(_stream(self.path)):
+            spans.append((i, offset, length))
+            source = abs_file(entry)
+            keys = {
+                "file": source,
+                "basename": os.path.basename(source),
+                "directory": os.path.normpath(entry["directory"]),
+                "output": abs_output(entry),
+            }
+            rows.extend((table, key, i) for table, key in keys.items()
+                        if key is not None)
+        db.executemany("INSERT INTO spans VALUES (?, ?, ?)", spans)
+        db.executemany("INSERT INTO lookup VALUES (?, ?, ?)", rows)
+        # created last, which is faster than updating it row by row
+        db.execute("CREATE INDEX lookup_key ON lookup (tbl, key)")
+        db.execute("INSERT INTO meta VALUES (?)", (key,))
+        db.commit()
+
+    def _open_index(self, key: str) -> sqlite3.Connection:
+        db = sqlite3.connect(self.index_path)
+        try:
+            row = db.execute("SELECT key FROM meta").fetchone()
+            if row is not None and row[0] == key:
+                return db
+        except sqlite3.Error:
+            # missing, stale or not an index at all
+            pass
+        db.close()
+
+        # Build the index next to the old one and swap it in, so that
+        # concurrent readers see either index in full.
+        tmp_path = "{}.{}.tmp".format(self.index_path, os.getpid())
+        try:
+            db = sqlite3.connect(tmp_path)
+            try:
+                self._build_index(db, key)
+            finally:
+                db.close()
+            os.replace(tmp_path, self.index_path)
+        except sqlite3.OperationalError:
+            # The index is only a cache, so don't fail if it can't be
+            # stored, e.g. because the database lives in a read-only
+            # directory.
+            db = sqlite3.connect(":memory:")
+            self._build_index(db, key)
+            return db
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return sqlite3.connect(self.index_path)
+
+    @property
+    def index(self) -> sqlite3.Connection:
+        key = self._key()
+        if self._index is None or self._index_key != key:
+            if self._index is not None:
+                self._index.close()
+            self._index = self._open_index(key)
+            self._index_key = key
+        return self._index
+
+    def _lookup(self, table: str, key: str) -> List[Entry]:
+        spans = self.index.execute(
+            "SELECT offset, length FROM lookup JOIN spans USING (id) "
+            "WHERE tbl = ? AND key = ? ORDER BY id", (table, key)).fetchall()
+        entries = []
+        with open(self.path, "rb") as fp:
+            for offset, length in spans:
+                fp.seek(offset)
+                entries.append(json.loads(fp.read(length).decode("utf-8")))
+        return entries
+
+    def by_file(self, path: str) -> List[Entry]:
+        """
+        Entries compiling `path`, relative to the current directory.
+        """
+        return self._lookup("file", os.path.abspath(path))
+
+    def by_basename(self, name: str) -> List[Entry]:
+        return self._lookup("basename", name)
+
+    def by_directory(self, directory: str) -> List[Entry]:
+        """
+        Entries run from `directory`, relative to the current directory.
+        """
+        return self._lookup("directory", os.path.abspath(directory))
+
+    def by_output(self, path: str) -> List[Entry]:
+        """
+        Entries producing `path`, relative to the current directory.
+        """
+        return self._lookup("output", os.path.abspath(path))
+
+
+def drop_flags(entries: Iterable[Entry],
+               flags: Set[str]) -> Iterator[Entry]:
+    """
+    Remove the arguments in `flags` from each compiler invocation.
+    """
+    for entry in entries:
+        args = arguments(entry)
+        kept = [arg for arg in args if arg not in flags]
+        yield entry if len(kept) == len(args) \
+            else _with_arguments(entry, kept)
+
+
+def retarget(entries: Iterable[Entry], old_dir: str,
+             new_dir: str) -> Iterator[Entry]:
+    """
+    Rewrite the paths under `old_dir` to paths under `new_dir`, e.g. after
+    copying a source tree elsewhere.
+    """
+    old_dir = os.path.normpath(old_dir)
+    new_dir = os.path.normpath(new_dir)
+
+    def move(path: str) -> str:
+        if path == old_dir or path.startswith(old_dir + os.sep):
+            return new_dir + path[len(old_dir):]
+        return path
+
+    def move_arg(arg: str) -> str:
+        # also rewrites joined options such as `-I/old/dir/include`
+        i = arg.find(old_dir)
+        return arg if i < 0 else arg[:i] + move(arg[i:])
+
+    for entry in entries:
+        entry = _with_arguments(entry, [move_arg(a) for a in arguments(entry)])
+        for key in ("directory", "file", "output"):
+            if key in entry:
+                entry[key] = move(entry[key])
+        yield entry
+
+
+def subset(entries: Iterable[Entry],
+           keep: Callable[[Entry], bool]) -> Iterator[Entry]:
+    return (entry for entry in entries if keep(entry))
+
+
+def write(path: str, entries: Iterable[Entry], indent: int = 2) -> str:
+    """
+    Atomically replace the database at `path` with `entries`, which may be
+    streamed from that same database. Returns `path`.
+    """
+    def dump(fh: Any) -> None:
+        # write entry by entry so that `entries` is never materialized
+        fh.write("[")
+        sep = "\n"
+        prefix = "\n" + " " * (indent or 0)
+        for entry in entries:
+            text = json.dumps(entry, indent=indent)
+            fh.write(sep + prefix[1:] + text.replace("\n", prefix))
+            sep = ",\n"
+        fh.write("\n]\n")
+
+    write_atomically(path, dump)
+    return path
+
+
+def _benchmark(n: int) -> None:
+    """
+    Compare loading a synthetic database of `n` entries with `json.load` to
+    looking up one entry through a fresh `CompileDb`.
+    """
+    import time
+
+    def timed(what: str, f: Callable[[], Any]) -> Any:
+        start = time.perf_counter()
+        result = f()
+        print("{:<28} {:8.3f}s".format(what, time.perf_counter() - start))
+        return result
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "compile_commands.json")
+        write(path, ({
+            "directory": "/src/dir{}".format(i % 100),
+            "file": "file{}.c".format(i),
+            "arguments": ["cc", "-c", "-O2", "-Iinclude", "-DN={}".format(i),
+                          "-o", "file{}.o".format(i), "file{}.c".format(i)],
+            "output": "file{}.o".format(i),
+        } for i in range(n)))
+        target = "/src/dir{}/file{}.c".format((n // 2) % 100, n // 2)
+
+        def load() -> List[Entry]:
+            with open(path) as fh:
+                return json.load(fh)
+
+        print("{} entries, {} bytes".format(n, os.path.getsize(path)))
+        timed("json.load", load)
+        timed("stream", lambda: sum(1 for _ in CompileDb(path)))
+        timed("build index + lookup", lambda: CompileDb(path).by_file(target))
+        found = timed("lookup (index on disk)",
+                      lambda: CompileDb(path).by_file(target))
+        assert len(found) == 1 and abs_file(found[0]) == target
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Benchmark streaming and indexed lookups against loading "
+                    "a whole synthetic compilation database.")
+    parser.add_argument("-n", "--entries", type=int, default=50000,
+                        help="number of entries of the database")
+    _benchmark(parser.parse_args().entries)
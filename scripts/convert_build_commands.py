@@ -1,11 +1,83 @@
 #!/usr/bin/python3
 
+import argparse
 import bencode
 import glob
 import json
 import os
 import sys
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import compile_db
+
+# Keep in sync with scripts/cc-wrappers/common.py
+JOURNAL_NAME = "build_commands.jsonl"
+
+# Prefix of the `file` of the pseudo-entries that describe link steps
+LINK_PREFIX = "/c2rust/link/"
+
+# gcc and clang options whose operand may be the next argument, e.g.
+# `-isystem /usr/include`. All of them also accept a joined operand, e.g.
+# `-isystem/usr/include`. Options whose operand can only be joined, like
+# `-Wl,` or `-std=`, are self-contained and need no entry here.
+JOINED_OR_SEPARATE_OPTIONS = {
+    # preprocessor
+    "-D", "-U", "-I", "-A", "-include", "-imacros", "-iquote", "-isystem",
+    "-idirafter", "-iprefix", "-iwithprefix", "-iwithprefixbefore",
+    "-isysroot", "-imultilib", "-imultiarch", "-isystem-after",
+    "-cxx-isystem", "-iframework", "-iframeworkwithsysroot", "-ivfsoverlay",
+    # dependency generation
+    "-MF", "-MT", "-MQ", "-MJ",
+    # driver
+    "-o", "-x", "-B", "-F", "-working-directory",
+    # linker
+    "-L", "-l", "-T",
+}
+
+# Options whose operand can only be the next argument.
+SEPARATE_OPTIONS = {
+    "-Xclang", "-Xlinker", "-Xassembler", "-Xpreprocessor", "-Xanalyzer",
+    "-Xcuda-fatbinary", "-Xcuda-ptxas", "-Xopenmp-target", "-mllvm",
+    "-aux-info", "-dumpbase", "-dumpbase-ext", "-dumpdir", "--param",
+    "-wrapper", "-target", "-arch", "-gcc-toolchain", "-resource-dir",
+    "-include-pch", "-serialize-diagnostics", "-dependency-file",
+    "-dependency-dot", "-module-dependency-dir", "-framework", "-e", "-u",
+    "-z",
+}
+
+# Option families whose members all take the next argument as operand, e.g.
+# `-Xarch_x86_64 -mavx`.
+SEPARATE_OPTION_PREFIXES = ("-Xarch_", "-Xopenmp-target=")
+
+# Options that only write dependency information. They are dropped because
+# they make otherwise identical compile commands differ.
+DEPENDENCY_OPTIONS = {
+    "-MF", "-MT", "-MQ", "-MJ", "-dependency-file", "-dependency-dot",
+    "-serialize-diagnostics",
+}
+DEPENDENCY_FLAGS = {"-M", "-MM", "-MD", "-MMD", "-MG", "-MP", "-MV"}
+
+# Longest first, so that e.g. `-isystem-after` wins over `-isystem`
+_JOINED_PREFIXES = sorted(JOINED_OR_SEPARATE_OPTIONS, key=len, reverse=True)
+
+
+def match_option(arg: str) -> Optional[Tuple[str, Optional[str]]]:
+    """
+    Match `arg` against the options that take an operand. Returns the option
+    and its joined operand, which is None if the operand is the next
+    argument, or None if `arg` is not such an option.
+    """
+    if arg in JOINED_OR_SEPARATE_OPTIONS or arg in SEPARATE_OPTIONS:
+        return arg, None
+    if arg.startswith(SEPARATE_OPTION_PREFIXES):
+        return arg, None
+    for prefix in _JOINED_PREFIXES:
+        if arg.startswith(prefix):
+            return prefix, arg[len(prefix):]
+    return None
+
 
 def get_fake() -> int:
     get_fake.ctr += 1  # type: ignore
@@ -17,98 +89,130 @@ class EntryInfo:
         self.entry = e
         self.new_args: List[str] = []
         self.c_inputs: List[str] = []
+        # C inputs that are only recognized as such because of `-x c`
+        self.forced_c_inputs: Set[str] = set()
         self.rest_inputs: List[str] = []
         self.libs: List[str] = []
         self.lib_dirs: List[str] = []
         self.compile_only = False
         self.shared_lib = False
-        self.output = None
-
-def convert_entries(entries: List[Dict[str, Any]],
-        out_dir: Optional[str] = None) -> List[Dict[str, Any]]:
-    entry_infos = []
-    for entry in entries:
-        old_args, entry["arguments"] = entry["arguments"], []
-        arg_iter = iter(old_args)
+        self.output: Optional[str] = None
 
-        ei = EntryInfo(entry)
-        ei.new_args.append(next(arg_iter)) # Copy over old_args[0]
-        for arg in arg_iter:
-            if arg in {"-D", "-U", "-I", "-include"}:
-                # TODO: use the full list of `Separate` options from gcc
-                ei.new_args.append(arg)
-                ei.new_args.append(next(arg_iter))
+    def input_path(self, inp: str) -> str:
+        return os.path.realpath(os.path.join(self.entry["directory"], inp))
 
-            elif arg == "-c":
-                ei.compile_only = True
+def parse_entry(entry: Dict[str, Any]) -> EntryInfo:
+    old_args, entry["arguments"] = entry["arguments"], []
+    arg_iter = iter(old_args)
 
-            elif arg == "-o":
-                ei.output = next(arg_iter)
-                ei.new_args.append(arg)
-                assert ei.output is not None
-                ei.new_args.append(ei.output)
+    ei = EntryInfo(entry)
+    ei.new_args.append(next(arg_iter)) # Copy over old_args[0]
+    language: Optional[str] = None
+    for arg in arg_iter:
+        option = match_option(arg)
+        if option is not None:
+            name, value = option
+            if value is None:
+                value = next(arg_iter, None)
+                if value is None:
+                    break # missing operand, the command failed anyway
+                args = [arg, value]
+            else:
+                args = [arg]
 
-            elif arg[:2] == "-o":
-                ei.output = arg[2:]
-                ei.new_args.append(arg)
+            if name == "-o":
+                ei.output = value
+                ei.new_args.extend(args)
+            elif name == "-x":
+                # re-added per input, see `convert_entries`
+                language = None if value == "none" else value
+            elif name == "-l":
+                ei.libs.append(value)
+            elif name == "-L":
+                ei.lib_dirs.append(value)
+            elif name not in DEPENDENCY_OPTIONS:
+                ei.new_args.extend(args)
 
-            elif arg == "-l":
-                ei.libs.append(next(arg_iter))
+        elif arg == "-c":
+            ei.compile_only = True
 
-            elif arg[:2] == "-l":
-                ei.libs.append(arg[2:])
+        # -pthread implicitly adds -lpthread
+        elif arg == "-pthread":
+            ei.libs.append("pthread")
+            ei.new_args.append(arg)
 
-            # -pthread implicitly adds -lpthread
-            elif arg == "-pthread":
-                ei.libs.append("pthread")
-                ei.new_args.append(arg)
+        elif arg == "-shared":
+            ei.shared_lib = True
 
-            elif arg == "-L":
-                ei.lib_dirs.append(next(arg_iter))
+        elif arg in DEPENDENCY_FLAGS:
+            pass
 
-            elif arg[:2] == "-L":
-                ei.lib_dirs.append(arg[2:])
+        elif not arg.startswith('-') or arg == '-':
+            if language == "c":
+                ei.c_inputs.append(arg)
+                if arg[-2:] != ".c":
+                    ei.forced_c_inputs.add(arg)
+            elif language is None and arg[-2:] == ".c":
+                ei.c_inputs.append(arg)
+            else:
+                ei.rest_inputs.append(arg)
 
-            elif arg == "-shared":
-                ei.shared_lib = True
+        else:
+            ei.new_args.append(arg)
 
-            elif arg[0] != '-' and arg[0] != '-':
-                if arg[-2:] == ".c":
-                    ei.c_inputs.append(arg)
-                else:
-                    ei.rest_inputs.append(arg)
+    return ei
 
-            else:
-                ei.new_args.append(arg)
+def _compile_key(entry: Dict[str, Any]) -> Tuple[str, str, Tuple[str, ...]]:
+    return (entry["directory"], entry["file"], tuple(entry["arguments"]))
 
-        entry_infos.append(ei)
+def convert_entries(entries: Iterable[Dict[str, Any]],
+        out_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Convert captured build commands into compile commands in a single pass
+    over `entries`, dropping duplicate compile commands.
+    """
+    object_map: Dict[str, str] = {}
+    compile_outputs: Dict[Tuple[str, str, Tuple[str, ...]], str] = {}
+    compile_entries = []
+    link_entries = []
+    for entry in entries:
+        ei = parse_entry(entry)
 
-    object_map = {}
-    new_entries = []
-    for ei in entry_infos:
         for inp in ei.c_inputs:
-            inp_path = os.path.join(entry["directory"], inp)
-            inp_path = os.path.realpath(inp_path)
-
-            # TODO: handle duplicates
-            c_object = ei.output or "%s_%d.o" % (inp[:-2], get_fake())
-            object_map[inp] = c_object
+            inp_path = ei.input_path(inp)
 
             new_entry = ei.entry.copy()
-            new_entry["arguments"] = ei.new_args + ["-c", inp]
+            x_args = ["-x", "c"] if inp in ei.forced_c_inputs else []
+            new_entry["arguments"] = ei.new_args + ["-c"] + x_args + [inp]
             new_entry["file"] = os.path.relpath(inp_path, out_dir) if out_dir else inp_path
-            new_entry["output"] = c_object
             del new_entry["type"]
-            new_entries.append(new_entry)
 
-    for ei in filter(lambda ei: not ei.compile_only, entry_infos):
+            key = _compile_key(new_entry)
+            if key in compile_outputs:
+                object_map[inp_path] = compile_outputs[key]
+                continue
+
+            # `-o` only names the object when compiling a single file
+            if ei.compile_only and ei.output and len(ei.c_inputs) == 1:
+                c_object = ei.output
+            else:
+                c_object = "%s_%d.o" % (os.path.splitext(inp)[0], get_fake())
+            object_map[inp_path] = c_object
+            compile_outputs[key] = c_object
+
+            new_entry["output"] = c_object
+            compile_entries.append(new_entry)
+
+        if ei.compile_only:
+            continue
+
         new_entry = ei.entry.copy()
-        c_objects = [object_map[inp] for inp in ei.c_inputs]
+        c_objects = [object_map[ei.input_path(inp)] for inp in ei.c_inputs]
         new_entry["arguments"] = ei.new_args
         # Hacky solution: c2rust-tranpile needs an absolute path here,
         # so we add a path-like prefix so that the transpiler can both
         # parse it correctly and recognize it as a bencoded link command
-        new_entry["file"] = "/c2rust/link/" + bencode.bencode({
+        new_entry["file"] = LINK_PREFIX + bencode.bencode({
             "inputs": c_objects + ei.rest_inputs, # FIXME: wrong order???
             "libs": ei.libs,
             "lib_dirs": ei.lib_dirs,
@@ -118,30 +222,197 @@ def convert_entries(entries: List[Dict[str, Any]],
             })
         new_entry["output"] = ei.output or "a.out"
         del new_entry["type"]
-        new_entries.append(new_entry)
+        link_entries.append(new_entry)
 
-    return new_entries
+    return compile_entries + link_entries
 
 
-def main() -> None:
-    if len(sys.argv) != 3:
-        sys.exit("Usage: convert_build_commands <build commands directory> <compilation database file>")
-
-    in_dir = sys.argv[1]
-    out_file = sys.argv[2]
-    out_dir = os.path.dirname(os.path.realpath(out_file))
-
-    entries = []
-    for json_file in glob.glob(os.path.join(in_dir, "*.json")):
-        with open(json_file, 'r') as f:
-            entry = json.load(f)
-            if entry["type"] != "cc":
-                continue # FIXME
+class Target:
+    """
+    An executable or shared library along with the compile commands of the
+    objects linked into it.
+    """
+    def __init__(self, name: str, link_entry: Dict[str, Any]):
+        self.name = name
+        self.link_entry = link_entry
+        self.link = bencode.bdecode(link_entry["file"][len(LINK_PREFIX):])
+        self.compile_entries: List[Dict[str, Any]] = []
+        # inputs not built by any captured compile command, e.g. static
+        # archives, whose `ar` commands are not captured
+        self.other_inputs: List[str] = []
+
+    def entries(self) -> List[Dict[str, Any]]:
+        return self.compile_entries + [self.link_entry]
+
+def _abs_path(directory: str, path: str) -> str:
+    return os.path.normpath(os.path.join(directory, path))
+
+def _source_path(entry: Dict[str, Any], out_dir: Optional[str]) -> str:
+    # `convert_entries` makes sources relative to the database's directory
+    return _abs_path(out_dir or entry["directory"], entry["file"])
+
+def find_targets(entries: List[Dict[str, Any]]) -> List[Target]:
+    """
+    Group the entries returned by `convert_entries` by the target they are
+    linked into. A compile entry can belong to several targets.
+    """
+    objects = {}
+    for entry in entries:
+        if not entry["file"].startswith(LINK_PREFIX):
+            objects[_abs_path(entry["directory"], entry["output"])] = entry
+
+    targets = []
+    names: Set[str] = set()
+    for entry in entries:
+        if not entry["file"].startswith(LINK_PREFIX):
+            continue
+
+        name = base = os.path.basename(entry["output"])
+        suffix = 1
+        while name in names:
+            suffix += 1
+            name = "%s-%d" % (base, suffix)
+        names.add(name)
+
+        target = Target(name, entry)
+        for inp in target.link["inputs"]:
+            compile_entry = objects.get(_abs_path(entry["directory"], inp))
+            if compile_entry is None:
+                target.other_inputs.append(inp)
+            else:
+                target.compile_entries.append(compile_entry)
+        targets.append(target)
+
+    return targets
+
+def target_graph(targets: List[Target], entries: List[Dict[str, Any]],
+        out_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Describe which objects and sources make up each target.
+    """
+    linked = set()
+    graph = []
+    for target in targets:
+        linked.update(id(e) for e in target.compile_entries)
+        graph.append({
+            "name": target.name,
+            "type": target.link["type"],
+            "directory": target.link_entry["directory"],
+            "output": target.link_entry["output"],
+            "objects": [e["output"] for e in target.compile_entries],
+            "sources": [_source_path(e, out_dir)
+                        for e in target.compile_entries],
+            "other_inputs": target.other_inputs,
+            "libs": target.link["libs"],
+            "lib_dirs": target.link["lib_dirs"],
+        })
+
+    unlinked = [_source_path(e, out_dir) for e in entries
+                if not e["file"].startswith(LINK_PREFIX)
+                and id(e) not in linked]
+    return {"targets": graph, "unlinked_sources": unlinked}
+
+def write_target_databases(targets: List[Target], db_dir: str,
+        out_dir: Optional[str] = None) -> None:
+    """
+    Write one compile database per target to `db_dir/<target>/`, so that
+    targets can be translated separately or concurrently.
+    """
+    for target in targets:
+        target_dir = os.path.join(db_dir, target.name)
+        os.makedirs(target_dir, exist_ok=True)
+        entries = []
+        for entry in target.entries():
+            entry = entry.copy()
+            if not entry["file"].startswith(LINK_PREFIX):
+                entry["file"] = _source_path(entry, out_dir)
             entries.append(entry)
+        compile_db.write(os.path.join(target_dir, "compile_commands.json"),
+                         entries)
+
+
+def _load_json(json_file: str) -> Dict[str, Any]:
+    with open(json_file, 'r') as f:
+        return json.load(f)
+
+
+def load_build_commands(in_dir: str) -> Iterator[Dict[str, Any]]:
+    """
+    Load the commands captured by the cc-wrappers, whether written one file
+    per command or appended to the journal. Files are read in parallel and
+    yielded as they are loaded.
+    """
+    json_files = glob.glob(os.path.join(in_dir, "*.json"))
+    with ThreadPoolExecutor() as executor:
+        yield from executor.map(_load_json, json_files)
+
+    journal = os.path.join(in_dir, JOURNAL_NAME)
+    if os.path.exists(journal):
+        # the journal records repeated invocations each time they run
+        seen = set()
+        with open(journal, 'r') as f:
+            for line in f:
+                if line.strip() and line not in seen:
+                    seen.add(line)
+                    yield json.loads(line)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Convert build commands captured by the cc-wrappers "
+                    "into a compilation database.")
+    parser.add_argument("in_dir", help="build commands directory")
+    parser.add_argument("out_file", help="compilation database file")
+    parser.add_argument("--target-graph", metavar="FILE",
+                        help="write the targets and the objects and sources "
+                             "they are linked from to FILE as JSON. `ar` "
+                             "commands are not captured, so static archives "
+                             "are not targets: a target lists the archives "
+                             "it links under other_inputs, and the sources "
+                             "compiled only into archives under "
+                             "unlinked_sources")
+    parser.add_argument("--per-target-dir", metavar="DIR",
+                        help="write a compilation database for each target "
+                             "to DIR/<target>/compile_commands.json")
+    parser.add_argument("--target", metavar="NAME", action="append",
+                        help="only write the entries of the named target to "
+                             "the compilation database (repeatable)")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+    out_dir = os.path.dirname(os.path.realpath(args.out_file))
+
+    entries = (entry for entry in load_build_commands(args.in_dir)
+               if entry["type"] == "cc") # FIXME
 
     new_entries = convert_entries(entries, out_dir)
-    with open(out_file, 'w') as f:
-        json.dump(new_entries, f, indent=2)
+
+    if args.target_graph or args.per_target_dir or args.target:
+        targets = find_targets(new_entries)
+        if args.target_graph:
+            with open(args.target_graph, 'w') as f:
+                json.dump(target_graph(targets, new_entries, out_dir), f,
+                          indent=2)
+        if args.per_target_dir:
+            write_target_databases(targets, args.per_target_dir, out_dir)
+        if args.target:
+            selected = [t for t in targets if t.name in args.target]
+            missing = set(args.target) - {t.name for t in selected}
+            if missing:
+                sys.exit("unknown targets: " + ", ".join(sorted(missing)))
+            # targets share compile entries, so keep the first of each
+            new_entries = []
+            seen: Set[Tuple[str, str, Tuple[str, ...]]] = set()
+            for target in selected:
+                for entry in target.entries():
+                    key = _compile_key(entry)
+                    if key not in seen:
+                        seen.add(key)
+                        new_entries.append(entry)
+
+    compile_db.write(args.out_file, new_entries)
 
 if __name__ == '__main__':
     main()
@@ -11,14 +11,29 @@ The script will:
 * compile the Rust source
 * execute the Rust executable
 * check that the C and Rust executables produced the same output
+
+With `--campaign`, worker processes repeat this for fresh programs until a
+time or iteration budget runs out. Failures are bucketed by signature and one
+reproducer is kept per bucket.
 """
 
+import argparse
 import subprocess
 import os
+import re
+import json
+import time
+import hashlib
+import signal
 import logging
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
 from shutil import copyfile
 import tempfile
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, TypeVar, Union
 import common
+import compile_db
 
 DEFAULT_CSMITH_HOME = "/usr/local/opt/csmith/include/csmith-2.3.0/runtime"
 CSMITH_HOME = os.environ.get("CSMITH_HOME", DEFAULT_CSMITH_HOME)
@@ -26,6 +41,8 @@ CSMITH_CMD = ["csmith", "--no-bitfields", "--no-builtins"]
 C_COMPILER = "clang"
 RUST_COMPILER = "rustc"
 CSMITH_TIMEOUT = 5 # seconds to wait for C compiled executable to run
+TRANSPILE_TIMEOUT = 60 # seconds to wait for the translation of one program
+RUSTC_TIMEOUT = 120 # seconds to wait for rustc to compile one program
 
 def validate_csmith_home() -> None:
     """Check that csmith.h can be found in CSMITH_HOME."""
@@ -36,22 +53,23 @@ def validate_csmith_home() -> None:
               'directory containing this header.')
         exit(1)
 
-def create_compile_commands(dirname: str, output_c_name: str) -> str:
-    """Create a compile commands file suitable for compiling the given csmith source file."""
-
-    compile_commands_settings = [{
+def compile_command(dirname: str, output_c_name: str) -> Dict[str, object]:
+    return {
         'directory': dirname,
         'arguments':
             [C_COMPILER,
              "-I", CSMITH_HOME,
              output_c_name],
-        'file': output_c_name}]
+        'file': output_c_name}
 
-    compile_commands_name = os.path.join(dirname, 'compile_commands.json')
-    with open(compile_commands_name, 'w') as filename:
-        filename.write(common.json_pp_obj(compile_commands_settings))
+def create_compile_commands(dirname: str, *output_c_names: str) -> str:
+    """Create a compile commands file suitable for compiling the given csmith source files."""
 
-    return compile_commands_name
+    compile_commands_settings = [compile_command(dirname, name)
+                                 for name in output_c_names]
+
+    compile_commands_name = os.path.join(dirname, 'compile_commands.json')
+    return compile_db.write(compile_commands_name, compile_commands_settings)
 
 def generate_c_source(dirname: str, output_c_name: str) -> None:
     """Generate a C source file using csmith."""
@@ -82,7 +100,7 @@ def compile_c_file(output_c_name: str, output_c_exe_name: str) -> None:
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL)
 
-def execute_driver(exe_name: str) -> bytes:
+def execute_driver(exe_name: Union[str, List[str]]) -> bytes:
     """Execute the given executable and return its stdout output."""
 
     logging.info("Executing: %s", exe_name)
@@ -95,11 +113,14 @@ def execute_driver(exe_name: str) -> bytes:
     logging.info("Execution finished: %s", expected_output)
     return expected_output
 
+def rust_compile_cmd(output_rs_name: str, output_rs_exec_name: str) -> List[str]:
+    return [RUST_COMPILER, '-Awarnings', output_rs_name, '-o', output_rs_exec_name]
+
 def compile_rust_file(output_c_name: str, output_rs_name: str, output_rs_exec_name: str) -> None:
     """Compile the given Rust source file."""
 
     logging.info("Compiling translated Rust")
-    compile_rust_cmd = [RUST_COMPILER, '-Awarnings', output_rs_name, '-o', output_rs_exec_name]
+    compile_rust_cmd = rust_compile_cmd(output_rs_name, output_rs_exec_name)
     try:
         subprocess.run(compile_rust_cmd, check=True)
     except:
@@ -108,11 +129,598 @@ def compile_rust_file(output_c_name: str, output_rs_name: str, output_rs_exec_na
         copyfile(output_rs_name, 'output.rs')
         raise
 
+# Stages of the pipeline that each fuzzed program goes through, in order.
+STAGES = ["generate", "compile_c", "run_c", "transpile", "compile_rust", "run_rust"]
+# Failures in these stages reject the csmith program rather than reveal a
+# translator bug, e.g. programs that don't terminate in time.
+DISCARD_STAGES = {"generate", "compile_c", "run_c"}
+
+PANIC_LOCATION = re.compile(r"panicked at (?:'.*', )?(\S+?\.rs):(\d+):\d+")
+RUSTC_ERROR_CODE = re.compile(r"^error\[(E\d+)\]", re.MULTILINE)
+ANY_LOCATION = re.compile(r"\S+\.rs:\d+(:\d+)?")
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+# what the transpiler reports about each program at `--log-level info`
+TRANSPILE_EXPORTED = re.compile(r"^info: exported the AST of (\S+)\.c in ",
+                                re.MULTILINE)
+TRANSPILE_STARTED = re.compile(r"^Transpiling (\S+)\.c$", re.MULTILINE)
+TRANSPILE_FINISHED = re.compile(r"^info: translated (\S+)\.c in ",
+                                re.MULTILINE)
+TRANSPILE_SKIPPED = re.compile(r"^warning: Error: .*\. Skipping (\S+)\.c; ",
+                               re.MULTILINE)
+
+
+class StageFailure(Exception):
+    """A fuzzed program failed at `stage`; `signature` identifies the bug."""
+
+    def __init__(self, stage: str, signature: str, log: str) -> None:
+        super().__init__(signature)
+        self.stage = stage
+        self.signature = signature
+        self.log = log
+
+
+def _normalize(line: str) -> str:
+    # Drop what varies between programs hitting the same bug.
+    line = ANY_LOCATION.sub("<location>", line)
+    return re.sub(r"\d+", "N", line.strip())
+
+
+def _first_line(log: str, marker: str) -> Optional[str]:
+    return next((l for l in log.splitlines() if marker in l), None)
+
+
+def failure_signature(stage: str, returncode: Optional[int], log: str) -> str:
+    """Summarize why `stage` failed so that equivalent failures share a bucket."""
+    if returncode is None:
+        return "{}: timeout".format(stage)
+
+    if stage == "transpile":
+        m = PANIC_LOCATION.search(log)
+        if m:
+            # the translator's own source location is stable across programs
+            return "transpile: panic at {}:{}".format(m.group(1), m.group(2))
+    elif stage == "compile_rust":
+        m = RUSTC_ERROR_CODE.search(log)
+        if m:
+            return "compile_rust: {}".format(m.group(1))
+    elif stage == "run_rust":
+        lines = log.splitlines()
+        for i, line in enumerate(lines):
+            if "panicked at" in line:
+                # newer panics put the message on the line after the location
+                message = line.split("panicked at", 1)[1]
+                if i + 1 < len(lines) and message.rstrip().endswith(":"):
+                    message += " " + lines[i + 1]
+                return "run_rust: panic {}".format(_normalize(message))
+    elif stage == "compare":
+        return "compare: output mismatch"
+
+    if returncode < 0:
+        return "{}: signal {}".format(stage, signal.Signals(-returncode).name)
+    error = _first_line(log, "error")
+    if error:
+        return "{}: {}".format(stage, _normalize(error))
+    return "{}: exit status {}".format(stage, returncode)
+
+
+@contextmanager
+def _stage(timings: Dict[str, float], stage: str) -> Iterator[None]:
+    start = time.monotonic()
+    try:
+        yield
+    except subprocess.TimeoutExpired as e:
+        raise StageFailure(stage, failure_signature(stage, None, ""),
+                           _decode(e.stderr))
+    except subprocess.CalledProcessError as e:
+        log = _decode(e.stdout) + _decode(e.stderr)
+        raise StageFailure(stage, failure_signature(stage, e.returncode, log),
+                           log)
+    finally:
+        timings[stage] = time.monotonic() - start
+
+
+def _decode(output: Optional[bytes]) -> str:
+    return output.decode("utf-8", "replace") if output else ""
+
+
+def _run_captured(cmd: List[str], **kwargs) -> None:
+    subprocess.run(cmd, check=True, capture_output=True, **kwargs)
+
+
+def bucket_dir(out_dir: str, signature: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", signature).strip("_")[:60]
+    digest = hashlib.sha1(signature.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(out_dir, "{}_{}".format(slug, digest))
+
+
+def save_reproducer(out_dir: str, failure: StageFailure, c_file: str) -> None:
+    """Keep the files of the first program that hits a new bucket."""
+    bucket = bucket_dir(out_dir, failure.signature)
+    try:
+        # creating the directory claims the bucket for this worker
+        os.mkdir(bucket)
+    except FileExistsError:
+        return
+    rs_file = os.path.splitext(c_file)[0] + ".rs"
+    for src, name in ((c_file, "output.c"), (rs_file, "output.rs")):
+        if os.path.isfile(src):
+            copyfile(src, os.path.join(bucket, name))
+    with open(os.path.join(bucket, "failure.txt"), "w") as fh:
+        fh.write("stage: {}\nsignature: {}\n\n{}".format(
+            failure.stage, failure.signature, failure.log))
+
+
+# The outcome of one fuzzed program: "match", "discard" or "failure", the
+# time spent in each stage, and the failing stage and signature, if any.
+FuzzResult = Tuple[str, Dict[str, float], Optional[str], Optional[str]]
+
+
+def check_program(dirname: str, timings: Dict[str, float]) -> None:
+    """
+    Compile, run, translate and compare the program in `dirname/output.c`,
+    raising a `StageFailure` for the first stage that fails.
+    """
+    output_c_name = os.path.join(dirname, 'output.c')
+    output_c_exe_name = os.path.join(dirname, 'output.c.exe')
+    output_rs_name = os.path.join(dirname, 'output.rs')
+    output_rs_exec_name = os.path.join(dirname, 'output.rs.exe')
+
+    with _stage(timings, "compile_c"):
+        compile_c_file(output_c_name, output_c_exe_name)
+    with _stage(timings, "run_c"):
+        expected_output = execute_driver(output_c_exe_name)
+    with _stage(timings, "transpile"):
+        cc_db = create_compile_commands(dirname, output_c_name)
+        _run_captured([common.config.C2RUST_BIN, "transpile", cc_db],
+                      timeout=TRANSPILE_TIMEOUT)
+    with _stage(timings, "compile_rust"):
+        _run_captured(rust_compile_cmd(output_rs_name, output_rs_exec_name),
+                      timeout=RUSTC_TIMEOUT)
+    with _stage(timings, "run_rust"):
+        actual_output = execute_driver(output_rs_exec_name)
+    if expected_output != actual_output:
+        log = "expected:\n{}\nactual:\n{}\n".format(
+            _decode(expected_output), _decode(actual_output))
+        raise StageFailure("compare", failure_signature("compare", 0, log), log)
+
+
+def fuzz_one(out_dir: str) -> FuzzResult:
+    """Generate, translate and compare one program in a fresh workspace."""
+    timings: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory('_c2rust_csmith') as dirname:
+        try:
+            with _stage(timings, "generate"):
+                output_c_name = os.path.join(dirname, 'output.c')
+                with open(output_c_name, 'w') as output_c:
+                    subprocess.run(CSMITH_CMD, cwd=dirname, stdout=output_c,
+                                   stderr=subprocess.PIPE, check=True)
+            check_program(dirname, timings)
+        except StageFailure as failure:
+            if failure.stage in DISCARD_STAGES:
+                return "discard", timings, failure.stage, None
+            save_reproducer(out_dir, failure, output_c_name)
+            return "failure", timings, failure.stage, failure.signature
+    return "match", timings, None, None
+
+
+T = TypeVar('T')
+
+# Programs are compiled as the modules of a single crate in batch mode, so the
+# crate attributes that the transpiler puts at the top of each file are
+# hoisted to the crate root and merged.
+MERGED_ATTRIBUTES = {"allow", "feature", "register_tool"}
+
+
+def split_inner_attributes(source: str) -> Tuple[List[str], str]:
+    """Split the leading `#![...]` attributes off a translated file."""
+    attrs = []
+    rest = source.lstrip()
+    while rest.startswith("#!["):
+        depth = 0
+        for end, c in enumerate(rest):
+            if c == '[':
+                depth += 1
+            elif c == ']':
+                depth -= 1
+                if depth == 0:
+                    break
+        attrs.append(rest[3:end].strip())
+        rest = rest[end + 1:].lstrip()
+    return attrs, rest
+
+
+class CrateRoot:
+    """The crate root of a batch: the merged attributes and a dispatcher."""
+
+    def __init__(self) -> None:
+        self.merged: Dict[str, Set[str]] = {name: set() for name in MERGED_ATTRIBUTES}
+        self.other: Set[str] = set()
+
+    def add_attributes(self, attrs: List[str]) -> None:
+        for attr in attrs:
+            m = re.match(r"(\w+)\s*\((.*)\)$", attr, re.DOTALL)
+            if m and m.group(1) in MERGED_ATTRIBUTES:
+                self.merged[m.group(1)].update(
+                    a.strip() for a in m.group(2).split(",") if a.strip())
+            else:
+                self.other.add(attr)
+
+    def source(self, names: List[str]) -> str:
+        lines = ["#![{}({})]".format(name, ", ".join(sorted(args)))
+                 for name, args in sorted(self.merged.items()) if args]
+        lines += ["#![{}]".format(attr) for attr in sorted(self.other)]
+        lines.append("")
+        lines += ["mod {};".format(name) for name in names]
+        lines.append("")
+        lines.append("fn main() {")
+        lines.append("    match ::std::env::args().nth(1).as_deref() {")
+        lines += ['        Some("{0}") => {0}::main(),'.format(name) for name in names]
+        lines.append('        program => panic!("unknown program {:?}", program),')
+        lines.append("    }")
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+
+def _program_log(log: str, name: str) -> str:
+    lines = [l for l in log.splitlines() if name in l]
+    return "\n".join(lines) if lines else log
+
+
+def transpile_batch(dirname: str, names: List[str],
+                    failures: Dict[str, StageFailure]) -> List[str]:
+    """
+    Translate `dirname/<name>.c` for all `names` with as few transpiler runs
+    as possible and return the names that were translated.
+
+    A panic aborts the whole run. The transpiler's log says which programs it
+    started and finished, so the program it was working on is charged with
+    the panic, and the ones that were not reached yet are translated again in
+    another run.
+    """
+    translated = []
+    remaining = list(names)
+    while remaining:
+        cc_db = create_compile_commands(dirname, *(n + ".c" for n in remaining))
+        try:
+            proc = subprocess.run(
+                [common.config.C2RUST_BIN, "transpile", cc_db,
+                 "--log-level", "info"],
+                capture_output=True, timeout=TRANSPILE_TIMEOUT * len(remaining))
+            returncode: Optional[int] = proc.returncode
+            stdout, stderr = proc.stdout, proc.stderr
+        except subprocess.TimeoutExpired as e:
+            # charged like a crash, with a timeout signature
+            returncode, stdout, stderr = None, e.stdout, e.stderr
+        log = _decode(stdout) + _decode(stderr)
+        started, finished = _transpile_progress(log)
+        crashed = None
+        if returncode != 0:
+            crashed = _crashed_program(remaining, started, finished)
+
+        retry = []
+        for name in remaining:
+            if name == crashed:
+                # checked first: a timed out run may leave a partial file
+                failures[name] = StageFailure(
+                    "transpile", failure_signature("transpile", returncode, log), log)
+            elif os.path.isfile(os.path.join(dirname, name + ".rs")):
+                translated.append(name)
+            elif returncode == 0 or name in started or name in finished:
+                # skipped, e.g. because the AST could not be exported
+                program_log = _program_log(log, name + ".c")
+                failures[name] = StageFailure(
+                    "transpile", failure_signature("transpile", 1, program_log),
+                    program_log)
+            else:
+                retry.append(name)
+        remaining = retry
+    return translated
+
+
+def _transpile_progress(log: str) -> Tuple[Set[str], Set[str]]:
+    """
+    The programs that the transpiler started translating and the ones it was
+    done with, translated or skipped, according to its `--log-level info` log.
+    """
+    log = ANSI_ESCAPE.sub("", log)
+    started = set(TRANSPILE_EXPORTED.findall(log))
+    started.update(TRANSPILE_STARTED.findall(log))
+    finished = set(TRANSPILE_FINISHED.findall(log))
+    finished.update(os.path.basename(path)
+                    for path in TRANSPILE_SKIPPED.findall(log))
+    return started, finished
+
+
+def _crashed_program(remaining: List[str], started: Set[str],
+                     finished: Set[str]) -> Optional[str]:
+    """
+    The program that a crashed run of the transpiler over `remaining` was
+    working on: the last one it started if it did not finish it, otherwise
+    the one after the last program it finished, which it crashed on before
+    logging anything, e.g. in the AST exporter.
+    """
+    last = -1
+    for i, name in enumerate(remaining):
+        if name in started or name in finished:
+            last = i
+    if last >= 0 and remaining[last] not in finished:
+        return remaining[last]
+    if last + 1 < len(remaining):
+        return remaining[last + 1]
+    # every program finished, so the crash was not caused by one of them
+    return None
+
+
+def compile_batch(dirname: str, names: List[str],
+                  failures: Dict[str, StageFailure]) -> Dict[str, List[str]]:
+    """
+    Compile the translations of `names` as modules of one crate with a single
+    rustc run, and return the command that runs each program.
+
+    Programs that rustc reports errors in are compiled on their own instead,
+    so that each program is charged with its own errors.
+    """
+    crate_dir = os.path.join(dirname, "crate")
+    os.makedirs(crate_dir, exist_ok=True)
+    root = CrateRoot()
+    for name in names:
+        with open(os.path.join(dirname, name + ".rs")) as fh:
+            attrs, body = split_inner_attributes(fh.read())
+        root.add_attributes(attrs)
+        with open(os.path.join(crate_dir, name + ".rs"), "w") as fh:
+            fh.write(body)
+
+    commands: Dict[str, List[str]] = {}
+    members = list(names)
+    main_rs = os.path.join(crate_dir, "main.rs")
+    exe = os.path.join(crate_dir, "batch.exe")
+    while members:
+        with open(main_rs, "w") as fh:
+            fh.write(root.source(members))
+        # the 2018 edition lets modules name the crates used by the root
+        try:
+            proc = subprocess.run(
+                rust_compile_cmd(main_rs, exe) + ["--edition=2018"],
+                capture_output=True, timeout=RUSTC_TIMEOUT * len(members))
+        except subprocess.TimeoutExpired:
+            # compile every program on its own to find the slow ones
+            log = ""
+        else:
+            if proc.returncode == 0:
+                commands.update((name, [exe, name]) for name in members)
+                break
+            log = _decode(proc.stderr)
+        culprits = [n for n in members
+                    if re.search(r"--> \S*\b{}\.rs:".format(n), log)]
+        for name in culprits or members:
+            rs_file = os.path.join(dirname, name + ".rs")
+            try:
+                _run_captured(rust_compile_cmd(rs_file, rs_file + ".exe"),
+                              timeout=RUSTC_TIMEOUT)
+                commands[name] = [rs_file + ".exe"]
+            except subprocess.TimeoutExpired:
+                failures[name] = StageFailure(
+                    "compile_rust", failure_signature("compile_rust", None, ""), "")
+            except subprocess.CalledProcessError as e:
+                program_log = _decode(e.stderr)
+                failures[name] = StageFailure(
+                    "compile_rust",
+                    failure_signature("compile_rust", e.returncode, program_log),
+                    program_log)
+        members = [n for n in members if n not in culprits] if culprits else []
+    return commands
+
+
+def fuzz_batch(out_dir: str, size: int) -> List[FuzzResult]:
+    """
+    Like `fuzz_one` for `size` programs, but translate them with one
+    transpiler run and compile them into one crate with one rustc run.
+    The time of those shared stages is split evenly between the programs.
+    """
+    names = ["p{}".format(i) for i in range(size)]
+    timings: Dict[str, Dict[str, float]] = {name: {} for name in names}
+    failures: Dict[str, StageFailure] = {}
+    expected: Dict[str, bytes] = {}
+    results = []
+    with tempfile.TemporaryDirectory('_c2rust_csmith') as dirname:
+        for name in names:
+            c_file = os.path.join(dirname, name + ".c")
+            try:
+                with _stage(timings[name], "generate"):
+                    with open(c_file, 'w') as output_c:
+                        subprocess.run(CSMITH_CMD, cwd=dirname, stdout=output_c,
+                                       stderr=subprocess.PIPE, check=True)
+                with _stage(timings[name], "compile_c"):
+                    compile_c_file(c_file, c_file + ".exe")
+                with _stage(timings[name], "run_c"):
+                    expected[name] = execute_driver(c_file + ".exe")
+            except StageFailure as failure:
+                failures[name] = failure
+
+        def shared_stage(stage: str, members: List[str], run: Callable[[], T]) -> T:
+            start = time.monotonic()
+            result = run()
+            for name in members:
+                timings[name][stage] = (time.monotonic() - start) / len(members)
+            return result
+
+        candidates = list(expected)
+        translated = shared_stage(
+            "transpile", candidates,
+            lambda: transpile_batch(dirname, candidates, failures))
+        commands = shared_stage(
+            "compile_rust", translated,
+            lambda: compile_batch(dirname, translated, failures))
+
+        for name, command in commands.items():
+            try:
+                with _stage(timings[name], "run_rust"):
+                    actual = execute_driver(command)
+                if actual != expected[name]:
+                    log = "expected:\n{}\nactual:\n{}\n".format(
+                        _decode(expected[name]), _decode(actual))
+                    raise StageFailure("compare",
+                                       failure_signature("compare", 0, log), log)
+            except StageFailure as failure:
+                failures[name] = failure
+
+        for name in names:
+            failure = failures.get(name)
+            if failure is None:
+                results.append(("match", timings[name], None, None))
+            elif failure.stage in DISCARD_STAGES:
+                results.append(("discard", timings[name], failure.stage, None))
+            else:
+                save_reproducer(out_dir, failure,
+                                os.path.join(dirname, name + ".c"))
+                results.append(("failure", timings[name], failure.stage,
+                                failure.signature))
+    return results
+
+
+class CampaignStats:
+    def __init__(self) -> None:
+        self.start = time.monotonic()
+        self.outcomes: Dict[str, int] = {"match": 0, "discard": 0, "failure": 0}
+        self.stage_time: Dict[str, float] = {stage: 0.0 for stage in STAGES}
+        self.stage_runs: Dict[str, int] = {stage: 0 for stage in STAGES}
+        self.discarded_at: Dict[str, int] = {}
+        self.buckets: Dict[str, int] = {}
+
+    @property
+    def programs(self) -> int:
+        return sum(self.outcomes.values())
+
+    def add(self, result: FuzzResult) -> None:
+        outcome, timings, stage, signature = result
+        self.outcomes[outcome] += 1
+        for name, seconds in timings.items():
+            self.stage_time[name] += seconds
+            self.stage_runs[name] += 1
+        if outcome == "discard":
+            self.discarded_at[stage] = self.discarded_at.get(stage, 0) + 1
+        elif signature is not None:
+            if signature not in self.buckets:
+                logging.warning("new failure: %s", signature)
+            self.buckets[signature] = self.buckets.get(signature, 0) + 1
+
+    def summary(self, out_dir: str) -> Dict:
+        elapsed = time.monotonic() - self.start
+        return {
+            "elapsed_seconds": elapsed,
+            "programs": self.programs,
+            "programs_per_minute": 60.0 * self.programs / elapsed if elapsed else 0.0,
+            "outcomes": self.outcomes,
+            "discarded_at": self.discarded_at,
+            "stages": {stage: {"runs": self.stage_runs[stage],
+                               "seconds": self.stage_time[stage]}
+                       for stage in STAGES},
+            "buckets": [{"signature": sig, "count": count,
+                         "reproducer": bucket_dir(out_dir, sig)}
+                        for sig, count in sorted(self.buckets.items(),
+                                                 key=lambda kv: -kv[1])],
+        }
+
+
+def print_summary(summary: Dict) -> None:
+    print("{programs} programs in {elapsed_seconds:.0f}s "
+          "({programs_per_minute:.1f} programs/min)".format(**summary))
+    print("outcomes: " + ", ".join("{} {}".format(count, outcome)
+                                   for outcome, count in summary["outcomes"].items()))
+    total = sum(s["seconds"] for s in summary["stages"].values()) or 1.0
+    print("\n{:>14} {:>8} {:>10} {:>10} {:>7}".format(
+        "stage", "runs", "total s", "mean s", "%"))
+    for stage, s in summary["stages"].items():
+        mean = s["seconds"] / s["runs"] if s["runs"] else 0.0
+        print("{:>14} {:>8} {:>10.1f} {:>10.3f} {:>6.1f}%".format(
+            stage, s["runs"], s["seconds"], mean, 100.0 * s["seconds"] / total))
+    if summary["buckets"]:
+        print("\n{:>8}  signature (reproducer)".format("count"))
+        for bucket in summary["buckets"]:
+            print("{:>8}  {} ({})".format(bucket["count"], bucket["signature"],
+                                         bucket["reproducer"]))
+
+
+def campaign(args: argparse.Namespace) -> None:
+    """Fuzz with `args.jobs` workers until the time or iteration budget is spent."""
+    out_dir = os.path.abspath(args.out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    deadline = time.monotonic() + args.time_budget if args.time_budget else None
+    stats = CampaignStats()
+    submitted = 0
+
+    def budget_left() -> bool:
+        if args.iterations is not None and submitted >= args.iterations:
+            return False
+        return deadline is None or time.monotonic() < deadline
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        pending = set()
+        try:
+            while True:
+                while len(pending) < args.jobs and budget_left():
+                    if args.batch > 1:
+                        pending.add(pool.submit(fuzz_batch, out_dir, args.batch))
+                        submitted += args.batch
+                    else:
+                        pending.add(pool.submit(fuzz_one, out_dir))
+                        submitted += 1
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    for program in (result if args.batch > 1 else [result]):
+                        stats.add(program)
+                logging.info("%d programs, %d failures in %d buckets",
+                                 stats.programs, stats.outcomes["failure"],
+                                 len(stats.buckets))
+        except KeyboardInterrupt:
+            logging.warning("interrupted, finishing up")
+            for future in pending:
+                future.cancel()
+
+    summary = stats.summary(out_dir)
+    with open(os.path.join(out_dir, "summary.json"), "w") as fh:
+        json.dump(summary, fh, indent=2)
+    print_summary(summary)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare csmith-generated C programs with their translation.")
+    parser.add_argument('--campaign', default=False, action='store_true',
+                        help="fuzz continuously with several workers")
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="number of worker processes (campaign mode)")
+    parser.add_argument('--time-budget', type=float, metavar='SECONDS',
+                        help="stop starting new programs after this long")
+    parser.add_argument('--iterations', type=int, metavar='N',
+                        help="stop after generating N programs")
+    parser.add_argument('--out-dir', default='csmith_failures',
+                        help="where to keep one reproducer per failure bucket")
+    parser.add_argument('--batch', type=int, default=1, metavar='K',
+                        help="translate and compile K programs at a time with "
+                             "one transpiler and one rustc run (campaign mode)")
+    args = parser.parse_args()
+    if args.batch > 1 and not args.campaign:
+        parser.error("--batch requires --campaign")
+    return args
+
+
 def main() -> None:
     """Generate a new csmith test case and compare its execution to the translated Rust version."""
 
+    args = _parse_args()
+
     validate_csmith_home()
 
+    if args.campaign:
+        common.setup_logging(logging.WARNING)
+        campaign(args)
+        return
+
     common.setup_logging()
 
     with tempfile.TemporaryDirectory('_c2rust_csmith') as dirname:
@@ -141,6 +749,7 @@ def main() -> None:
             logging.info("FAILURE: %s %s", expected_output, actual_output)
             copyfile(output_c_name, 'output.c')
             copyfile(output_rs_name, 'output.rs')
+            logging.info("Run csmith_reduce.py output.c to reduce it")
 
 
 if __name__ == "__main__":
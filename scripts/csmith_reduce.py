@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Reduce a C program that csmith.py found to translate incorrectly.
+
+The program is shrunk with delta debugging at three levels: top-level
+declarations, statements inside function bodies and parenthesized
+expressions or integer literals, which are replaced by `0`. A candidate is
+interesting if it still fails the csmith.py pipeline with the same signature
+as the original program, e.g. the same output mismatch or the same rustc
+error code. Candidates are checked in parallel and results are cached by the
+hash of the candidate's source.
+
+The splitting is purely lexical, so many candidates don't compile; those
+are simply not interesting. As with any reducer, a mismatch can turn into
+one caused by undefined behavior in the reduced C program, so check the
+result before filing a bug.
+
+Example:
+
+    csmith_reduce.py -j 16 csmith_failures/compare_output_mismatch_*/output.c
+"""
+
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from shutil import copyfile
+from typing import Callable, Dict, List, Optional, Tuple
+
+import common
+import csmith
+
+# A span of the source to replace, and its replacement.
+Unit = Tuple[int, int, str]
+
+IDENT_CHARS = re.compile(r"[A-Za-z0-9_\]\)]")
+INT_LITERAL = re.compile(r"(?<![\w.])(?:0[xX][0-9a-fA-F]+|[1-9][0-9]*)[uUlL]*\b")
+
+
+def mask_source(text: str) -> str:
+    """
+    Blank out comments, string and character literals and preprocessor lines
+    so that the structure of the program can be recovered from the rest.
+    Offsets into the result are offsets into `text`.
+    """
+    out = list(text)
+    i, n = 0, len(text)
+    line_start = True
+    while i < n:
+        c = text[i]
+        if line_start and c == '#':
+            j = text.find('\n', i)
+            j = n if j < 0 else j
+            out[i:j] = ' ' * (j - i)
+            i = j
+            continue
+        if c == '\n':
+            line_start = True
+            i += 1
+            continue
+        if not c.isspace():
+            line_start = False
+        if text.startswith('//', i):
+            j = text.find('\n', i)
+            j = n if j < 0 else j
+        elif text.startswith('/*', i):
+            j = text.find('*/', i + 2)
+            j = n if j < 0 else j + 2
+        elif c in '"\'':
+            j = i + 1
+            while j < n and text[j] != c:
+                j += 2 if text[j] == '\\' else 1
+            j = min(j + 1, n)
+        else:
+            i += 1
+            continue
+        out[i:j] = [ch if ch == '\n' else ' ' for ch in text[i:j]]
+        i = j
+    return ''.join(out)
+
+
+def _prev_char(masked: str, i: int) -> str:
+    i -= 1
+    while i >= 0 and masked[i].isspace():
+        i -= 1
+    return masked[i] if i >= 0 else ''
+
+
+def _skip_space(masked: str, i: int) -> int:
+    while i < len(masked) and masked[i].isspace():
+        i += 1
+    return i
+
+
+class Structure:
+    """
+    The top-level declarations, statements and expressions of a C program,
+    recovered from its masked source by matching brackets.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        masked = mask_source(text)
+        self.decls: List[Unit] = []
+        self.stmts: List[Unit] = []
+        self.exprs: List[Unit] = []
+
+        # each open brace is "func", "block" or "aggregate"
+        braces: List[str] = []
+        # start of the current statement in each open block
+        stmt_start: List[int] = []
+        parens: List[int] = []
+        decl_start = _skip_space(masked, 0)
+
+        def in_code() -> bool:
+            return bool(braces) and braces[-1] != "aggregate"
+
+        def end_stmt(end: int) -> None:
+            start = stmt_start[-1]
+            if start < end:
+                self.stmts.append((start, end, ""))
+            stmt_start[-1] = _skip_space(masked, end)
+
+        for i, c in enumerate(masked):
+            if c == '(':
+                parens.append(i)
+            elif c == ')' and parens:
+                start = parens.pop()
+                # leave calls and the conditions of if, while, etc. alone
+                if in_code() and not IDENT_CHARS.match(_prev_char(masked, start)):
+                    self.exprs.append((start, i + 1, "0"))
+            elif c == ';' and not parens:
+                if not braces:
+                    self.decls.append((decl_start, i + 1, ""))
+                    decl_start = _skip_space(masked, i + 1)
+                elif in_code():
+                    end_stmt(i + 1)
+            elif c == '{':
+                if not braces:
+                    kind = "func" if _prev_char(masked, i) == ')' else "aggregate"
+                elif in_code() and _prev_char(masked, i) != '=':
+                    kind = "block"
+                else:
+                    kind = "aggregate"
+                braces.append(kind)
+                if kind != "aggregate":
+                    stmt_start.append(_skip_space(masked, i + 1))
+            elif c == '}' and braces:
+                kind = braces.pop()
+                if kind != "aggregate":
+                    stmt_start.pop()
+                if kind == "func":
+                    self.decls.append((decl_start, i + 1, ""))
+                    decl_start = _skip_space(masked, i + 1)
+                elif kind == "block" and in_code() and not parens:
+                    end_stmt(i + 1)
+
+        for m in INT_LITERAL.finditer(masked):
+            self.exprs.append((m.start(), m.end(), "0"))
+        self.exprs.sort()
+
+    def units(self, level: str) -> List[Unit]:
+        return getattr(self, level)
+
+
+LEVELS = ["decls", "stmts", "exprs"]
+
+
+def apply(text: str, units: List[Unit]) -> str:
+    """
+    Replace the spans of `units` in `text`. Spans nested in a span that was
+    already replaced are ignored.
+    """
+    pieces = []
+    pos = 0
+    for start, end, replacement in sorted(units, key=lambda u: (u[0], -u[1])):
+        if start < pos:
+            continue
+        pieces.append(text[pos:start])
+        pieces.append(replacement)
+        pos = end
+    pieces.append(text[pos:])
+    return ''.join(pieces)
+
+
+def _source_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def failure_of(text: str) -> Optional[str]:
+    """Run the csmith.py pipeline on `text` and return its failure signature."""
+    with tempfile.TemporaryDirectory('_c2rust_csmith_reduce') as dirname:
+        with open(os.path.join(dirname, 'output.c'), 'w') as fh:
+            fh.write(text)
+        try:
+            csmith.check_program(dirname, {})
+        except csmith.StageFailure as failure:
+            return failure.signature
+    return None
+
+
+class Reducer:
+    def __init__(self, signature: str, jobs: int) -> None:
+        self.signature = signature
+        self.jobs = jobs
+        # the pipeline steps log every command they run
+        self.pool = ProcessPoolExecutor(max_workers=jobs,
+                                        initializer=logging.disable,
+                                        initargs=(logging.INFO,))
+        # candidate hash -> failure signature
+        self.cache: Dict[str, Optional[str]] = {}
+        self.tests = 0
+        self.cache_hits = 0
+
+    def _remember(self, key: str) -> Callable[[Future], None]:
+        def done(future: Future) -> None:
+            if not future.cancelled() and future.exception() is None:
+                self.cache[key] = future.result()
+        return done
+
+    def first_interesting(self, candidates: List[str]) -> Optional[str]:
+        """
+        Check `candidates` in parallel and return the first interesting one
+        in order. Once it is known, later candidates are cancelled.
+        """
+        keys = [_source_hash(c) for c in candidates]
+        futures: Dict[str, Future] = {}
+        for key, candidate in zip(keys, candidates):
+            if key in self.cache:
+                self.cache_hits += 1
+            elif key not in futures:
+                future = self.pool.submit(failure_of, candidate)
+                future.add_done_callback(self._remember(key))
+                futures[key] = future
+                self.tests += 1
+
+        found = None
+        for key, candidate in zip(keys, candidates):
+            signature = (futures[key].result() if key in futures
+                         else self.cache[key])
+            if signature == self.signature:
+                found = candidate
+                break
+        for future in futures.values():
+            future.cancel()
+        return found
+
+    def reduce_level(self, text: str, level: str) -> str:
+        """Delta debugging over the units of one level."""
+        units = Structure(text).units(level)
+        n = 2
+        while units:
+            n = min(n, len(units))
+            chunk = -(-len(units) // n)
+            subsets = [units[i:i + chunk] for i in range(0, len(units), chunk)]
+            # try dropping each subset, then keeping only each subset
+            candidates = [apply(text, subset) for subset in subsets]
+            if n > 2:
+                candidates += [apply(text, units[:i] + units[i + chunk:])
+                               for i in range(0, len(units), chunk)]
+            candidates = [c for c in candidates if len(c) < len(text)]
+            found = self.first_interesting(candidates)
+            if found is not None:
+                text = found
+                units = Structure(text).units(level)
+                n = max(n - 1, 2)
+                logging.info("%s: %d bytes", level, len(text))
+            elif chunk == 1:
+                break
+            else:
+                n = min(2 * n, len(units))
+        return text
+
+    def reduce(self, text: str) -> str:
+        """Reduce every level in turn until none of them shrinks the program."""
+        while True:
+            size = len(text)
+            for level in LEVELS:
+                text = self.reduce_level(text, level)
+            if len(text) == size:
+                return text
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Reduce a C program that csmith.py found to translate "
+                    "incorrectly.")
+    parser.add_argument('c_file', help="program to reduce, e.g. output.c")
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="number of candidates to check in parallel")
+    parser.add_argument('-o', '--output',
+                        help="where to write the reduced program "
+                             "(default: <c_file>.reduced.c)")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+    csmith.validate_csmith_home()
+    common.setup_logging()
+
+    with open(args.c_file) as fh:
+        text = fh.read()
+    signature = failure_of(text)
+    if signature is None:
+        common.die("{} passes, nothing to reduce".format(args.c_file))
+    logging.info("reducing %s (%d bytes): %s", args.c_file, len(text), signature)
+
+    reducer = Reducer(signature, args.jobs)
+    try:
+        reduced = reducer.reduce(text)
+    finally:
+        reducer.pool.shutdown(cancel_futures=True)
+
+    output = args.output or os.path.splitext(args.c_file)[0] + ".reduced.c"
+    with open(output, 'w') as fh:
+        fh.write(reduced)
+
+    # keep the translation of the reduced program next to it
+    with tempfile.TemporaryDirectory('_c2rust_csmith_reduce') as dirname:
+        copyfile(output, os.path.join(dirname, 'output.c'))
+        try:
+            csmith.check_program(dirname, {})
+        except csmith.StageFailure:
+            pass
+        output_rs = os.path.join(dirname, 'output.rs')
+        if os.path.isfile(output_rs):
+            copyfile(output_rs, os.path.splitext(output)[0] + ".rs")
+
+    logging.info("%d -> %d bytes after %d tests (%d cache hits): %s",
+                 len(text), len(reduced), reducer.tests, reducer.cache_hits,
+                 output)
+
+
+if __name__ == "__main__":
+    main()
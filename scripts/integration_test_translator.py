@@ -3,18 +3,30 @@
 
 import argparse
 import errno
+import json
 import logging
 import multiprocessing
+import multiprocessing.connection
 import os
+import re
 from shutil import rmtree
+import statistics
+import subprocess
 import sys
 import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from compile_db import CompileDb, abs_file
 
 from common import (
     config as c,
     pb,
+    Colors,
+    Jobserver,
     get_cmd_or_die,
     invoke,
+    invoke_with_jobserver,
     get_rust_toolchain_libpath,
     download_archive,
     invoke_quietly,
@@ -22,8 +34,10 @@ from common import (
     on_mac,
     regex,
     setup_logging,
+    sha256_file,
     ensure_dir,
     transpile,
+    write_atomically,
 )
 
 
@@ -50,7 +64,23 @@ SED = get_cmd_or_die("sed")
 MAKE = get_cmd_or_die("make")
 CMAKE = get_cmd_or_die("cmake")
 BEAR = get_cmd_or_die("bear")
-JOBS = "-j2"  # main updates jobs based on args
+CLANG = get_cmd_or_die("clang")
+
+# stamps of the cached upstream builds and the logs of concurrent tests
+INTEGRATION_DIR = os.path.join(c.BUILD_DIR, "integration")
+
+# set in each test's process; shared by the builds of all tests
+JOBSERVER: Optional[Jobserver] = None
+
+# one JSON result per line and corpus for each `--benchmark` run
+BENCHMARK_HISTORY = os.path.join(INTEGRATION_DIR, "benchmark_history.jsonl")
+# number of earlier results of a corpus that a new result is compared with
+BENCHMARK_BASELINE = 5
+
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+# logged by `transpile_single` at `--log-level info`
+TIMING_LOG = re.compile(
+    r"^info: (exported the AST of|translated) (.+) in ([0-9.]+)s$")
 
 minimal_snippet = """ \
 int main() { return 0; }
@@ -64,6 +94,7 @@ int main() {
 }
 """
 
+# formatted with the test's own temporary directory
 minimal_cc_db = """ \
 [
   {{
@@ -72,13 +103,70 @@ minimal_cc_db = """ \
     "file": "test.c"
   }}
 ]
-""".format(tempfile.gettempdir())
+"""
+
+
+def fetch(url: str, archive: str, src_dir: str) -> None:
+    with pb.local.cwd(c.BUILD_DIR):
+        if not os.path.isfile(archive):
+            download_archive(url, archive)
+        if not os.path.isdir(src_dir):
+            invoke_quietly(TAR, "xf", archive)
+
+
+def make(*prefix: pb.commands.BaseCommand) -> None:
+    """
+    run make, optionally under `prefix` (e.g. bear), with the jobs of the
+    shared jobserver.
+    """
+    assert JOBSERVER is not None
+    cmd = MAKE
+    for wrapper in reversed(prefix):
+        cmd = wrapper[cmd]
+    invoke_with_jobserver(cmd, JOBSERVER)
+
+
+def cached_build(name: str, archive: str, cc_db_file: str,
+                 build: Callable[[], None], args: argparse.Namespace,
+                 **config: Any) -> None:
+    """
+    run `build` to build an upstream project and generate `cc_db_file`,
+    unless the last build used the same archive, compiler and `config`.
+    Rebuilding Ruby takes much longer than translating it.
+    """
+    key = {
+        'archive': sha256_file(os.path.join(c.BUILD_DIR, archive)),
+        'compiler': CLANG('--version'),
+        'config': config,
+    }
+    stamp_file = os.path.join(INTEGRATION_DIR, name + '.json')
+    if not args.rebuild and os.path.isfile(cc_db_file):
+        try:
+            with open(stamp_file) as fh:
+                stamp = json.load(fh)
+        except (OSError, ValueError):
+            stamp = None
+        if stamp == {'key': key, 'sha256': sha256_file(cc_db_file)}:
+            logging.info("using cached build of %s", name)
+            return
+
+    build()
+    if not os.path.isfile(cc_db_file):
+        die("missing " + cc_db_file, errno.ENOENT)
+    stamp = {'key': key, 'sha256': sha256_file(cc_db_file)}
+    write_atomically(stamp_file, lambda fh: json.dump(stamp, fh, indent=2))
 
 
 def _test_minimal(code_snippet: str) -> bool:
     transpiler = get_cmd_or_die(c.TRANSPILER)
 
-    tempdir = tempfile.gettempdir()
+    # concurrent tests must not share their files
+    with tempfile.TemporaryDirectory(prefix="c2rust_integration_") as tempdir:
+        return _transpile_snippet(transpiler, code_snippet, tempdir)
+
+
+def _transpile_snippet(transpiler: pb.commands.BaseCommand,
+                       code_snippet: str, tempdir: str) -> bool:
     cfile = os.path.join(tempdir, "test.c")
     with open(cfile, 'w') as fh:
         fh.write(code_snippet)
@@ -86,7 +174,7 @@ def _test_minimal(code_snippet: str) -> bool:
     # avoid warnings about missing compiler flags, not strictly required
     cc_json = os.path.join(tempdir, "compile_commands.json")
     with open(cc_json, 'w') as fh:
-        fh.write(minimal_cc_db)
+        fh.write(minimal_cc_db.format(tempdir))
 
     ld_lib_path = get_rust_toolchain_libpath()
 
@@ -114,26 +202,46 @@ def test_hello_world(_: argparse.Namespace) -> bool:
     return _test_minimal(hello_world_snippet)
 
 
-def test_json_c(args: argparse.Namespace) -> bool:
-    if not os.path.isfile(os.path.join(c.BUILD_DIR, JSON_C_ARCHIVE)):
-        with pb.local.cwd(c.BUILD_DIR):
-            download_archive(JSON_C_URL, JSON_C_ARCHIVE)
-            invoke_quietly(TAR, "xf", JSON_C_ARCHIVE)
+def prepare_json_c(args: argparse.Namespace) -> str:
+    fetch(JSON_C_URL, JSON_C_ARCHIVE, JSON_C_SRC)
+
+    def build() -> None:
+        with pb.local.cwd(JSON_C_SRC), pb.local.env(CC="clang"):
+            if os.path.isfile('Makefile'):
+                invoke(MAKE['clean'])
+            configure = pb.local.get("./configure")
+            invoke(configure)
+            make(BEAR)
 
     cc_db_file = os.path.join(JSON_C_SRC, c.CC_DB_JSON)
-    # unconditionally compile json-c since we don't know if
-    # cc_db was generated from the environment we're in.
-    with pb.local.cwd(JSON_C_SRC), pb.local.env(CC="clang"):
-        if os.path.isfile('Makefile'):
-            invoke(MAKE['clean'])
-        configure = pb.local.get("./configure")
-        invoke(configure)
-        invoke(BEAR[MAKE[JOBS]])
+    cached_build("json-c", JSON_C_ARCHIVE, cc_db_file, build, args)
+    return cc_db_file
 
-    if not os.path.isfile(cc_db_file):
-        die("missing " + cc_db_file, errno.ENOENT)
 
-    return transpile(cc_db_file)
+def test_json_c(args: argparse.Namespace) -> bool:
+    return transpile(prepare_json_c(args))
+
+
+def prepare_lua(args: argparse.Namespace) -> str:
+    """
+    download lua and compile it with cmake to create
+    a compiler command database.
+    """
+
+    fetch(LUA_URL, LUA_ARCHIVE, LUA_SRC)
+
+    build_dir = os.path.join(LUA_SRC, "build")
+
+    def build() -> None:
+        rmtree(build_dir, ignore_errors=True)
+        os.mkdir(build_dir)
+        with pb.local.cwd(build_dir), pb.local.env(CC="clang"):
+            invoke(CMAKE['-DCMAKE_EXPORT_COMPILE_COMMANDS=1', LUA_SRC])
+            make()
+
+    cc_db_file = os.path.join(build_dir, c.CC_DB_JSON)
+    cached_build("lua", LUA_ARCHIVE, cc_db_file, build, args)
+    return cc_db_file
 
 
 def test_lua(args: argparse.Namespace) -> bool:
@@ -142,53 +250,245 @@ def test_lua(args: argparse.Namespace) -> bool:
     a compiler command database, and use it to
     drive the transpiler.
     """
+    return transpile(prepare_lua(args))
 
-    if not os.path.isfile(os.path.join(c.BUILD_DIR, LUA_ARCHIVE)):
-        with pb.local.cwd(c.BUILD_DIR):
-            download_archive(LUA_URL, LUA_ARCHIVE)
-    if not os.path.isdir(LUA_SRC):
-        with pb.local.cwd(c.BUILD_DIR):
-            invoke_quietly(TAR, "xf", LUA_ARCHIVE)
 
-    # unconditionally compile lua since we don't know if
-    # cc_db was generated from the environment we're in.
-    build_dir = os.path.join(LUA_SRC, "build")
-    rmtree(build_dir, ignore_errors=True)
-    os.mkdir(build_dir)
-    with pb.local.cwd(build_dir), pb.local.env(CC="clang"):
-        invoke(CMAKE['-DCMAKE_EXPORT_COMPILE_COMMANDS=1', LUA_SRC])
-        invoke(MAKE[JOBS])
+def prepare_ruby(args: argparse.Namespace) -> str:
+    if on_mac():
+        die("transpiling ruby on mac is not supported.")
 
-    cc_db_file = os.path.join(LUA_SRC, "build", c.CC_DB_JSON)
-    if not os.path.isfile(cc_db_file):
-        die("missing " + cc_db_file, errno.ENOENT)
+    fetch(RUBY_URL, RUBY_ARCHIVE, RUBY_SRC)
+
+    def build() -> None:
+        with pb.local.cwd(RUBY_SRC), pb.local.env(CC="clang",
+                                                  cflags="-w"):
+            configure = pb.local.get("./configure")
+            invoke(configure)
+            make(BEAR)
 
-    return transpile(cc_db_file)
+    cc_db_file = os.path.join(RUBY_SRC, c.CC_DB_JSON)
+    cached_build("ruby", RUBY_ARCHIVE, cc_db_file, build, args,
+                 cflags="-w")
+    return cc_db_file
 
 
 def test_ruby(args: argparse.Namespace) -> bool:
-    if on_mac():
-        die("transpiling ruby on mac is not supported.")
+    return transpile(prepare_ruby(args))
 
-    if not os.path.isfile(os.path.join(c.BUILD_DIR, RUBY_ARCHIVE)):
-        with pb.local.cwd(c.BUILD_DIR):
-            download_archive(RUBY_URL, RUBY_ARCHIVE)
-            invoke_quietly(TAR, "xf", RUBY_ARCHIVE)
 
-    cc_db_file = os.path.join(RUBY_SRC, c.CC_DB_JSON)
+# corpus name -> function that builds the corpus and returns its cc_db
+CORPORA: Dict[str, Callable[[argparse.Namespace], str]] = {
+    "json_c": prepare_json_c,
+    "lua": prepare_lua,
+    "ruby": prepare_ruby,
+}
 
-    # unconditionally compile ruby since we don't know if
-    # cc_db was generated from the environment we're in.
-    with pb.local.cwd(RUBY_SRC), pb.local.env(CC="clang",
-                                              cflags="-w"):
-        configure = pb.local.get("./configure")
-        invoke(configure)
-        invoke(BEAR[MAKE[JOBS]])
 
-    if not os.path.isfile(cc_db_file):
-        die("missing " + cc_db_file, errno.ENOENT)
+def _count_sources(cc_db_file: str) -> Tuple[int, int]:
+    """
+    the number of translation units in `cc_db_file` and their lines of C.
+    """
+    files = {abs_file(entry) for entry in CompileDb(cc_db_file)}
+    loc = 0
+    for path in files:
+        with open(path, 'rb') as fh:
+            loc += sum(1 for _ in fh)
+    return len(files), loc
 
-    return transpile(cc_db_file)
+
+def _time_transpile(cc_db_file: str) -> Dict[str, float]:
+    """
+    translate `cc_db_file` once into a scratch directory and measure the
+    wall and CPU time, the peak RSS and the time that the transpiler logs
+    for exporting and translating the ASTs.
+    """
+    with tempfile.TemporaryDirectory(prefix="c2rust_benchmark_") as tempdir:
+        argv = [c.C2RUST_BIN, 'transpile', cc_db_file,
+                '--output-dir', os.path.join(tempdir, "out"),
+                '--overwrite-existing', '--log-level', 'info']
+        # a file rather than a pipe, so that the transpiler can't block on
+        # it while we wait for its resource usage
+        with open(os.path.join(tempdir, "log"), 'w+b') as log:
+            start = time.monotonic()
+            proc = subprocess.Popen(argv, stdout=log, stderr=log)
+            _, status, rusage = os.wait4(proc.pid, 0)
+            wall = time.monotonic() - start
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            log.seek(0)
+            output = log.read().decode(errors='replace')
+
+    if proc.returncode != 0:
+        logging.critical(output)
+        die("transpiling {} failed with exit code {}".format(
+            cc_db_file, proc.returncode), proc.returncode)
+
+    timings = {'ast_export_s': 0.0, 'emit_s': 0.0, 'translated': 0}
+    for line in output.splitlines():
+        m = TIMING_LOG.match(ANSI_ESCAPE.sub('', line))
+        if not m:
+            continue
+        if m.group(1) == "translated":
+            timings['emit_s'] += float(m.group(3))
+            timings['translated'] += 1
+        else:
+            timings['ast_export_s'] += float(m.group(3))
+
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    rss_unit = 1024 * 1024 if on_mac() else 1024
+    return {
+        'wall_s': wall,
+        'cpu_s': rusage.ru_utime + rusage.ru_stime,
+        'peak_rss_mb': rusage.ru_maxrss / rss_unit,
+        **timings,
+    }
+
+
+def _regressions(result: Dict[str, Any], baseline: List[Dict[str, Any]],
+                 threshold: float) -> List[str]:
+    """
+    the metrics of `result` that are worse than the median of `baseline` by
+    more than `threshold`, as a fraction.
+    """
+    regressions = []
+    if not baseline:
+        return regressions
+    for metric in ('wall_s', 'peak_rss_mb'):
+        expected = statistics.median(b[metric] for b in baseline)
+        if result[metric] > expected * (1 + threshold):
+            regressions.append("{}: {} regressed from {:.2f} to {:.2f}".format(
+                result['corpus'], metric, expected, result[metric]))
+    return regressions
+
+
+def benchmark(args: argparse.Namespace) -> bool:
+    """
+    translate each corpus `args.benchmark` times after `args.warmup` runs,
+    append the medians to the history file and compare them with the last
+    results there. Returns whether no metric regressed.
+    """
+    global JOBSERVER
+    corpora = {name: prepare for name, prepare in CORPORA.items()
+               if args.regex.search(name)}
+    if not corpora:
+        die("nothing to benchmark")
+
+    history = []
+    if os.path.isfile(args.history):
+        with open(args.history) as fh:
+            history = [json.loads(line) for line in fh if line.strip()]
+    git = get_cmd_or_die("git")
+    with pb.local.cwd(c.ROOT_DIR):
+        commit = git('rev-parse', 'HEAD').strip()
+
+    # the corpora are built, if need be, but not translated concurrently
+    JOBSERVER = Jobserver(args.jobs)
+    regressions = []
+    for name, prepare in corpora.items():
+        cc_db_file = prepare(args)
+        units, loc = _count_sources(cc_db_file)
+
+        for _ in range(args.warmup):
+            _time_transpile(cc_db_file)
+        runs = [_time_transpile(cc_db_file) for _ in range(args.benchmark)]
+        if any(run['translated'] != units for run in runs):
+            logging.warning("%s: only translated %d of %d files", name,
+                            min(run['translated'] for run in runs), units)
+
+        wall = statistics.median(run['wall_s'] for run in runs)
+        result = {
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': commit,
+            'corpus': name,
+            'runs': args.benchmark,
+            'units': units,
+            'loc': loc,
+            'wall_s': wall,
+            'cpu_s': statistics.median(run['cpu_s'] for run in runs),
+            'units_per_s': units / wall,
+            'loc_per_s': loc / wall,
+            'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+            'ast_export_s': statistics.median(
+                run['ast_export_s'] for run in runs),
+            'emit_s': statistics.median(run['emit_s'] for run in runs),
+        }
+        logging.info(
+            "%s: %.2fs, %.1f units/s, %.0f LOC/s, peak RSS %.0f MiB, "
+            "AST export %.2fs, translation %.2fs", name, wall,
+            result['units_per_s'], result['loc_per_s'],
+            result['peak_rss_mb'], result['ast_export_s'], result['emit_s'])
+
+        baseline = [h for h in history if h['corpus'] == name]
+        regressions += _regressions(result, baseline[-BENCHMARK_BASELINE:],
+                                    args.threshold)
+        with open(args.history, 'a') as fh:
+            fh.write(json.dumps(result) + "\n")
+
+    for regression in regressions:
+        logging.error(regression)
+    return not regressions
+
+
+def _run_test(test: Callable[[argparse.Namespace], bool],
+              args: argparse.Namespace, jobserver: Jobserver,
+              log_file: Optional[str]) -> None:
+    global JOBSERVER
+    if log_file:
+        fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(fd, sys.stdout.fileno())
+        os.dup2(fd, sys.stderr.fileno())
+        os.close(fd)
+    JOBSERVER = jobserver
+    # this token stands for the implicit job of the test's own make
+    token = jobserver.acquire()
+    try:
+        success = test(args)
+    finally:
+        jobserver.release(token)
+    sys.exit(0 if success else 1)
+
+
+def run_tests(tests: List[Callable[[argparse.Namespace], bool]],
+              args: argparse.Namespace) -> List[str]:
+    """
+    Run each test in its own process, since plumbum changes the working
+    directory and environment process-wide. Their builds share a jobserver
+    with `--jobs` tokens. Returns the names of the tests that failed.
+    """
+    # Interleaved output of concurrent tests is unreadable, so each one
+    # writes to its own log file unless it runs alone.
+    ensure_dir(INTEGRATION_DIR)
+    log_dir = INTEGRATION_DIR if len(tests) > 1 else None
+    jobserver = Jobserver(args.jobs)
+
+    ctx = multiprocessing.get_context('fork')
+    running = {}
+    for test in tests:
+        name = test.__name__
+        log_file = os.path.join(log_dir, name + '.log') if log_dir else None
+        logging.debug("running test: %s", name)
+        proc = ctx.Process(target=_run_test, name=name,
+                           args=(test, args, jobserver, log_file))
+        proc.start()
+        running[proc.sentinel] = (proc, log_file)
+
+    failed = []
+    while running:
+        for sentinel in multiprocessing.connection.wait(list(running)):
+            proc, log_file = running.pop(sentinel)
+            proc.join()
+            if proc.exitcode == 0:
+                print(Colors.OKGREEN + "{}: passed".format(proc.name) +
+                      Colors.NO_COLOR)
+                continue
+
+            failed.append(proc.name)
+            print(Colors.FAIL + "{}: failed".format(proc.name) +
+                  (" (log: {})".format(log_file) if log_file else "") +
+                  Colors.NO_COLOR)
+            if log_file:
+                with open(log_file, errors='replace') as fh:
+                    sys.stdout.writelines(fh.readlines()[-20:])
+    return failed
 
 
 def parse_args() -> argparse.Namespace:
@@ -204,13 +504,28 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument('-j', '--jobs', type=int, dest="jobs",
                         default=multiprocessing.cpu_count(),
                         help='max number of concurrent jobs')
+    parser.add_argument('--rebuild', default=False, action='store_true',
+                        help='rebuild the upstream projects even if their '
+                             'cached builds are up to date')
+    parser.add_argument('--benchmark', type=int, metavar='RUNS', default=0,
+                        help='instead of testing, translate the json-c, lua '
+                             'and ruby corpora RUNS times each and record '
+                             'the throughput')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='untimed runs before benchmarking a corpus')
+    parser.add_argument('--history', default=BENCHMARK_HISTORY,
+                        help='file that benchmark results are appended to')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='fail the benchmark if the time or peak RSS of '
+                             'a corpus exceeds the median of its last {} '
+                             'results by more than this fraction'.format(
+                                 BENCHMARK_BASELINE))
     parser.add_argument('-v', '--verbose', default=False, dest="verbose",
                         help='enable verbose output')
     return parser.parse_args()
 
 
 def main() -> None:
-    global JOBS
     setup_logging()
     logging.debug("args: %s", " ".join(sys.argv))
 
@@ -224,7 +539,15 @@ def main() -> None:
     ensure_dir(c.BUILD_DIR)
 
     args = parse_args()
-    JOBS = '-j' + str(args.jobs)
+
+    if args.benchmark > 0:
+        ensure_dir(INTEGRATION_DIR)
+        if benchmark(args):
+            logging.info("PASS")
+        else:
+            logging.info("FAIL")
+            quit(1)
+        return
 
     # filter what gets tested using `what` argument
     tests = [test_minimal,
@@ -237,18 +560,14 @@ def main() -> None:
     if not tests:
         die("nothing to test")
 
-    success = True
-    for t in tests:
-        logging.debug("running test: %s", t.__name__)
-        success = success and t(args)
+    failed = run_tests(tests, args)
 
     # FIXME: test lighttpd, varnish, Python, etc.
-    # FIXME: add rebuild option?.
 
-    if success:
+    if not failed:
         logging.info("PASS")
     else:
-        logging.info("FAIL")
+        logging.info("FAIL: %s", ", ".join(failed))
         quit(1)
 
 
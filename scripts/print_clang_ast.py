@@ -2,60 +2,146 @@
 
 import os
 import sys
-import json
+import argparse
+import hashlib
 import logging
 import subprocess
-from typing import Any, Dict, List
-from common import setup_logging, die, get_cmd_or_die
+import tempfile
+from typing import List, Optional
+from common import config as c, setup_logging, die, get_cmd_or_die
+from compile_db import CompileDb, Entry, arguments
 
+# dumps by hash of the preprocessed source and the dump flags
+CACHE_DIR = os.path.join(c.BUILD_DIR, "clang_ast_cache")
 
-def dump_ast(cmd: Dict[str, Any]) -> None:
-    args: List[str] = cmd["arguments"]
-    assert len(args) >= 3 and args[1] == "-c"
-    args[0] = "clang"
-    args[1] = "-fsyntax-only"
-    args.append("-Xclang")
-    args.append("-ast-dump")
-    cmd_str: str = " ".join(args)
 
-    olddir = os.curdir
+def clang_args(entry: Entry) -> List[str]:
+    """
+    The arguments of the compiler invocation in `entry` without the
+    compiler, `-c` and the output file, so that clang can preprocess or
+    parse the file instead of compiling it.
+    """
+    args = arguments(entry)[1:]
+    kept = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg == "-o":
+            skip = True
+        elif arg != "-c":
+            kept.append(arg)
+    return kept
+
+
+def dump_flags(filter: Optional[str] = None,
+               json_format: bool = False) -> List[str]:
+    flags = ["-fsyntax-only", "-Xclang",
+             "-ast-dump=json" if json_format else "-ast-dump"]
+    if filter:
+        flags += ["-Xclang", "-ast-dump-filter", "-Xclang", filter]
+    return flags
+
+
+def _run_clang(entry: Entry, flags: List[str]) -> bytes:
+    argv = ["clang"] + clang_args(entry) + flags
+    logging.debug("running %s in %s", " ".join(argv), entry["directory"])
+    proc = subprocess.run(argv, cwd=entry["directory"],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        die("clang exited with code {}:\n{}".format(
+            proc.returncode, proc.stderr.decode(errors="replace")),
+            proc.returncode)
+    return proc.stdout
+
+
+def cache_key(entry: Entry, flags: List[str]) -> str:
+    """
+    Hash everything that a dump depends on: the preprocessed source, the
+    clang version, the location of the file, which appears in the dump, and
+    the dump flags.
+    """
+    hm = hashlib.sha256()
+    hm.update(_run_clang(entry, ["-E"]))
+    version = subprocess.run(["clang", "--version"], stdout=subprocess.PIPE,
+                             check=True).stdout
+    hm.update(version)
+    for part in [entry["directory"], entry["file"]] + clang_args(entry) + flags:
+        hm.update(part.encode() + b"\0")
+    return hm.hexdigest()
+
+
+def dump_ast(entry: Entry, filter: Optional[str] = None,
+             json_format: bool = False,
+             cache_dir: Optional[str] = CACHE_DIR) -> bytes:
+    """
+    Dump the Clang AST of the file compiled by `entry`, optionally only the
+    declarations whose qualified names contain `filter`, and as JSON. Dumps
+    are cached in `cache_dir` unless it is `None`.
+    """
+    flags = dump_flags(filter, json_format)
+    if cache_dir is None:
+        return _run_clang(entry, flags)
+
+    cache_file = os.path.join(cache_dir, cache_key(entry, flags))
     try:
-        os.chdir(cmd["directory"])
-        subprocess.call(cmd_str, shell=True)
-    finally:
-        os.chdir(olddir)
+        with open(cache_file, "rb") as fh:
+            return fh.read()
+    except FileNotFoundError:
+        pass
+
+    dump = _run_clang(entry, flags)
+    os.makedirs(cache_dir, exist_ok=True)
+    # concurrent callers may dump the same file
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, "wb") as fh:
+        fh.write(dump)
+    os.replace(tmp_path, cache_file)
+    return dump
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Print the Clang AST of a file in a compilation "
+                    "database.")
+    parser.add_argument("c_file", help="file to dump, matched by basename")
+    parser.add_argument("compile_commands",
+                        help="path/to/compile_commands.json")
+    parser.add_argument("-f", "--filter", metavar="NAME",
+                        help="only dump declarations whose qualified names "
+                             "contain NAME")
+    parser.add_argument("--json", action="store_true",
+                        help="dump the AST as JSON")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="don't use or store cached dumps")
+    return parser.parse_args()
 
 
 def main() -> None:
     setup_logging()
-    if not len(sys.argv) == 3:
-        print(
-            "usage: print_clang_ast.py <file.c> path/to/compile_commands.json",
-            file=sys.stderr)
-        exit(1)
-    c_file: str = os.path.basename(sys.argv[1])
-    compile_commands_path: str = sys.argv[2]
+    args = _parse_args()
+    c_file: str = os.path.basename(args.c_file)
+    compile_commands_path: str = args.compile_commands
 
     # do we have clang in path?
     get_cmd_or_die("clang")
 
     try:
-        with open(compile_commands_path, "r") as fh:
-            commands = json.load(fh)
+        commands = CompileDb(compile_commands_path).by_basename(c_file)
     except FileNotFoundError:
         die(f"file not found: " + compile_commands_path)
+    except ValueError as e:
+        die(str(e))
 
-    commands = filter(
-        lambda c: os.path.basename(c["file"]) == c_file,
-        commands)
-
-    cmd = next(commands, None)
-    if not cmd:
+    if not commands:
         die(f"no command to compile {c_file}")
-    elif next(commands, None):
+    elif len(commands) > 1:
         logging.warning(f"warning: found multiple commands for {c_file}")
-    
-    dump_ast(cmd)
+    cmd = commands[0]
+
+    dump = dump_ast(cmd, args.filter, args.json,
+                    None if args.no_cache else CACHE_DIR)
+    sys.stdout.buffer.write(dump)
 
 
 if __name__ == "__main__":
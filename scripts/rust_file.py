@@ -2,7 +2,7 @@ import logging
 import os
 
 from enum import Enum
-from common import get_cmd_or_die, NonZeroReturn
+from common import get_cmd_or_die, NonZeroReturn, write_atomically
 from plumbum.machines.local import LocalCommand
 from typing import Iterable, List, Optional, Set, Tuple
 
@@ -137,6 +137,23 @@ class RustMatch:
         return buffer
 
 
+def write_if_changed(path: str, content: str) -> bool:
+    """
+    Atomically replace the file at `path` with `content` unless it already
+    has that content, so that its mtime and cargo's fingerprints survive
+    reruns that generate the same code. Returns whether the file was written.
+    """
+    try:
+        with open(path, 'r') as fh:
+            if fh.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+
+    write_atomically(path, lambda fh: fh.write(content))
+    return True
+
+
 class RustFileBuilder:
     def __init__(self) -> None:
         self.features: Set[str] = set()
@@ -147,31 +164,33 @@ class RustFileBuilder:
         self.functions: List[RustFunction] = []
 
     def __str__(self) -> str:
+        # Sets are emitted in sorted order so that identical builders always
+        # produce identical files.
         buffer = ""
 
-        for feature in self.features:
+        for feature in sorted(self.features):
             buffer += "#![feature({})]\n".format(feature)
 
         buffer += '\n'
 
         for pragma in self.pragmas:
-            buffer += "#![{}({})]\n".format(pragma[0], ",".join(pragma[1]))
+            buffer += "#![{}({})]\n".format(pragma[0], ",".join(sorted(pragma[1])))
 
         buffer += '\n'
 
-        for crate in self.extern_crates:
+        for crate in sorted(self.extern_crates):
             # TODO(kkysen) `#[macro_use]` shouldn't be needed.
             # Waiting on fix for https://github.com/immunant/c2rust/issues/426.
             buffer += "#[macro_use] extern crate {};\n".format(crate)
 
         buffer += '\n'
 
-        for mod in self.mods:
+        for mod in sorted(self.mods, key=lambda m: (m.name, m.visibility.value)):
             buffer += str(mod)
 
         buffer += '\n'
 
-        for use in self.uses:
+        for use in sorted(self.uses, key=lambda u: (u.use, u.visibility.value)):
             buffer += str(use)
 
         buffer += '\n'
@@ -217,7 +236,6 @@ class RustFileBuilder:
         self.functions.extend(functions)
 
     def build(self, path: str) -> RustFile:
-        with open(path, 'w') as fh:
-            fh.write(str(self))
+        write_if_changed(path, str(self))
 
         return RustFile(path)
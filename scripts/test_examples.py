@@ -2,25 +2,34 @@
 
 import argparse
 import errno
+import json
 import logging
 import os
 import multiprocessing
+import multiprocessing.connection
 import re
+import subprocess
 import sys
 
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 from common import (
     config as c,
     pb,
     Colors,
+    Jobserver,
     die,
     get_cmd_or_die,
+    ensure_dir,
     invoke,
+    invoke_with_jobserver,
     regex,
     setup_logging,
+    sha256_file,
     transpile,
-    on_mac
+    on_mac,
+    write_atomically,
 )
 
 cargo = get_cmd_or_die('cargo')
@@ -32,6 +41,11 @@ rustc = get_cmd_or_die('rustc')
 
 NUM_JOBS = multiprocessing.cpu_count()
 
+CONFIGURE_CFLAGS = "-g -O0"
+
+# seconds that each test executable of an example may run
+TEST_TIMEOUT = 600
+
 EXAMPLES = [
     'genann',
     'grabc',
@@ -60,6 +74,17 @@ def print_blue(msg: str) -> None:
 
 
 class Test:
+    # set when the phases run under a shared `Jobserver`
+    jobserver: Optional[Jobserver] = None
+    # number of jobs the running phase may use
+    jobs = NUM_JOBS
+    # whether `ib_cmd` is a `make` invocation that should run in parallel
+    parallel_ib = False
+    # arguments to `configure`, if `_gen_cc_db` runs it
+    configure_args: List[str] = []
+    # whether `test` runs test executables in parallel
+    parallel_test = False
+
     def __init__(self, args: argparse.Namespace):
         self.args = args
         self.project_name = ''
@@ -88,16 +113,75 @@ class Test:
     def autotools(self, configure_args: List[str] = []) -> None:
         with pb.local.cwd(self.repo_dir):
             invoke(pb.local['./autogen.sh'])
-            with pb.local.env(CFLAGS="-g -O0"):
+            with pb.local.env(CFLAGS=CONFIGURE_CFLAGS):
                 invoke(pb.local['./configure'], configure_args)
 
-    # `gen_cc_db` generates the `compile_commands.json` for a project
+    # Runs a command that understands the make jobserver protocol, such as
+    # `make` or `cargo`, with as many jobs as the machine allows.
+    def invoke_parallel(self, cmd: pb.commands.BaseCommand, *arguments: str) -> None:
+        if self.jobserver is None:
+            invoke(cmd, *arguments, '-j{}'.format(NUM_JOBS))
+            return
+
+        invoke_with_jobserver(cmd, self.jobserver, *arguments)
+
+    def intercept_build(self) -> None:
+        ib_cmd = list(self.ib_cmd)
+        if self.parallel_ib:
+            # intercept-build doesn't pass the jobserver on to make, so
+            # the phase holds all of make's tokens itself
+            ib_cmd.append('-j{}'.format(self.jobs))
+        invoke(intercept_build, *ib_cmd)
+
+    # Everything that the generated `compile_commands.json` depends on
+    def cc_db_key(self) -> Dict[str, Any]:
+        with pb.local.cwd(self.repo_dir):
+            commit = git('rev-parse', 'HEAD').strip()
+        compiler = pb.local[os.environ.get('CC', 'cc')]
+        return {
+            'commit': commit,
+            'configure_args': self.configure_args,
+            'configure_cflags': CONFIGURE_CFLAGS,
+            'ib_cmd': self.ib_cmd,
+            'compiler': compiler('--version'),
+        }
+
+    def _cc_db_stamp(self) -> str:
+        return os.path.join(c.BUILD_DIR, 'examples', 'cc_db',
+                            self.project_name + '.json')
+
+    # `gen_cc_db` generates the `compile_commands.json` for a project, unless
+    # the one generated last time is still up to date. Configuring and
+    # building a project just to capture its compile commands is most of
+    # the runtime of some examples.
     def gen_cc_db(self) -> None:
+        cc_db = os.path.join(self.repo_dir, 'compile_commands.json')
+        stamp_file = self._cc_db_stamp()
+        key = self.cc_db_key()
+
+        if not self.args.regen_cc_db and os.path.isfile(cc_db):
+            try:
+                with open(stamp_file) as fh:
+                    stamp = json.load(fh)
+            except (OSError, ValueError):
+                stamp = None
+            if stamp == {'key': key, 'sha256': sha256_file(cc_db)}:
+                print_blue("Using cached {}".format(cc_db))
+                self.cc_db = cc_db
+                return
+
+        self._gen_cc_db()
+        self.cc_db = build_path(self.repo_dir, 'compile_commands.json',
+                                is_dir=False)
+        ensure_dir(os.path.dirname(stamp_file))
+        stamp = {'key': key, 'sha256': sha256_file(self.cc_db)}
+        write_atomically(stamp_file,
+                         lambda fh: json.dump(stamp, fh, indent=2))
+
+    def _gen_cc_db(self) -> None:
         with pb.local.cwd(self.repo_dir):
             invoke(make, ['clean'])
-            invoke(intercept_build, *self.ib_cmd)
-            self.cc_db = build_path(self.repo_dir, 'compile_commands.json',
-                                    is_dir=False)
+            self.intercept_build()
 
     # `transpile` in most cases runs the transpile function from `common.py`,
     # which in turn just calls `c2rust transpile *args`
@@ -111,16 +195,73 @@ class Test:
     # will be built or rustc will be called directly
     def build(self) -> None:
         with pb.local.cwd(self.rust_src):
-            invoke(cargo, ['build', '-j{}'.format(NUM_JOBS)])
+            self.invoke_parallel(cargo, 'build')
 
     def test(self) -> None:
         pass
 
+    def cargo_target_dir(self, crate_dir: str) -> str:
+        with pb.local.cwd(crate_dir):
+            metadata = json.loads(cargo('metadata', '--no-deps',
+                                        '--format-version', '1'))
+        return metadata['target_directory']
+
+    # Runs test executables directly rather than through `cargo run`, each
+    # with a timeout and with its output captured. Tests that are not in
+    # `serial` run in parallel with each other.
+    def run_tests(self, tests: Dict[str, List[str]], cwd: str,
+                  serial: Set[str] = set()) -> None:
+        def run_one(name: str) -> Tuple[str, Optional[str], bytes]:
+            try:
+                proc = subprocess.run(tests[name], cwd=cwd,
+                                      capture_output=True,
+                                      timeout=TEST_TIMEOUT)
+            except subprocess.TimeoutExpired as e:
+                error = "timed out after {}s".format(TEST_TIMEOUT)
+                return name, error, (e.stdout or b'') + (e.stderr or b'')
+            error = None
+            if proc.returncode != 0:
+                error = "exited with code {}".format(proc.returncode)
+            return name, error, proc.stdout + proc.stderr
+
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as pool:
+            results = list(pool.map(run_one,
+                                    [t for t in tests if t not in serial]))
+        results.extend(run_one(t) for t in tests if t in serial)
+
+        failed = []
+        for name, error, output in results:
+            output_str = output.decode(errors='replace')
+            logging.debug("output of %s:\n%s", name, output_str)
+            if error is None:
+                print(Colors.OKGREEN + "{}: passed".format(name) +
+                      Colors.NO_COLOR)
+            else:
+                print(Colors.FAIL + "{}: {}".format(name, error) +
+                      Colors.NO_COLOR)
+                sys.stdout.write(output_str)
+                failed.append(name)
+        if failed:
+            die("{} tests failed: {}".format(self.project_name,
+                                             ", ".join(failed)))
+
+    def run_phase(self, phase: Callable[[], None]) -> None:
+        if self.jobserver is None:
+            phase()
+            return
+
+        greedy = (self.parallel_ib and phase == self.gen_cc_db) or \
+            (self.parallel_test and phase == self.test)
+        tokens = self.jobserver.acquire(greedy)
+        self.jobs = len(tokens)
+        try:
+            phase()
+        finally:
+            self.jobserver.release(tokens)
+
     def build_and_test(self) -> None:
-        self.gen_cc_db()
-        self.transpile()
-        self.build()
-        self.test()
+        for phase in (self.gen_cc_db, self.transpile, self.build, self.test):
+            self.run_phase(phase)
 
 
 class Genann(Test):
@@ -131,36 +272,31 @@ class Genann(Test):
             c.EXAMPLES_DIR, self.project_name, is_dir=True)
         self.repo_dir = build_path(self.example_dir, 'repo', is_dir=True)
         self.rust_src = os.path.join(self.example_dir, 'rust')
+        # the examples whose translations are tested
+        self.binaries = ['example1', 'example4']
         self.transpiler_args = ['--emit-build-files', '--overwrite-existing',
                                 '--output-dir', self.rust_src]
+        for binary in self.binaries:
+            self.transpiler_args.extend(['--binary', binary])
         self.ib_cmd = ['make']
+        self.parallel_test = True
         self.init_submodule()
 
     def __del__(self) -> None:
         self.deinit_submodule()
 
+    # The crate is translated once with all of the binaries, which `build`
+    # builds together.
     def test(self) -> None:
-        rm = get_cmd_or_die('rm')
         ln = get_cmd_or_die('ln')
-        for N in (1, 4):
-            test = 'example{}'.format(N)
-            with pb.local.cwd(self.repo_dir):
-                invoke(rm, ['-rf', self.rust_src])
-
-            self._transpile_example(test)
-            with pb.local.cwd(self.rust_src):
-                # Create a link to the example data files
-                invoke(ln, ['-sf', build_path(self.repo_dir, 'example', True)])
-                invoke(cargo, ['run'])
-
-    # Helper function that transpiles whatever test is
-    # passed in as `main`
-    def _transpile_example(self, main: str) -> None:
-        transpile(self.cc_db,
-                  emit_build_files=False,
-                  extra_transpiler_args=['--emit-build-files', '--binary', main,
-                                         '--overwrite-existing',
-                                         '--output-dir', self.rust_src])
+        with pb.local.cwd(self.rust_src):
+            # Create a link to the example data files
+            invoke(ln, ['-sfn', build_path(self.repo_dir, 'example', True)])
+
+        bin_dir = os.path.join(self.cargo_target_dir(self.rust_src), 'debug')
+        self.run_tests({binary: [os.path.join(bin_dir, binary)]
+                        for binary in self.binaries},
+                       cwd=self.rust_src)
 
 
 class Grabc(Test):
@@ -188,7 +324,12 @@ class Libxml2(Test):
         self.args = args
         self.project_name = 'libxml2'
         self.transpiler_args = []
-        self.ib_cmd = ['make', 'check', '-j{}'.format(NUM_JOBS)]
+        self.ib_cmd = ['make', 'check']
+        self.parallel_ib = True
+        # Without --disable-static, libtool builds two copies of many source
+        # files. We can't handle that, so we disable that behavior here.
+        self.configure_args = ['--disable-static']
+        self.parallel_test = True
         self.example_dir = build_path(
             c.EXAMPLES_DIR, self.project_name, is_dir=True)
         self.repo_dir = build_path(self.example_dir, 'repo', is_dir=True)
@@ -199,20 +340,24 @@ class Libxml2(Test):
     def __del__(self) -> None:
         self.deinit_submodule()
 
-    def gen_cc_db(self) -> None:
-        # Without --disable-static, libtool builds two copies of many source
-        # files. We can't handle that, so we disable that behavior here.
-        self.autotools(['--disable-static'])
+    def _gen_cc_db(self) -> None:
+        self.autotools(self.configure_args)
         with pb.local.cwd(self.repo_dir):
             invoke(make, ['clean'])
-            invoke(intercept_build, *self.ib_cmd)
+            self.intercept_build()
 
     def transpile(self) -> None:
         with pb.local.cwd(self.example_dir):
             invoke(pb.local['./translate.py'])
             invoke(pb.local['./patch_translated_code.py'])
 
-    # Iterates through the list of tests, and then runs each one
+    # Builds all of the tests at once in the build phase, so cargo gets the
+    # jobserver's free tokens rather than the ones `test` holds greedily
+    def build(self) -> None:
+        with pb.local.cwd(self.rust_src):
+            self.invoke_parallel(cargo, 'build', '--examples')
+
+    # Runs each of the examples built by `build`
     def test(self) -> None:
         # testname -> input_file
         tests: Dict[str, List[str]] = {
@@ -237,11 +382,17 @@ class Libxml2(Test):
             "testAutomata": ['test/automata/po'],
         }
 
+        # these write scratch files to the working directory
+        serial = {"runtest", "testapi"}
+
+        examples_dir = os.path.join(self.cargo_target_dir(self.rust_src),
+                                    'debug', 'examples')
+        commands = {}
         for test, input_file in tests.items():
-            with pb.local.cwd(self.rust_src):
-                example_args = ['run', '--example', test]
-                example_args.extend(input_file)
-                invoke(cargo, *example_args)
+            # drop the `--` that separated the arguments from `cargo run`'s
+            args = input_file[1:] if input_file[:1] == ['--'] else input_file
+            commands[test] = [os.path.join(examples_dir, test)] + args
+        self.run_tests(commands, cwd=self.rust_src, serial=serial)
 
 
 class Lil(Test):
@@ -297,7 +448,8 @@ class TinyCC(Test):
         self.args = args
         self.project_name = 'tinycc'
         self.transpiler_args = []
-        self.ib_cmd = ['make', '-j{}'.format(NUM_JOBS)]
+        self.ib_cmd = ['make']
+        self.parallel_ib = True
         self.example_dir = build_path(
             c.EXAMPLES_DIR, self.project_name, is_dir=True)
         self.repo_dir = build_path(self.example_dir, 'repo', is_dir=True)
@@ -312,11 +464,11 @@ class TinyCC(Test):
         os.chdir(self.repo_dir)
         invoke(pb.local['./configure'])
 
-    def gen_cc_db(self) -> None:
-        self.autotools()
+    def _gen_cc_db(self) -> None:
+        self.autotools(self.configure_args)
         with pb.local.cwd(self.repo_dir):
             invoke(make, ['clean'])
-            invoke(intercept_build, *self.ib_cmd)
+            self.intercept_build()
 
     def transpile(self) -> None:
         with pb.local.cwd(self.example_dir):
@@ -331,7 +483,8 @@ class Tmux(Test):
         self.args = args
         self.project_name = 'tmux'
         self.transpiler_args = []
-        self.ib_cmd = ['make', 'check', '-j{}'.format(NUM_JOBS)]
+        self.ib_cmd = ['make', 'check']
+        self.parallel_ib = True
         self.example_dir = build_path(
             c.EXAMPLES_DIR, self.project_name, is_dir=True)
         self.repo_dir = build_path(self.example_dir, 'repo', is_dir=True)
@@ -342,11 +495,11 @@ class Tmux(Test):
     def __del__(self) -> None:
         self.deinit_submodule()
 
-    def gen_cc_db(self) -> None:
-        self.autotools()
+    def _gen_cc_db(self) -> None:
+        self.autotools(self.configure_args)
         with pb.local.cwd(self.repo_dir):
             invoke(make, ['clean'])
-            invoke(intercept_build, *self.ib_cmd)
+            self.intercept_build()
 
     def transpile(self) -> None:
         with pb.local.cwd(self.example_dir):
@@ -389,11 +542,9 @@ class Xzoom(Test):
     def __del__(self) -> None:
         self.deinit_submodule()
 
-    def gen_cc_db(self) -> None:
+    def _gen_cc_db(self) -> None:
         with pb.local.cwd(self.repo_dir):
-            invoke(intercept_build, *self.ib_cmd)
-            self.cc_db = build_path(self.repo_dir, 'compile_commands.json',
-                                    is_dir=False)
+            self.intercept_build()
 
     def build(self) -> None:
         with pb.local.cwd(self.repo_dir):
@@ -423,6 +574,12 @@ def _parser_args() -> argparse.Namespace:
         '--only-examples', dest='regex_examples', type=regex, default='.*',
         help="Regular Expression to filter which example to build and run"
     )
+    parser.add_argument('-j', '--jobs', type=int, default=NUM_JOBS,
+                        help='max number of jobs run by all examples together')
+    parser.add_argument('--regen-cc-db', default=False,
+                        action='store_true', dest='regen_cc_db',
+                        help='regenerate compile_commands.json even if the\
+                        cached one is up to date')
     parser.add_argument('--deinit', default=False,
                         action='store_true', dest='deinit',
                         help='Deinitialize the submodules, this will remove\
@@ -445,15 +602,74 @@ def run(args: argparse.Namespace) -> None:
         Urlparser(args),
         Xzoom(args),
     ]
-    for example in examples:
-        if args.regex_examples.fullmatch(example.project_name) and\
-        not _is_excluded(example.project_name):
-            example.build_and_test()
+    selected = [example for example in examples
+                if args.regex_examples.fullmatch(example.project_name) and
+                not _is_excluded(example.project_name)]
+
+    failed = run_examples(selected, Jobserver(args.jobs))
+    if failed:
+        die("failed examples: " + ", ".join(failed))
 
     print(Colors.OKGREEN + "Done building and testing the examples." +
           Colors.NO_COLOR)
 
 
+def _build_and_test(example: Test, jobserver: Jobserver,
+                    log_file: Optional[str]) -> None:
+    if log_file:
+        fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(fd, sys.stdout.fileno())
+        os.dup2(fd, sys.stderr.fileno())
+        os.close(fd)
+    example.jobserver = jobserver
+    example.build_and_test()
+
+
+def run_examples(examples: List[Test], jobserver: Jobserver) -> List[str]:
+    """
+    Build and test each example in its own process, so that their phases
+    overlap while the jobserver bounds the total number of jobs. Each process
+    has its own working directory and environment, which plumbum changes
+    process-wide. Returns the names of the examples that failed.
+    """
+    # Interleaved output of concurrent examples is unreadable, so each one
+    # writes to its own log file unless it runs alone.
+    log_dir = None
+    if len(examples) > 1:
+        log_dir = os.path.join(c.BUILD_DIR, 'examples')
+        ensure_dir(log_dir)
+
+    ctx = multiprocessing.get_context('fork')
+    running = {}
+    for example in examples:
+        name = example.project_name
+        log_file = os.path.join(log_dir, name + '.log') if log_dir else None
+        proc = ctx.Process(target=_build_and_test, name=name,
+                           args=(example, jobserver, log_file))
+        proc.start()
+        print_blue("Building and testing {}...".format(name) +
+                   (" (log: {})".format(log_file) if log_file else ""))
+        running[proc.sentinel] = (proc, log_file)
+
+    failed = []
+    while running:
+        for sentinel in multiprocessing.connection.wait(list(running)):
+            proc, log_file = running.pop(sentinel)
+            proc.join()
+            if proc.exitcode == 0:
+                print(Colors.OKGREEN + "{}: done".format(proc.name) +
+                      Colors.NO_COLOR)
+                continue
+
+            failed.append(proc.name)
+            print(Colors.FAIL + "{}: failed with exit code {}".format(
+                proc.name, proc.exitcode) + Colors.NO_COLOR)
+            if log_file:
+                with open(log_file, errors='replace') as fh:
+                    sys.stdout.writelines(fh.readlines()[-20:])
+    return failed
+
+
 def main() -> None:
     setup_logging()
     args = _parser_args()
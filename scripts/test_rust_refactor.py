@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 
+import argparse
+import difflib
+import hashlib
+import json
 import os
 import logging
-from typing import List
-
-import plumbum as pb
+import multiprocessing
+import re
+import signal
+import subprocess
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
 
 from common import (
     config as c,
@@ -14,11 +23,29 @@ from common import (
     get_host_triplet,
     setup_logging,
     die,
+    ensure_dir,
+    sha256_file,
+    write_atomically,
 )
 
 # Tools we will need
 rustfmt = get_cmd_or_die("rustfmt")
-diff = get_cmd_or_die("diff")
+
+REFACTOR_BIN = os.path.join(c.ROOT_DIR, "target/debug/c2rust-refactor")
+
+# seconds that a test case, i.e. its `run.sh`, may run
+DEFAULT_TIMEOUT = 300
+
+# results of earlier runs by test case, with the fingerprints of their inputs
+RESULTS_CACHE = os.path.join(c.BUILD_DIR, "refactor_test_results.json")
+# written by the test cases themselves
+GENERATED_SUFFIXES = (".new", ".log")
+
+WHITESPACE = re.compile(r"\s+")
+
+# Lua scripts named on a `run.sh` command line, and the modules they require
+LUA_SCRIPT = re.compile(r"[^\s'\"]+\.lua\b")
+LUA_REQUIRE = re.compile(r"""\brequire\s*\(?\s*["']([\w.]+)["']""")
 
 
 def get_testcases(directory: str) -> List[str]:
@@ -36,60 +63,285 @@ def get_testcases(directory: str) -> List[str]:
     return testcases
 
 
-def run_tests(testcases: List[str]) -> None:
-    ipath = os.path.join(c.ROOT_DIR, "target/debug/c2rust-refactor")
-    # refactor = '{ip} -P ../.. -p plugin_stub -r alongside'.format(ip=ipath)
+def test_env() -> Dict[str, str]:
+    """
+    The environment that the `run.sh` scripts expect.
+    """
+    # refactor = '{ip} -P ../.. -p plugin_stub -r alongside'.format(ip=REFACTOR_BIN)
     # NOTE:PL: I removed the plugin options (-P, -p) to get the tests to run.
-    refactor = '{ip} -r alongside'.format(ip=ipath)
+    refactor = '{ip} -r alongside'.format(ip=REFACTOR_BIN)
 
-    # help plumbum find rust
+    # help the refactoring tool find rust
     ld_lib_path = get_rust_toolchain_libpath()
-    if 'LD_LIBRARY_PATH' in pb.local.env:
-        ld_lib_path += ':' + pb.local.env['LD_LIBRARY_PATH']
+    if 'LD_LIBRARY_PATH' in os.environ:
+        ld_lib_path += ':' + os.environ['LD_LIBRARY_PATH']
 
     rustflags = "-L {rust_lib_dir}/rustlib/{triplet}/lib"
     rustflags = rustflags.format(rust_lib_dir=ld_lib_path,
                                  triplet=get_host_triplet())
 
-    with pb.local.env(RUST_BACKTRACE='1',
-                      RUST_LOG="c2rust_refactor=info",
-                      LD_LIBRARY_PATH=ld_lib_path,
-                      not_LD_LIBRARY_PATH=ld_lib_path,
-                      refactor=refactor,
-                      rustflags=rustflags):
-        for test in testcases:
-            script = pb.local.get(test)
-            testdir = os.path.dirname(test)
-            testname = os.path.basename(testdir)
-            try:
-                with pb.local.cwd(testdir):
-                    logging.debug("testing: %s", testdir)
-                    script.run()
-
-                    old_new_rust = os.path.join(testdir, "old.rs.new")
-                    assert os.path.isfile(old_new_rust), "missing rewritten rust"
-                    mode = "overwrite"  # set to 'replace' to generate backups
-                    rustfmt["--force", "--write-mode", mode, old_new_rust].run()
-
-                    new_rust = os.path.join(testdir, "new.rs")
-                    diff["-wB", new_rust, old_new_rust].run()
-
-                    print(" {}[ OK ]{} ".format(Colors.OKGREEN, Colors.NO_COLOR) + testname)
-                    logging.debug(" [ OK ] " + testname)
-            except pb.ProcessExecutionError as pee:
-                print(" {}[FAIL]{} ".format(Colors.FAIL, Colors.NO_COLOR) + testname)
-                logging.debug(" [FAIL] " + testname)
-                logfile = os.path.join(testdir, "log")
-                if os.path.exists(logfile):
-                    with open(logfile, "r") as fh:
-                        lines = fh.readlines()
-                        logging.debug("".join(lines))
+    env = dict(os.environ)
+    env.update(RUST_BACKTRACE='1',
+               RUST_LOG="c2rust_refactor=info",
+               LD_LIBRARY_PATH=ld_lib_path,
+               not_LD_LIBRARY_PATH=ld_lib_path,
+               refactor=refactor,
+               rustflags=rustflags)
+    return env
 
 
-def main() -> None:
-    # TODO: implement rustfmt and diff actions from `run-test.sh`
+def tool_fingerprint(env: Dict[str, str]) -> str:
+    """
+    Hash what all test cases depend on: the refactoring tool, rustfmt and
+    the variables that `run.sh` reads.
+    """
+    hm = hashlib.sha256()
+    hm.update(sha256_file(REFACTOR_BIN).encode())
+    hm.update(rustfmt("--version").encode())
+    for var in ("refactor", "rustflags"):
+        hm.update(env[var].encode() + b"\0")
+    return hm.hexdigest()
+
+
+def lua_inputs(testdir: str) -> List[str]:
+    """
+    The Lua scripts that the `run.sh` of a test case runs, and the modules
+    they require, transitively. Like the refactoring tool, modules are
+    looked up next to the script that requires them; others, such as
+    Penlight, are installed libraries and not inputs of the test.
+    """
+    with open(os.path.join(testdir, "run.sh")) as fh:
+        pending = [os.path.normpath(os.path.join(testdir, script))
+                   for script in LUA_SCRIPT.findall(fh.read())]
+    found: List[str] = []
+    while pending:
+        path = pending.pop()
+        if path in found or not os.path.isfile(path):
+            continue
+        found.append(path)
+        with open(path) as fh:
+            for module in LUA_REQUIRE.findall(fh.read()):
+                pending.append(os.path.join(
+                    os.path.dirname(path),
+                    module.replace(".", os.sep) + ".lua"))
+    return sorted(found)
+
+
+def testcase_fingerprint(test: str, tools: str) -> str:
+    """
+    Hash the inputs of a test case, i.e. every file in its directory that it
+    doesn't generate itself, such as `run.sh`, `old.rs`, `new.rs` and plugin
+    sources, and the Lua scripts it runs from elsewhere, together with the
+    fingerprint of the tools.
+    """
+    testdir = os.path.dirname(test)
+    paths = []
+    for root, subdirs, files in os.walk(testdir):
+        subdirs.sort()
+        paths += [os.path.join(root, name) for name in sorted(files)
+                  if not name.endswith(GENERATED_SUFFIXES)]
+    paths += [path for path in lua_inputs(testdir)
+              if os.path.relpath(path, testdir).startswith(os.pardir)]
+
+    hm = hashlib.sha256(tools.encode())
+    for path in paths:
+        hm.update(os.path.relpath(path, testdir).encode() + b"\0")
+        hm.update(sha256_file(path).encode())
+    return hm.hexdigest()
+
+
+def load_results_cache() -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(RESULTS_CACHE) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def store_results_cache(cache: Dict[str, Dict[str, Any]]) -> None:
+    write_atomically(RESULTS_CACHE, lambda fh: json.dump(cache, fh, indent=2))
+
+
+def _significant_lines(text: str) -> List[str]:
+    # what `diff -wB` compares: lines without whitespace, except blank ones
+    return [WHITESPACE.sub("", line) for line in text.splitlines()
+            if line.strip()]
+
 
+def compare(expected: str, actual: str, expected_name: str,
+            actual_name: str) -> Optional[str]:
+    """
+    Compare two sources, ignoring whitespace and blank lines. Returns a
+    unified diff if they differ.
+    """
+    if _significant_lines(expected) == _significant_lines(actual):
+        return None
+    return "".join(difflib.unified_diff(
+        [line for line in expected.splitlines(True) if line.strip()],
+        [line for line in actual.splitlines(True) if line.strip()],
+        expected_name, actual_name))
+
+
+def _run(cmd: List[str], cwd: str, env: Dict[str, str], timeout: float,
+         stdin: Optional[bytes] = None) -> subprocess.CompletedProcess:
+    # `run.sh` starts the refactoring tool as a child of its shell, so kill
+    # the whole process group on a timeout
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, start_new_session=True,
+                            stdin=subprocess.PIPE if stdin is not None
+                            else subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        stdout, stderr = proc.communicate(stdin, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.communicate()
+        raise
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+def run_testcase(test: str, env: Dict[str, str],
+                 timeout: float) -> Dict[str, Any]:
+    """
+    Run one test case and compare the formatted result of the refactoring
+    with its `new.rs`.
+    """
+    testdir = os.path.dirname(test)
+    result: Dict[str, Any] = {
+        "name": os.path.relpath(testdir, os.path.join(c.RREF_DIR, "tests")),
+        "passed": False,
+        "message": None,
+        "output": "",
+        "timed_out": False,
+    }
+    old_new_rust = os.path.join(testdir, "old.rs.new")
+    # don't compare with the output of an earlier run
+    if os.path.exists(old_new_rust):
+        os.unlink(old_new_rust)
+
+    start = time.monotonic()
+    logging.debug("testing: %s", testdir)
+    try:
+        script = _run([test], testdir, env, timeout)
+        result["output"] = (script.stdout + script.stderr).decode(
+            errors='replace')
+        if script.returncode != 0:
+            result["message"] = "run.sh exited with code {}".format(
+                script.returncode)
+        elif not os.path.isfile(old_new_rust):
+            result["message"] = "missing rewritten rust"
+        else:
+            with open(old_new_rust, "rb") as fh:
+                formatted = _run([str(rustfmt)], testdir, env,
+                                 timeout - (time.monotonic() - start),
+                                 stdin=fh.read())
+            if formatted.returncode != 0:
+                result["message"] = "rustfmt exited with code {}".format(
+                    formatted.returncode)
+                result["output"] += formatted.stderr.decode(errors='replace')
+            else:
+                with open(os.path.join(testdir, "new.rs")) as fh:
+                    expected = fh.read()
+                result["message"] = compare(
+                    expected, formatted.stdout.decode(), "new.rs",
+                    "old.rs.new")
+                result["passed"] = result["message"] is None
+    except subprocess.TimeoutExpired:
+        result["message"] = "timed out after {}s".format(timeout)
+        result["timed_out"] = True
+    result["duration"] = time.monotonic() - start
+    return result
+
+
+def _report(result: Dict[str, Any]) -> None:
+    testname = result["name"]
+    if result["cached"]:
+        testname += " (cached)"
+    if result["passed"]:
+        print(" {}[ OK ]{} ".format(Colors.OKGREEN, Colors.NO_COLOR) + testname)
+        logging.debug(" [ OK ] " + testname)
+    else:
+        print(" {}[FAIL]{} ".format(Colors.FAIL, Colors.NO_COLOR) + testname)
+        logging.debug(" [FAIL] %s: %s", testname, result["message"])
+        logging.debug(result["output"])
+
+
+def run_tests(testcases: List[str], jobs: int, timeout: float,
+              use_cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    Run the test cases in parallel. Unless `use_cache` is false, a test case
+    whose fingerprint matches that of an earlier run reports that run's
+    result instead.
+    """
+    env = test_env()
+    tools = tool_fingerprint(env)
+    cache = load_results_cache()
+    results = []
+    to_run = {}
+    for test in testcases:
+        fingerprint = testcase_fingerprint(test, tools)
+        cached = cache.get(test)
+        if use_cache and cached and cached["fingerprint"] == fingerprint:
+            result = dict(cached["result"], cached=True)
+            results.append(result)
+            _report(result)
+        else:
+            to_run[test] = fingerprint
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(run_testcase, test, env, timeout): test
+                   for test in to_run}
+        for future in as_completed(futures):
+            test = futures[future]
+            result = dict(future.result(), cached=False)
+            results.append(result)
+            _report(result)
+            # timeouts may depend on the load of the machine
+            if not result["timed_out"]:
+                cache[test] = {"fingerprint": to_run[test], "result": result}
+
+    if to_run:
+        store_results_cache(cache)
+    return sorted(results, key=lambda r: r["name"])
+
+
+def write_junit(path: str, results: List[Dict[str, Any]]) -> None:
+    suite = ET.Element(
+        "testsuite", name="c2rust-refactor", tests=str(len(results)),
+        failures=str(sum(not r["passed"] for r in results)),
+        time="{:.3f}".format(sum(r["duration"] for r in results)))
+    for r in results:
+        case = ET.SubElement(suite, "testcase", classname="c2rust-refactor",
+                             name=r["name"],
+                             time="{:.3f}".format(r["duration"]))
+        if not r["passed"]:
+            message = r["message"].splitlines()[0]
+            failure = ET.SubElement(case, "failure", message=message)
+            failure.text = r["message"] + "\n" + r["output"]
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Run the c2rust-refactor golden tests.")
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of test cases to run in parallel')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help='seconds that each test case may run')
+    parser.add_argument('--json', metavar='FILE',
+                        help='write the results and durations as JSON')
+    parser.add_argument('--junit', metavar='FILE',
+                        help='write the results as JUnit XML')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help='run every test case, even if neither it nor '
+                             'the refactoring tool changed since its last '
+                             'run')
+    return parser.parse_args()
+
+
+def main() -> None:
     setup_logging()
+    args = _parse_args()
     # NOTE: it seems safe to disable this check since we now
     # that we use a rust-toolchain.toml file for rustc versioning.
     # ensure_rustc_version(c.CUSTOM_RUST_RUSTC_VERSION)
@@ -97,12 +349,24 @@ def main() -> None:
     # ensure_rustfmt_version()
     test_dir = os.path.join(c.RREF_DIR, "tests")
     assert os.path.isdir(test_dir), "test dir missing: " + test_dir
-    refactor_binary = os.path.join(c.ROOT_DIR, "target/debug/c2rust-refactor")
-    if not os.path.isfile(refactor_binary):
-        die("build refactor binary first. expected: " + refactor_binary)
+    if not os.path.isfile(REFACTOR_BIN):
+        die("build refactor binary first. expected: " + REFACTOR_BIN)
+    ensure_dir(c.BUILD_DIR)
 
     testcases = get_testcases(test_dir)
-    run_tests(sorted(testcases))
+    results = run_tests(sorted(testcases), args.jobs, args.timeout,
+                        args.use_cache)
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+    if args.junit:
+        write_junit(args.junit, results)
+
+    failed = [r["name"] for r in results if not r["passed"]]
+    if failed:
+        die("{} of {} test cases failed: {}".format(
+            len(failed), len(results), ", ".join(failed)))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import compile_db
+
+ENTRIES = [
+    {"directory": "/src", "file": "a.c", "arguments": ["cc", "-c", "a.c"]},
+    {"directory": "/src/ü", "file": "b.c", "command": "cc -c b.c"},
+]
+
+
+class StreamTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "compile_commands.json")
+
+    def write(self, text: str) -> None:
+        with open(self.path, "w", encoding="utf-8") as fh:
+            fh.write(text)
+
+    def test_offsets(self) -> None:
+        text = json.dumps(ENTRIES, indent=2, ensure_ascii=False)
+        self.write(text)
+        data = text.encode("utf-8")
+        for chunk_size in (1, 3, 1 << 20):
+            with mock.patch.object(compile_db, "_CHUNK_SIZE", chunk_size):
+                spans = list(compile_db._stream(self.path))
+            self.assertEqual([entry for _, _, entry in spans], ENTRIES)
+            for offset, length, entry in spans:
+                self.assertEqual(json.loads(data[offset:offset + length]),
+                                 entry)
+
+    def test_truncated(self) -> None:
+        text = json.dumps(ENTRIES, ensure_ascii=False)
+        for truncated in ("", "[", "[1", "[1,", text[:len(text) // 2],
+                          text[:-1]):
+            self.write(truncated)
+            for chunk_size in (1, 1 << 20):
+                with self.subTest(text=truncated, chunk_size=chunk_size), \
+                        mock.patch.object(compile_db, "_CHUNK_SIZE",
+                                          chunk_size):
+                    with self.assertRaisesRegex(ValueError, "malformed"):
+                        list(compile_db._stream(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import stat
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import csmith
+
+# Mimics what `c2rust transpile --log-level info` prints for each program of
+# a compile database, and panics on the program named by FAKE_CRASH while
+# exporting its AST or translating it.
+FAKE_TRANSPILER = '''\
+#!{python}
+import json, os, sys
+crash_name, _, crash_phase = os.environ.get("FAKE_CRASH", "").partition(":")
+with open(sys.argv[2]) as fh:
+    entries = json.load(fh)
+for entry in entries:
+    name = os.path.splitext(entry["file"])[0]
+    if (name, "export") == (crash_name, crash_phase):
+        sys.exit("thread 'main' panicked at 'export', src/export.rs:1:1")
+    print("\\x1b[32minfo:\\x1b[0m exported the AST of %s.c in 0.1s" % name,
+          file=sys.stderr, flush=True)
+    print("Transpiling %s.c" % name, flush=True)
+    rs = os.path.join(entry["directory"], name + ".rs")
+    if (name, "translate") == (crash_name, crash_phase):
+        open(rs, "w").write("partial")
+        sys.exit("thread 'main' panicked at 'translate', src/lib.rs:1:1")
+    open(rs, "w").write("fn main() {{}}\\n")
+    print("\\x1b[32minfo:\\x1b[0m translated %s.c in 0.1s" % name,
+          file=sys.stderr, flush=True)
+'''
+
+
+class TranspileBatchTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dirname = tmp.name
+        self.names = ["prog0", "prog1", "prog2", "prog3"]
+        for name in self.names:
+            open(os.path.join(self.dirname, name + ".c"), "w").close()
+
+        transpiler = os.path.join(self.dirname, "fake_c2rust")
+        with open(transpiler, "w") as fh:
+            fh.write(FAKE_TRANSPILER.format(python=sys.executable))
+        os.chmod(transpiler, os.stat(transpiler).st_mode | stat.S_IXUSR)
+        patcher = mock.patch.object(csmith.common.config, "C2RUST_BIN",
+                                    transpiler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def transpile(self, crash: str):
+        failures = {}
+        with mock.patch.dict(os.environ, {"FAKE_CRASH": crash}):
+            translated = csmith.transpile_batch(self.dirname, self.names,
+                                                failures)
+        return translated, failures
+
+    def test_no_crash(self) -> None:
+        translated, failures = self.transpile("")
+        self.assertEqual(translated, self.names)
+        self.assertEqual(failures, {})
+
+    def test_crash_while_exporting(self) -> None:
+        # prog1 was done when prog2's export crashed, before prog2 was named
+        translated, failures = self.transpile("prog2:export")
+        self.assertEqual(translated, ["prog0", "prog1", "prog3"])
+        self.assertEqual(list(failures), ["prog2"])
+        self.assertEqual(failures["prog2"].signature,
+                         "transpile: panic at src/export.rs:1")
+
+    def test_crash_while_translating(self) -> None:
+        # prog1's partial translation must not count as translated
+        translated, failures = self.transpile("prog1:translate")
+        self.assertEqual(translated, ["prog0", "prog2", "prog3"])
+        self.assertEqual(list(failures), ["prog1"])
+        self.assertEqual(failures["prog1"].signature,
+                         "transpile: panic at src/lib.rs:1")
+
+    def test_crash_on_first_program(self) -> None:
+        translated, failures = self.transpile("prog0:export")
+        self.assertEqual(translated, ["prog1", "prog2", "prog3"])
+        self.assertEqual(list(failures), ["prog0"])
+
+
+if __name__ == "__main__":
+    unittest.main()